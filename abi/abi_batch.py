@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Runs several ABI tools in one process, sharing the parsed binaries.
+
+The binaries below each --directory (or listed in each --binaries-from file)
+are discovered once and read once (in parallel). Every --run then invokes one
+of the ABI tools in-process with its usual command line; lookups of those
+binaries are served from memory instead of walking the tree and parsing the
+files again.
+
+For every run, OUT_DIR receives <name>.stdout, <name>.stderr and
+<name>.exit_code, where <name> is the tool name (suffixed with a counter if
+the tool is run more than once). OUT_DIR/report.json summarizes the exit
+codes and the time spent in each phase.
+
+Usage:
+
+  abi_batch --directory DIST_DIR --out-dir OUT_DIR \\
+      --run "extract_symbols --symbol-list OUT_DIR/abi_symbollist DIST_DIR" \\
+      --run "check_buildtime_symbol_protection --abi-symbol-list LIST DIST_DIR"
+"""
+
+import argparse
+import collections
+import contextlib
+import json
+import logging
+import os
+import shlex
+import sys
+import time
+import traceback
+
+import check_buildtime_symbol_protection
+import dependency_graph_extractor
+import extract_gki_protected_exports
+import extract_symbols
+import process_symbols
+import symbol_extraction
+import verify_ksymtab
+
+_TOOLS = {
+    "check_buildtime_symbol_protection": check_buildtime_symbol_protection.main,
+    "dependency_graph_extractor": dependency_graph_extractor.main,
+    "extract_gki_protected_exports": extract_gki_protected_exports.main,
+    "extract_symbols": extract_symbols.main,
+    "process_symbols": process_symbols.main,
+    "verify_ksymtab": verify_ksymtab.main,
+}
+
+
+def _parse_run(value):
+  """Splits a --run value into (tool, argv)."""
+  argv = shlex.split(value)
+  if not argv or argv[0] not in _TOOLS:
+    raise argparse.ArgumentTypeError(
+        f"expected one of {', '.join(sorted(_TOOLS))} followed by its "
+        f"arguments, got {value!r}")
+  return argv[0], argv[1:]
+
+
+def _exit_code(result):
+  """Converts the return value of a main() or a SystemExit code to an int."""
+  if result is None:
+    return 0
+  if isinstance(result, int):
+    return result
+  # sys.exit("message") prints the message and exits with 1.
+  print(result, file=sys.stderr)
+  return 1
+
+
+def run_tool(name, tool, argv, out_dir):
+  """Runs tool(argv) with its output captured in out_dir.
+
+  Returns:
+    The exit code of the tool.
+  """
+  stdout_path = os.path.join(out_dir, f"{name}.stdout")
+  stderr_path = os.path.join(out_dir, f"{name}.stderr")
+  with open(stdout_path, "w") as stdout, open(stderr_path, "w") as stderr:
+    # Tools call logging.basicConfig(), which is a no-op once the root logger
+    # has a handler, possibly pointing at the log of the previous tool.
+    logging.root.handlers.clear()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(
+        stderr):
+      try:
+        exit_code = _exit_code(tool(argv))
+      except SystemExit as e:
+        exit_code = _exit_code(e.code)
+      except Exception:  # pylint: disable=broad-exception-caught
+        traceback.print_exc()
+        exit_code = 1
+    logging.root.handlers.clear()
+  with open(os.path.join(out_dir, f"{name}.exit_code"), "w") as f:
+    f.write(f"{exit_code}\n")
+  return exit_code
+
+
+def discover_binaries(directories, manifests=()):
+  """Lists vmlinux and the kernel modules in directories and manifests."""
+  paths = []
+  for directory in directories:
+    paths.extend(symbol_extraction.list_files(directory))
+  for manifest in manifests:
+    paths.extend(symbol_extraction.read_binaries_manifest(manifest))
+  return [
+      path for path in paths
+      if path.endswith(".ko") or os.path.basename(path) == "vmlinux"
+  ]
+
+
+def main(argv=None):
+  """Runs the requested ABI tools on a shared set of binaries."""
+  parser = argparse.ArgumentParser(
+      description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument(
+      "--directory",
+      action="append",
+      default=[],
+      help="A directory with kernel binaries to read ahead of the runs. Can "
+      "be passed multiple times.")
+  parser.add_argument(
+      "--binaries-from",
+      metavar="FILE",
+      action="append",
+      default=[],
+      help="A file listing kernel binaries to read ahead of the runs, "
+      "separated by newlines or NUL characters. Can be passed multiple times.")
+  parser.add_argument(
+      "--out-dir",
+      required=True,
+      help="Where to put the output, exit code and timing of every run")
+  parser.add_argument(
+      "--run",
+      action="append",
+      type=_parse_run,
+      required=True,
+      help="A tool and its arguments, as one shell-quoted string. Can be "
+      "passed multiple times.")
+  parser.add_argument(
+      "--jobs", "-j",
+      type=int,
+      default=os.cpu_count() or 1,
+      help="Number of binaries to read in parallel (default: %(default)s)")
+  args = parser.parse_args(argv)
+  if not args.directory and not args.binaries_from:
+    parser.error("at least one of --directory or --binaries-from is required")
+
+  os.makedirs(args.out_dir, exist_ok=True)
+  phases = []
+
+  def phase(name, start, **extra):
+    seconds = time.monotonic() - start
+    phases.append(dict(name=name, seconds=round(seconds, 3), **extra))
+    print(f"abi_batch: {name}: {seconds:.2f}s", file=sys.stderr)
+
+  start = time.monotonic()
+  binaries = discover_binaries(args.directory, args.binaries_from)
+  phase("discovery", start, binaries=len(binaries))
+
+  start = time.monotonic()
+  profiles = symbol_extraction.read_module_profiles(binaries, args.jobs)
+  symbol_extraction.preload_profiles(profiles.values())
+  phase("extraction", start)
+
+  counts = collections.Counter(tool for tool, _ in args.run)
+  seen = collections.Counter()
+  failed = False
+  for tool, tool_argv in args.run:
+    seen[tool] += 1
+    name = tool if counts[tool] == 1 else f"{tool}.{seen[tool]}"
+    start = time.monotonic()
+    exit_code = run_tool(name, _TOOLS[tool], tool_argv, args.out_dir)
+    phase(name, start, tool=tool, argv=tool_argv, exit_code=exit_code)
+    if exit_code:
+      failed = True
+      print(
+          f"abi_batch: {name} failed with exit code {exit_code}, see "
+          f"{os.path.join(args.out_dir, name)}.stderr",
+          file=sys.stderr)
+
+  with open(os.path.join(args.out_dir, "report.json"), "w") as f:
+    json.dump({"phases": phases}, f, indent=2)
+    f.write("\n")
+
+  return 1 if failed else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,154 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import gc
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+import warnings
+
+from absl.testing import absltest
+import abi_batch
+import check_buildtime_symbol_protection
+import extract_symbols
+import symbol_extraction
+import synthetic_corpus
+
+
+class AbiBatchTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.dist = os.path.join(self.tmp, "dist")
+    os.makedirs(self.dist)
+    self.out = os.path.join(self.tmp, "out")
+    self.addCleanup(symbol_extraction._preloaded.clear)
+    self.symvers = self._write(
+        "Module.symvers",
+        "0x0\tfoo\tvmlinux\tEXPORT_SYMBOL\t\n"
+        "0x0\tbar\tvmlinux\tEXPORT_SYMBOL_GPL\t\n")
+
+  def _write(self, name, content):
+    path = os.path.join(self.tmp, name)
+    with open(path, "w") as f:
+      f.write(content)
+    return path
+
+  def _read(self, name):
+    with open(os.path.join(self.out, name)) as f:
+      return f.read()
+
+  def _verify(self, symbol_list):
+    return (f"verify_ksymtab --raw-kmi-symbol-list {symbol_list} "
+            f"--symvers-file {self.symvers}")
+
+  def test_runs(self):
+    good = self._write("good", "[abi_symbol_list]\n  foo\n  bar\n")
+    bad = self._write("bad", "[abi_symbol_list]\n  baz\n")
+    exit_code = abi_batch.main([
+        "--directory", self.dist, "--out-dir", self.out, "--jobs", "1",
+        "--run", self._verify(good), "--run", self._verify(bad)
+    ])
+    self.assertEqual(exit_code, 1)
+    self.assertEqual(self._read("verify_ksymtab.1.exit_code"), "0\n")
+    self.assertEqual(self._read("verify_ksymtab.2.exit_code"), "1\n")
+    self.assertIn("baz", self._read("verify_ksymtab.2.stderr"))
+
+    report = json.loads(self._read("report.json"))
+    self.assertEqual([phase["name"] for phase in report["phases"]], [
+        "discovery", "extraction", "verify_ksymtab.1", "verify_ksymtab.2"
+    ])
+    self.assertEqual(report["phases"][3]["exit_code"], 1)
+
+  def _standalone(self, tool, argv):
+    """Runs tool(argv) on its own, returns (exit code, stdout, stderr)."""
+    symbol_extraction._preloaded.clear()
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(
+        stderr):
+      exit_code = abi_batch._exit_code(tool(argv))
+    return exit_code, stdout.getvalue(), stderr.getvalue()
+
+  def test_matches_standalone_runs(self):
+    # Resources left open would warn on the stderr of only some runs,
+    # depending on when they are collected and on the test runner.
+    with warnings.catch_warnings(record=True) as caught:
+      warnings.simplefilter("always", ResourceWarning)
+      self._test_matches_standalone_runs()
+      gc.collect()
+    self.assertEqual([str(warning.message) for warning in caught], [])
+
+  def _test_matches_standalone_runs(self):
+    corpus = synthetic_corpus.generate(
+        self.dist, 12, vmlinux_exports=200, signed_fraction=0.5)
+    # Leave out a symbol, so that the check reports it.
+    kmi = self._write(
+        "kmi", "[abi_symbol_list]\n" +
+        "".join(f"  {symbol}\n" for symbol in corpus.vendor_symbols[1:]))
+    runs = [
+        ("extract_symbols", f"--print-modules --jobs 1 {self.dist}"),
+        ("check_buildtime_symbol_protection",
+         f"--abi-symbol-list {kmi} --print-unsigned-modules {self.dist}"),
+    ]
+    expected = {
+        tool: self._standalone(abi_batch._TOOLS[tool], argv.split())
+        for tool, argv in runs
+    }
+    self.assertEqual(expected["check_buildtime_symbol_protection"][0], 1)
+
+    binaries = len(corpus.modules) + 1
+    with mock.patch.object(
+        symbol_extraction,
+        "_read_module_profile",
+        wraps=symbol_extraction._read_module_profile) as read:
+      abi_batch.main([
+          "--directory", self.dist, "--out-dir", self.out, "--jobs", "1"
+      ] + [arg for tool, argv in runs for arg in ("--run", f"{tool} {argv}")])
+    # Every binary is read once, ahead of the runs.
+    self.assertEqual(read.call_count, binaries)
+
+    for tool, _ in runs:
+      exit_code, stdout, stderr = expected[tool]
+      self.assertEqual(self._read(f"{tool}.exit_code"), f"{exit_code}\n")
+      self.assertEqual(self._read(f"{tool}.stdout"), stdout)
+      self.assertEqual(self._read(f"{tool}.stderr"), stderr)
+    self.assertIn("[abi_symbol_list]", self._read("extract_symbols.stdout"))
+    self.assertIn(corpus.vendor_symbols[0],
+                  self._read("check_buildtime_symbol_protection.stderr"))
+
+  def test_bad_arguments(self):
+    exit_code = abi_batch.main([
+        "--directory", self.dist, "--out-dir", self.out, "--run",
+        "verify_ksymtab --no-such-flag"
+    ])
+    self.assertEqual(exit_code, 1)
+    self.assertEqual(self._read("verify_ksymtab.exit_code"), "2\n")
+    self.assertIn("error:", self._read("verify_ksymtab.stderr"))
+
+  def test_unknown_tool(self):
+    with self.assertRaises(SystemExit):
+      abi_batch.main([
+          "--directory", self.dist, "--out-dir", self.out, "--run", "rm -rf"
+      ])
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Measures how the ABI tools scale with the number of kernel modules.
+
+For every module count, a synthetic corpus (see synthetic_corpus.py) is
+generated and every tool is run on it in a fresh Python process. For every
+run, the wall time, the number of subprocesses and worker processes started
+and the peak RSS of the largest process are reported.
+
+Usage:
+
+  benchmark_abi_tools --modules 10,100,1000 --json results.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic_corpus
+
+TOOLS = (
+    "extract_symbols",
+    "check_buildtime_symbol_protection",
+    "dependency_graph_extractor",
+)
+
+# Runs a tool in a child process, counting the processes it starts (also from
+# its worker processes, through an inherited O_APPEND file).
+_RUNNER = """
+import importlib
+import json
+import multiprocessing.process
+import os
+import resource
+import subprocess
+import sys
+
+tool, stats_file, counter_file, argv = (
+    sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4:])
+counter = os.open(counter_file, os.O_WRONLY | os.O_APPEND)
+
+popen_init = subprocess.Popen.__init__
+def counting_init(self, *args, **kwargs):
+  os.write(counter, b"s")
+  popen_init(self, *args, **kwargs)
+subprocess.Popen.__init__ = counting_init
+
+process_start = multiprocessing.process.BaseProcess.start
+def counting_start(self):
+  os.write(counter, b"w")
+  process_start(self)
+multiprocessing.process.BaseProcess.start = counting_start
+
+try:
+  exit_code = importlib.import_module(tool).main(argv) or 0
+except SystemExit as e:
+  exit_code = e.code
+with open(stats_file, "w") as f:
+  json.dump({
+      "exit_code": exit_code,
+      "peak_rss_kb": max(
+          resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+          resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+  }, f)
+"""
+
+
+def _tool_argv(tool, corpus_dir, out_dir, symbol_list, jobs):
+  """Returns the command line of tool for a corpus."""
+  if tool == "extract_symbols":
+    return ["--symbol-list", os.path.join(out_dir, "abi_symbollist"),
+            "--jobs", str(jobs), corpus_dir]
+  if tool == "check_buildtime_symbol_protection":
+    return ["--abi-symbol-list", symbol_list, corpus_dir]
+  if tool == "dependency_graph_extractor":
+    return [corpus_dir, os.path.join(out_dir, "dependency_graph.json")]
+  raise ValueError(f"unknown tool {tool}")
+
+
+def run_tool(tool, argv, work_dir):
+  """Runs tool(argv) in a new process.
+
+  Returns:
+    A dict with the wall time, the number of subprocesses and worker
+    processes started, the peak RSS and the exit code of the run. The peak
+    RSS is None if the process failed before reporting it.
+  """
+  stats_file = os.path.join(work_dir, f"{tool}.stats")
+  counter_file = os.path.join(work_dir, f"{tool}.processes")
+  open(counter_file, "w").close()
+  if os.path.exists(stats_file):
+    os.remove(stats_file)
+  env = dict(os.environ)
+  abi_dir = os.path.dirname(os.path.abspath(__file__))
+  env["PYTHONPATH"] = os.pathsep.join(
+      filter(None, [abi_dir, env.get("PYTHONPATH")]))
+  start = time.monotonic()
+  child = subprocess.run(
+      [sys.executable, "-c", _RUNNER, tool, stats_file, counter_file] + argv,
+      env=env,
+      stdout=subprocess.DEVNULL,
+      check=False)
+  seconds = time.monotonic() - start
+  try:
+    with open(stats_file) as f:
+      stats = json.load(f)
+  except (OSError, ValueError):
+    # e.g. the tool raised an exception, the traceback is on stderr.
+    stats = {"exit_code": child.returncode or 1, "peak_rss_kb": None}
+  if not stats["exit_code"] and child.returncode:
+    stats["exit_code"] = child.returncode
+  if stats["exit_code"]:
+    print(f"benchmark_abi_tools: {tool} failed with exit code "
+          f"{stats['exit_code']}",
+          file=sys.stderr)
+  with open(counter_file, "rb") as f:
+    processes = f.read()
+  return {
+      "tool": tool,
+      "seconds": round(seconds, 3),
+      "subprocesses": processes.count(b"s"),
+      "worker_processes": processes.count(b"w"),
+      "peak_rss_kb": stats["peak_rss_kb"],
+      "exit_code": stats["exit_code"],
+  }
+
+
+def benchmark(module_counts, tools=TOOLS, work_dir=None, jobs=None,
+              **corpus_args):
+  """Runs every tool on a corpus of every size.
+
+  Args:
+    module_counts: The numbers of modules to benchmark.
+    tools: The tools to run.
+    work_dir: Where to put the corpora; a temporary directory if None.
+    jobs: --jobs of the tools supporting it, defaults to the CPU count.
+    **corpus_args: Passed to synthetic_corpus.generate().
+
+  Returns:
+    One dict per run, see run_tool(), with the number of modules added.
+  """
+  jobs = jobs or os.cpu_count() or 1
+  temporary = work_dir is None
+  if temporary:
+    work_dir = tempfile.mkdtemp(prefix="benchmark_abi_tools")
+  results = []
+  try:
+    for count in module_counts:
+      corpus_dir = os.path.join(work_dir, f"{count}_modules", "dist")
+      out_dir = os.path.join(work_dir, f"{count}_modules", "out")
+      os.makedirs(out_dir, exist_ok=True)
+      corpus = synthetic_corpus.generate(corpus_dir, count, **corpus_args)
+      symbol_list = os.path.join(out_dir, "vendor_symbol_list")
+      with open(symbol_list, "w") as f:
+        f.write("[abi_symbol_list]\n")
+        f.writelines(f"  {symbol}\n" for symbol in corpus.vendor_symbols)
+      for tool in tools:
+        argv = _tool_argv(tool, corpus_dir, out_dir, symbol_list, jobs)
+        result = run_tool(tool, argv, out_dir)
+        result["modules"] = count
+        results.append(result)
+  finally:
+    if temporary:
+      shutil.rmtree(work_dir)
+  return results
+
+
+def main(argv=None):
+  """Benchmarks the ABI tools on synthetic corpora."""
+  parser = argparse.ArgumentParser(
+      description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument(
+      "--modules",
+      default="10,100,1000",
+      help="Comma separated numbers of modules (default: %(default)s)")
+  parser.add_argument(
+      "--tool",
+      action="append",
+      dest="tools",
+      choices=TOOLS,
+      help="Tool to benchmark. Can be passed multiple times (default: all)")
+  parser.add_argument(
+      "--jobs", "-j",
+      type=int,
+      help="--jobs of the tools supporting it (default: the CPU count)")
+  parser.add_argument(
+      "--work-dir",
+      help="Keep the corpora and outputs in this directory")
+  parser.add_argument(
+      "--json",
+      help="Also write the results to this file")
+  args = parser.parse_args(argv)
+
+  results = benchmark(
+      [int(count) for count in args.modules.split(",")],
+      tools=args.tools or TOOLS,
+      work_dir=args.work_dir,
+      jobs=args.jobs)
+
+  print(f"{'tool':<36}{'modules':>8}{'seconds':>10}{'subprocs':>10}"
+        f"{'workers':>9}{'peak RSS MiB':>14}")
+  for result in results:
+    peak_rss = result["peak_rss_kb"]
+    peak_rss = "-" if peak_rss is None else f"{peak_rss / 1024:.1f}"
+    print(f"{result['tool']:<36}{result['modules']:>8}"
+          f"{result['seconds']:>10.2f}{result['subprocesses']:>10}"
+          f"{result['worker_processes']:>9}{peak_rss:>14}")
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(results, f, indent=2)
+      f.write("\n")
+  return 1 if any(result["exit_code"] for result in results) else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -27,19 +27,18 @@ warning at the build time to avoid a testing iteration.
 Usage:
 
    check_buildtime_symbol_protection --abi-symbol-list ABI_SYMBOL_LIST
-   [directory]
+   [--binaries-from FILE] [directory]
 """
 import argparse
 import itertools
 import os
 import pathlib
-import subprocess
 import sys
 
 import symbol_extraction
 
 
-def main():
+def main(argv=None):
   """Ensure undefined symbols in unsigned modules are accounted for.
 
   For a given directory and a given symbol list, locate all unsigned modules
@@ -65,47 +64,58 @@ def main():
       action="store_true",
       help="Emit the names of the processed unsigned modules")
 
-  args = parser.parse_args()
+  parser.add_argument(
+      "--binaries-from",
+      metavar="FILE",
+      help="Read the paths of the modules from FILE (separated by newlines "
+      "or NUL characters) instead of searching the directory")
+
+  args = parser.parse_args(argv)
 
-  if not os.path.isdir(args.directory):
+  if args.binaries_from:
+    binaries = symbol_extraction.read_binaries_manifest(args.binaries_from)
+  elif not os.path.isdir(args.directory):
     print(
         f"Expected a directory to search for unsigned modules, but got {args.directory}",
         file=sys.stderr,
     )
     return 1
+  else:
+    binaries = symbol_extraction.list_files(args.directory)
 
-  modules = pathlib.Path(args.directory).glob("**/*.ko")
+  modules = [pathlib.Path(path) for path in binaries if path.endswith(".ko")]
+
+  # Read signature, imports and exports of every module at once
+  profiles = [
+      symbol_extraction.read_module_profile(module) for module in modules
+  ]
 
   # Find unsigned modules
-  unsigned_modules = [
-      module for module in modules
-      if not symbol_extraction.is_signature_present(module)
+  unsigned_profiles = [
+      profile for profile in profiles if not profile.is_signed
   ]
 
   if args.print_unsigned_modules:
     print(
         "These modules have been checked for GKI protected symbol violations:")
-    for module in sorted(unsigned_modules):
-      print(f" {os.path.basename(module)}")
+    for profile in sorted(unsigned_profiles, key=lambda p: p.path):
+      print(f" {os.path.basename(profile.path)}")
 
   # Find all undefined symbols from unsigned modules
   undefined_symbol_consumer_lookup = {}
   undefined_symbols = []
-  for module in unsigned_modules:
-    module_undefined_symbols = symbol_extraction.extract_undefined_symbols(
-        module
-    )
-    undefined_symbols.extend(module_undefined_symbols)
-    for symbol in module_undefined_symbols:
+  for profile in unsigned_profiles:
+    module_name = os.path.basename(profile.path)
+    undefined_symbols.extend(profile.undefined_symbols)
+    for symbol in profile.undefined_symbols:
       if symbol in undefined_symbol_consumer_lookup:
-        undefined_symbol_consumer_lookup[symbol].append(module.name)
+        undefined_symbol_consumer_lookup[symbol].append(module_name)
       else:
-        undefined_symbol_consumer_lookup[symbol] = [module.name]
+        undefined_symbol_consumer_lookup[symbol] = [module_name]
 
   # Find all defined symbols from unsigned modules
   defined_symbols = itertools.chain.from_iterable(
-      symbol_extraction.extract_exported_symbols(module)
-      for module in unsigned_modules)
+      profile.exported_symbols for profile in unsigned_profiles)
 
   # Read ABI symbols in a list
   abi_symbols = symbol_extraction.read_symbol_list(args.abi_symbol_list)
@@ -0,0 +1,73 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from absl.testing import absltest
+import check_buildtime_symbol_protection
+import synthetic_corpus
+
+
+class CheckBuildtimeSymbolProtectionTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.dist = os.path.join(self.tmp, "dist")
+    self.corpus = synthetic_corpus.generate(
+        self.dist, 6, vmlinux_exports=50, signed_fraction=0.5)
+
+  def _write(self, name, content):
+    path = os.path.join(self.tmp, name)
+    with open(path, "w") as f:
+      f.write(content)
+    return path
+
+  def _symbol_list(self, symbols):
+    return self._write(
+        "kmi", "[abi_symbol_list]\n" + "".join(f"  {s}\n" for s in symbols))
+
+  def _check(self, symbol_list, *args):
+    return check_buildtime_symbol_protection.main(
+        ["--abi-symbol-list", symbol_list, *args])
+
+  def test_directory(self):
+    self.assertEqual(
+        self._check(self._symbol_list(self.corpus.vendor_symbols), self.dist),
+        0)
+    self.assertEqual(
+        self._check(self._symbol_list(self.corpus.vendor_symbols[1:]),
+                    self.dist), 1)
+
+  def test_binaries_from(self):
+    manifest = self._write("binaries", "\n".join(self.corpus.modules) + "\n")
+    empty_dir = os.path.join(self.tmp, "empty")
+    os.makedirs(empty_dir)
+    self.assertEqual(
+        self._check(self._symbol_list(self.corpus.vendor_symbols[1:]),
+                    "--binaries-from", manifest, empty_dir), 1)
+
+  def test_no_modules(self):
+    # e.g. the modules staging archive of a kernel_build without modules.
+    manifest = self._write("binaries", "")
+    self.assertEqual(
+        self._check(self._symbol_list([]), "--binaries-from", manifest,
+                    self.dist), 0)
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Analysis of the graphs created by dependency_graph_extractor.
+
+The adjacency list written by the extractor is keyed on string ids and maps
+every binary to its dependents. DependencyGraph loads it into integer indexed
+arrays in compressed sparse row (CSR) form: the dependents of node i are
+targets[offsets[i]:offsets[i + 1]]. The reverse graph (the dependencies of
+every node) is built the same way on first use.
+
+Edges point from the binary exporting a symbol to the binary using it, so a
+topological order is a valid load order. Sets of nodes, e.g. the transitive
+closure of a node, are represented as Python integers used as bitsets.
+"""
+
+import array
+import json
+import pathlib
+from typing import Iterable, Sequence
+
+
+def _csr(
+    node_count: int, edges: Iterable[tuple[int, int]]
+) -> tuple[array.array, array.array]:
+    """Builds the (offsets, targets) arrays of a graph with sorted targets."""
+    buckets = [[] for _ in range(node_count)]
+    for source, target in edges:
+        buckets[source].append(target)
+    offsets = array.array("l", [0])
+    targets = array.array("l")
+    for bucket in buckets:
+        targets.extend(sorted(set(bucket)))
+        offsets.append(len(targets))
+    return offsets, targets
+
+
+class DependencyGraph:
+    """An immutable dependency graph between kernel binaries."""
+
+    def __init__(self, names: Sequence[str], edges: Iterable[tuple[int, int]]):
+        """Creates a graph.
+
+        Args:
+            names: The name of every node, e.g. "vmlinux" or "foo.ko".
+            edges: (exporter, dependent) pairs of node indices. Duplicates
+                are ignored.
+        """
+        self.names = list(names)
+        self._index = {name: i for i, name in enumerate(self.names)}
+        self._offsets, self._targets = _csr(len(self.names), edges)
+        self._reverse = None
+        self._components = None
+
+    @classmethod
+    def from_adjacency_list(cls, adjacency_list: dict) -> "DependencyGraph":
+        """Creates a graph from the output of dependency_graph_extractor."""
+        ids = {key: i for i, key in enumerate(adjacency_list)}
+        names = [node["name"] for node in adjacency_list.values()]
+        edges = [
+            (ids[key], ids[dependent])
+            for key, node in adjacency_list.items()
+            for dependent in node["dependents"]
+            if dependent in ids
+        ]
+        return cls(names, edges)
+
+    @classmethod
+    def load(cls, path: pathlib.Path | str) -> "DependencyGraph":
+        """Loads the adjacency list written by dependency_graph_extractor."""
+        with open(path, encoding="utf-8") as f:
+            return cls.from_adjacency_list(json.load(f))
+
+    def to_adjacency_list(self) -> dict:
+        """Returns the graph in the format of dependency_graph_extractor."""
+        return {
+            str(i): {
+                "name": name,
+                "dependents": [str(j) for j in self.dependents(i)],
+            }
+            for i, name in enumerate(self.names)
+        }
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def edge_count(self) -> int:
+        return len(self._targets)
+
+    def edges(self) -> Iterable[tuple[int, int]]:
+        """Yields every (exporter, dependent) pair."""
+        for source in range(len(self.names)):
+            for target in self.dependents(source):
+                yield source, target
+
+    def index(self, name: str) -> int:
+        """Returns the index of the node called name.
+
+        Raises:
+            KeyError: if there is no such node.
+        """
+        return self._index[name]
+
+    def dependents(self, node: int) -> Sequence[int]:
+        """Returns the nodes using symbols exported by node."""
+        return self._targets[self._offsets[node]:self._offsets[node + 1]]
+
+    def dependencies(self, node: int) -> Sequence[int]:
+        """Returns the nodes exporting symbols used by node."""
+        if self._reverse is None:
+            self._reverse = _csr(
+                len(self.names),
+                ((target, source) for source, target in self.edges()))
+        offsets, targets = self._reverse
+        return targets[offsets[node]:offsets[node + 1]]
+
+    def strongly_connected_components(self) -> list[list[int]]:
+        """Returns the strongly connected components in topological order.
+
+        Every node belongs to exactly one component; nodes that are not part
+        of a cycle form a component of their own. Components are sorted so
+        that exporters come before their dependents.
+        """
+        if self._components is not None:
+            return self._components
+        # Iterative version of Tarjan's algorithm, which finds the components
+        # in reverse topological order.
+        node_count = len(self.names)
+        index = [-1] * node_count
+        lowlink = [0] * node_count
+        on_stack = [False] * node_count
+        stack = []
+        components = []
+        counter = 0
+        for root in range(node_count):
+            if index[root] != -1:
+                continue
+            work = [(root, 0)]
+            while work:
+                node, edge = work.pop()
+                if edge == 0:
+                    index[node] = lowlink[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack[node] = True
+                neighbors = self.dependents(node)
+                if edge > 0:
+                    lowlink[node] = min(lowlink[node],
+                                        lowlink[neighbors[edge - 1]])
+                while edge < len(neighbors):
+                    neighbor = neighbors[edge]
+                    if index[neighbor] == -1:
+                        break
+                    if on_stack[neighbor]:
+                        lowlink[node] = min(lowlink[node], index[neighbor])
+                    edge += 1
+                if edge < len(neighbors):
+                    # Visit the neighbor, then resume with the next edge.
+                    work.append((node, edge + 1))
+                    work.append((neighbors[edge], 0))
+                    continue
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+        components.reverse()
+        self._components = components
+        return components
+
+    def cycles(self) -> list[list[int]]:
+        """Returns the components with more than one node, or a self loop."""
+        return [
+            component for component in self.strongly_connected_components()
+            if len(component) > 1 or component[0] in self.dependents(
+                component[0])
+        ]
+
+    def topological_order(self) -> list[int]:
+        """Returns the nodes ordered so that exporters come first.
+
+        This is a valid load order for the modules.
+
+        Raises:
+            ValueError: if the graph has cycles.
+        """
+        cycles = self.cycles()
+        if cycles:
+            raise ValueError("Dependency cycle between " + ", ".join(
+                self.names[i] for i in cycles[0]))
+        return [
+            component[0]
+            for component in self.strongly_connected_components()
+        ]
+
+    def _condensation(self) -> tuple[list[int], list[list[int]]]:
+        """Returns (component of every node, components in topo order)."""
+        components = self.strongly_connected_components()
+        component_of = [0] * len(self.names)
+        for c, component in enumerate(components):
+            for node in component:
+                component_of[node] = c
+        return component_of, components
+
+    def _component_reachability(
+        self, reverse: bool
+    ) -> tuple[list[int], list[int], list[int]]:
+        """Computes what every component reaches through at least one edge.
+
+        Edges are followed towards the dependents, or towards the
+        dependencies if reverse is set.
+
+        Returns:
+            (component of every node, bitset of the reachable components of
+            every component, bitset of the reachable nodes of every
+            component). A component only reaches itself if it is a cycle.
+        """
+        component_of, components = self._condensation()
+        neighbors = self.dependencies if reverse else self.dependents
+        reachable_components = [0] * len(components)
+        reachable_nodes = [0] * len(components)
+        # Process components so that their neighbors are done first.
+        order = range(len(components))
+        if not reverse:
+            order = reversed(order)
+        for c in order:
+            component_bits = node_bits = 0
+            for node in components[c]:
+                for neighbor in neighbors(node):
+                    d = component_of[neighbor]
+                    if d == c:
+                        # Every node of a cycle reaches all of its nodes.
+                        component_bits |= 1 << c
+                        node_bits |= sum(1 << n for n in components[c])
+                    elif not component_bits >> d & 1:
+                        component_bits |= 1 << d | reachable_components[d]
+                        node_bits |= reachable_nodes[d]
+                        for member in components[d]:
+                            node_bits |= 1 << member
+            reachable_components[c] = component_bits
+            reachable_nodes[c] = node_bits
+        return component_of, reachable_components, reachable_nodes
+
+    def transitive_closure(
+        self, nodes: Iterable[int], dependents: bool = False
+    ) -> list[int]:
+        """Returns every node reachable from nodes, excluding nodes themselves.
+
+        Args:
+            nodes: The starting nodes.
+            dependents: If set, return the transitive dependents instead of
+                the transitive dependencies.
+        """
+        nodes = list(nodes)
+        neighbors = self.dependents if dependents else self.dependencies
+        seen = set(nodes)
+        pending = list(nodes)
+        result = set()
+        while pending:
+            node = pending.pop()
+            for neighbor in neighbors(node):
+                result.add(neighbor)
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    pending.append(neighbor)
+        return sorted(result.difference(nodes))
+
+    def reachability(self, dependents: bool = False) -> list[int]:
+        """Returns the transitive closure of every node as a bitset.
+
+        Bit j of the i-th value is set if node j is a transitive dependency
+        (or dependent, if dependents is set) of node i.
+        """
+        component_of, _, reachable = self._component_reachability(
+            reverse=not dependents)
+        return [reachable[component_of[i]] for i in range(len(self.names))]
+
+    def transitive_reduction(self) -> "DependencyGraph":
+        """Returns the graph without edges implied by other paths.
+
+        An edge u -> v is dropped if v is also reachable from u through
+        another dependent of u. The reduction of a cyclic graph is not
+        unique: edges within a cycle are kept as they are and only the first
+        edge between two components is kept.
+        """
+        component_of, reachable, _ = self._component_reachability(
+            reverse=False)
+        edges = []
+        for c, component in enumerate(self.strongly_connected_components()):
+            # Components reachable from c in two or more steps.
+            indirect = 0
+            for node in component:
+                for target in self.dependents(node):
+                    d = component_of[target]
+                    if d != c:
+                        # A cycle reaches itself, which does not make the
+                        # edge to it redundant.
+                        indirect |= reachable[d] & ~(1 << d)
+            seen = 0
+            for node in component:
+                for target in self.dependents(node):
+                    d = component_of[target]
+                    if d == c:
+                        edges.append((node, target))
+                    elif not (indirect | seen) >> d & 1:
+                        seen |= 1 << d
+                        edges.append((node, target))
+        return DependencyGraph(self.names, edges)
+
+    def depths(self) -> list[int]:
+        """Returns the length of the longest dependency chain of every node.
+
+        Nodes without dependencies (e.g. vmlinux) have depth 0. The members
+        of a cycle share the same depth.
+        """
+        component_of, components = self._condensation()
+        component_depth = [0] * len(components)
+        for c, component in enumerate(components):
+            for node in component:
+                for dependency in self.dependencies(node):
+                    d = component_of[dependency]
+                    if d != c:
+                        component_depth[c] = max(component_depth[c],
+                                                 component_depth[d] + 1)
+        return [component_depth[component_of[i]] for i in range(len(self))]
+
+    def critical_path(self) -> list[int]:
+        """Returns one of the longest dependency chains, exporters first."""
+        if not self.names:
+            return []
+        depths = self.depths()
+        node = max(range(len(self.names)), key=lambda i: (depths[i], -i))
+        path = [node]
+        while depths[node] > 0:
+            node = min(
+                (d for d in self.dependencies(node)
+                 if depths[d] == depths[node] - 1),
+                default=None,
+            )
+            if node is None:
+                break
+            path.append(node)
+        path.reverse()
+        return path
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Answers queries about a graph created by dependency_graph_extractor.
+
+Examples:
+
+  # Modules needed (transitively) by foo.ko, or using it.
+  dependency_graph_analyzer graph.json closure foo.ko
+  dependency_graph_analyzer graph.json closure --dependents foo.ko
+
+  # A load order, the dependency cycles and the longest dependency chains.
+  dependency_graph_analyzer graph.json order
+  dependency_graph_analyzer graph.json cycles
+  dependency_graph_analyzer graph.json depth --top 10
+  dependency_graph_analyzer graph.json critical-path
+
+  # The graph without the edges implied by other paths.
+  dependency_graph_analyzer graph.json reduce reduced.json
+"""
+
+import argparse
+import json
+import logging
+import pathlib
+import sys
+
+import dependency_graph
+
+
+def _closure(graph: dependency_graph.DependencyGraph, args) -> int:
+    try:
+        nodes = [graph.index(name) for name in args.modules]
+    except KeyError as e:
+        logging.error("Unknown module %s", e)
+        return 1
+    for node in graph.transitive_closure(nodes, dependents=args.dependents):
+        print(graph.names[node])
+    return 0
+
+
+def _order(graph: dependency_graph.DependencyGraph, args) -> int:
+    del args  # Unused.
+    try:
+        order = graph.topological_order()
+    except ValueError as e:
+        logging.error("%s", e)
+        return 1
+    for node in order:
+        print(graph.names[node])
+    return 0
+
+
+def _cycles(graph: dependency_graph.DependencyGraph, args) -> int:
+    del args  # Unused.
+    for cycle in graph.cycles():
+        print(" ".join(graph.names[node] for node in cycle))
+    return 0
+
+
+def _depth(graph: dependency_graph.DependencyGraph, args) -> int:
+    depths = graph.depths()
+    nodes = sorted(range(len(graph)), key=lambda i: (-depths[i], graph.names[i]))
+    if args.top:
+        nodes = nodes[:args.top]
+    for node in nodes:
+        print(f"{depths[node]}\t{graph.names[node]}")
+    return 0
+
+
+def _critical_path(graph: dependency_graph.DependencyGraph, args) -> int:
+    del args  # Unused.
+    for node in graph.critical_path():
+        print(graph.names[node])
+    return 0
+
+
+def _reduce(graph: dependency_graph.DependencyGraph, args) -> int:
+    reduced = graph.transitive_reduction()
+    logging.info("Kept %d of %d edges", reduced.edge_count(),
+                 graph.edge_count())
+    args.output.write_text(
+        json.dumps(reduced.to_adjacency_list()), encoding="utf-8")
+    return 0
+
+
+def main(argv=None):
+    """Loads the graph and answers a single query about it."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "adjacency_list",
+        type=pathlib.Path,
+        help="File with a graph created by dependency_graph_extractor.",
+    )
+    subparsers = parser.add_subparsers(dest="query", required=True)
+
+    closure = subparsers.add_parser(
+        "closure", help="Lists the transitive dependencies of modules.")
+    closure.add_argument("modules", nargs="+", help="Names of the modules")
+    closure.add_argument(
+        "--dependents",
+        action="store_true",
+        help="List the transitive dependents instead.",
+    )
+    closure.set_defaults(func=_closure)
+
+    subparsers.add_parser(
+        "order", help="Lists the binaries in a valid load order."
+    ).set_defaults(func=_order)
+
+    subparsers.add_parser(
+        "cycles", help="Lists the groups of modules depending on each other."
+    ).set_defaults(func=_cycles)
+
+    depth = subparsers.add_parser(
+        "depth",
+        help="Lists the length of the longest dependency chain of modules.")
+    depth.add_argument(
+        "--top", type=int, help="Only list the N deepest modules.")
+    depth.set_defaults(func=_depth)
+
+    subparsers.add_parser(
+        "critical-path", help="Lists one of the longest dependency chains."
+    ).set_defaults(func=_critical_path)
+
+    reduce = subparsers.add_parser(
+        "reduce",
+        help="Writes the transitive reduction in the same format as the input.")
+    reduce.add_argument(
+        "output", type=pathlib.Path, help="Where to store the output")
+    reduce.set_defaults(func=_reduce)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)s: %(message)s")
+    graph = dependency_graph.DependencyGraph.load(args.adjacency_list)
+    return args.func(graph, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
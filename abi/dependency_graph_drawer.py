@@ -16,45 +16,150 @@
 """Utility function to create a visualization graph using dot language."""
 
 import argparse
+import collections
 import hashlib
 import json
 import logging
 import pathlib
+import posixpath
 import sys
 
+import dependency_graph
+
+
+def _cluster(node: dict, depth: int) -> str:
+    """Returns the directory of a node, limited to depth components."""
+    directory = posixpath.dirname(node.get("path", ""))
+    if depth:
+        directory = "/".join(directory.split("/")[:depth])
+    return directory
+
+
+def _collapse(
+    graph: dependency_graph.DependencyGraph,
+    clusters: list[str],
+) -> tuple[dependency_graph.DependencyGraph, list[str]]:
+    """Replaces the nodes of every cluster by a single node."""
+    names = []
+    index = {}
+    node_to_collapsed = []
+    for name, cluster in zip(graph.names, clusters):
+        key = cluster or name
+        if key not in index:
+            index[key] = len(names)
+            names.append(key + "/" if cluster else name)
+        node_to_collapsed.append(index[key])
+    edges = [
+        (node_to_collapsed[a], node_to_collapsed[b])
+        for a, b in graph.edges()
+        if node_to_collapsed[a] != node_to_collapsed[b]
+    ]
+    return dependency_graph.DependencyGraph(names, edges), [""] * len(names)
+
+
+def _limit_edges(
+    graph: dependency_graph.DependencyGraph,
+    edges: list[tuple[int, int]],
+    max_edges: int,
+) -> list[tuple[int, int]]:
+    """Keeps at most max_edges edges, favoring the longest chains.
+
+    Every node first keeps the edge from its deepest dependency, so the
+    longest dependency chains stay visible. The remaining budget goes to the
+    edges between nodes of the closest depths.
+    """
+    if len(edges) <= max_edges:
+        return edges
+    depths = graph.depths()
+    by_dependent = collections.defaultdict(list)
+    for edge in edges:
+        by_dependent[edge[1]].append(edge)
+    backbone = {
+        max(candidates, key=lambda e: (depths[e[0]], -e[0]))
+        for candidates in by_dependent.values()
+    }
+    ranked = sorted(
+        edges,
+        key=lambda e: (e not in backbone, depths[e[1]] - depths[e[0]], e),
+    )
+    logging.warning("Dropped %d of %d edges to stay within --max-edges",
+                    len(edges) - max_edges, len(edges))
+    kept = set(ranked[:max_edges])
+    return [edge for edge in edges if edge in kept]
+
 
 def _create_graphviz(
     adjacency_list: dict,
     output: pathlib.Path,
     colors: bool,
+    reduce: bool = True,
+    cluster_depth: int | None = None,
+    collapse_clusters: bool = False,
+    max_edges: int | None = None,
 ):
-    "Creates a diagram to display a graph using DOT language."
+    """Creates a diagram to display a graph using DOT language.
+
+    Args:
+        adjacency_list: The graph created by dependency_graph_extractor.
+        output: Where to write the diagram.
+        colors: Whether edges from the same module share a color.
+        reduce: Whether to drop the edges implied by other paths.
+        cluster_depth: If set, group modules by the first cluster_depth
+            components of their directory (0 for the whole directory).
+        collapse_clusters: Whether to draw every group as a single node.
+        max_edges: If set, the maximum number of edges to draw.
+    """
+    graph = dependency_graph.DependencyGraph.from_adjacency_list(
+        adjacency_list)
+    clusters = [""] * len(graph)
+    if cluster_depth is not None:
+        clusters = [
+            _cluster(node, cluster_depth) for node in adjacency_list.values()
+        ]
+        if collapse_clusters:
+            graph, clusters = _collapse(graph, clusters)
+    if reduce:
+        graph = graph.transitive_reduction()
+
+    # vmlinux is dependency for most of the nodes so skip it.
+    edges = [(a, b) for a, b in graph.edges() if graph.names[a] != "vmlinux"]
+    if max_edges is not None:
+        edges = _limit_edges(graph, edges, max_edges)
+
     content = ["digraph {"]
     content.extend([
         "\tgraph [rankdir=LR, splines=ortho];",
         "\tnode [color=steelblue, shape=plaintext];",
         "\tedge [arrowhead=odot, color=olive];",
     ])
-    leaves = []
-    for node in adjacency_list.values():
-        # vmlinux is dependency for most of the nodes so skip it.
-        if node["name"] == "vmlinux":
-            continue
-        # Skip nodes without dependents.
-        if not node["dependents"]:
-            leaves.append(node["name"])
-            continue
-        edges = []
-        for neighbor in node["dependents"]:
-            edges.append(f'"{adjacency_list[neighbor]["name"]}"')
-        edge_str = ",".join(edges)
+    drawn = {node for edge in edges for node in edge}
+    members = collections.defaultdict(list)
+    for node in sorted(drawn):
+        if clusters[node]:
+            members[clusters[node]].append(node)
+    for i, (cluster, nodes) in enumerate(sorted(members.items())):
+        content.append(f"\tsubgraph cluster_{i} {{")
+        content.append(f'\t\tlabel="{cluster}";')
+        content.extend(f'\t\t"{graph.names[node]}";' for node in nodes)
+        content.append("\t}")
+
+    dependents = collections.defaultdict(list)
+    for a, b in edges:
+        dependents[a].append(b)
+    # Nodes without dependents.
+    leaves = [
+        graph.names[node] for node in range(len(graph))
+        if node not in dependents and graph.names[node] != "vmlinux"
+    ]
+    for node, targets in dependents.items():
+        edge_str = ",".join(f'"{graph.names[target]}"' for target in targets)
         # Customize edge colors.
         edge_color = ""
         if colors:
             h = hashlib.shake_256(edge_str.encode())
-            edge_color = f' [color="  # {h.hexdigest(3)}"]'
-        content.append(f'\t"{node["name"]}" -> {edge_str}{edge_color};')
-    logging.warning("Leaf nodes: [%s]", leaves)
+            edge_color = f' [color="#{h.hexdigest(3)}"]'
+        content.append(f'\t"{graph.names[node]}" -> {edge_str}{edge_color};')
+    logging.warning("Leaf nodes: [%s]", ", ".join(leaves))
     content.append("}")
     output.write_text("\n".join(content), encoding="utf-8")
 
@@ -71,7 +176,7 @@ def _read_graph(
         ) from exc
 
 
-def main():
+def main(argv=None):
     """Creates two maps of dependencies for a directory full of kernel modules."""
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -91,12 +196,56 @@ def main():
         ),
     )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--no-reduce",
+        dest="reduce",
+        action="store_false",
+        help=(
+            "Draw every edge. By default, edges implied by other paths (like"
+            " vmlinux -> b when there is vmlinux -> a -> b) are not drawn."
+        ),
+    )
+    parser.add_argument(
+        "--cluster-by-directory",
+        metavar="DEPTH",
+        type=int,
+        nargs="?",
+        const=0,
+        help=(
+            "Group modules by directory, using at most DEPTH leading"
+            " directory components (default: all of them)."
+        ),
+    )
+    parser.add_argument(
+        "--collapse-clusters",
+        action="store_true",
+        help="Draw every directory group as a single node.",
+    )
+    parser.add_argument(
+        "--max-edges",
+        type=int,
+        help=(
+            "Draw at most this many edges, keeping the longest dependency"
+            " chains first."
+        ),
+    )
+
+    args = parser.parse_args(argv)
     logging.basicConfig(level=logging.INFO,
                         format="%(levelname)s: %(message)s")
+    if args.collapse_clusters and args.cluster_by_directory is None:
+        parser.error("--collapse-clusters requires --cluster-by-directory")
 
     # Create graph visualization.
-    _create_graphviz(args.adjacency_list, args.output, args.colors)
+    _create_graphviz(
+        args.adjacency_list,
+        args.output,
+        args.colors,
+        reduce=args.reduce,
+        cluster_depth=args.cluster_by_directory,
+        collapse_clusters=args.collapse_clusters,
+        max_edges=args.max_edges,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,83 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import pathlib
+import re
+import shutil
+import tempfile
+
+from absl.testing import absltest
+import dependency_graph_drawer
+
+# vmlinux -> a -> b -> c, with the implied a -> c; x uses a and b.
+_GRAPH = {
+    "0": {"name": "vmlinux", "dependents": ["1", "2", "3", "4"]},
+    "1": {"name": "a.ko", "dependents": ["2", "3", "4"],
+          "path": "drivers/foo/a.ko"},
+    "2": {"name": "b.ko", "dependents": ["3", "4"],
+          "path": "drivers/foo/b.ko"},
+    "3": {"name": "c.ko", "dependents": [], "path": "drivers/bar/c.ko"},
+    "4": {"name": "x.ko", "dependents": [], "path": "x.ko"},
+}
+
+
+class DependencyGraphDrawerTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = pathlib.Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.graph = self.tmp / "graph.json"
+        self.graph.write_text(json.dumps(_GRAPH))
+        self.output = self.tmp / "graph.dot"
+
+    def _draw(self, *args) -> str:
+        dependency_graph_drawer.main(
+            [str(self.graph), str(self.output)] + list(args))
+        return self.output.read_text()
+
+    def _edges(self, dot: str) -> set[tuple[str, str]]:
+        edges = set()
+        for source, targets in re.findall(r'"([^"]+)" -> ([^[;]*)', dot):
+            edges.update((source, target)
+                         for target in re.findall(r'"([^"]+)"', targets))
+        return edges
+
+    def test_transitive_reduction(self):
+        self.assertEqual(
+            self._edges(self._draw()),
+            {("a.ko", "b.ko"), ("b.ko", "c.ko"), ("b.ko", "x.ko")})
+        self.assertEqual(
+            self._edges(self._draw("--no-reduce")),
+            {("a.ko", "b.ko"), ("a.ko", "c.ko"), ("a.ko", "x.ko"),
+             ("b.ko", "c.ko"), ("b.ko", "x.ko")})
+
+    def test_clusters(self):
+        dot = self._draw("--cluster-by-directory")
+        self.assertIn('label="drivers/foo"', dot)
+        self.assertIn('label="drivers/bar"', dot)
+        self.assertEqual(
+            self._edges(self._draw("--cluster-by-directory", "1",
+                                   "--collapse-clusters")),
+            {("drivers/", "x.ko")})
+
+    def test_max_edges(self):
+        self.assertEqual(
+            self._edges(self._draw("--no-reduce", "--max-edges", "3")),
+            {("a.ko", "b.ko"), ("b.ko", "c.ko"), ("b.ko", "x.ko")})
+
+
+if __name__ == "__main__":
+    absltest.main()
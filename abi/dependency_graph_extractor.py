@@ -26,10 +26,17 @@ import symbol_extraction
 
 def find_binaries(
     directory: pathlib.Path,
+    binaries: list[str] | None = None,
 ) -> (pathlib.Path | None, list[pathlib.Path]):
-    """Locates vmlinux and kernel modules (*.ko)."""
-    vmlinux = list(directory.glob("**/vmlinux"))
-    modules = list(directory.glob("**/*.ko"))
+    """Locates vmlinux and kernel modules (*.ko).
+
+    If binaries is set, it is searched instead of the files below directory.
+    """
+    if binaries is None:
+        binaries = symbol_extraction.list_files(directory)
+    files = [pathlib.Path(path) for path in binaries]
+    vmlinux = [path for path in files if path.name == "vmlinux"]
+    modules = [path for path in files if path.suffix == ".ko"]
     if not vmlinux:
         return None, modules
     if len(vmlinux) > 1:
@@ -50,12 +57,17 @@ def create_graph(
     undefined_symbols_by_module: dict[str, list[str]],
     exported_symbols_by_module: dict[str, list[str]],
     output: pathlib.Path,
+    paths: dict[str, str] | None = None,
 ):
-    "Creates a best effort dependency graph from symbol relationships."
+    """Creates a best effort dependency graph from symbol relationships.
+
+    If set, paths maps module names to their path relative to the searched
+    directory, which is recorded for modules in subdirectories.
+    """
     ids = dict()
     symbol_to_module = dict()
     # Schema for the list (this uses numeric id's to reduce the output size).
-    # {id: {name: str, dependents: list()}}
+    # {id: {name: str, dependents: list(), [path: str]}}
     adjacency_list = dict()
 
     for module, exported in exported_symbols_by_module.items():
@@ -66,6 +78,9 @@ def create_graph(
                 "name": module,
                 "dependents": set(),
             }
+            path = (paths or {}).get(module)
+            if path and path != module:
+                adjacency_list[mod_id]["path"] = path
         exporter = ids.get(module)
         for symbol in exported:
             symbol_to_module[symbol] = exporter
@@ -86,7 +101,7 @@ def create_graph(
     )
 
 
-def main():
+def main(argv=None):
     """Extracts the required symbols for a directory full of kernel modules."""
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -99,35 +114,58 @@ def main():
         type=pathlib.Path,
         help="Path for storing the output",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--binaries-from",
+        metavar="FILE",
+        type=pathlib.Path,
+        help=(
+            "Read the paths of vmlinux and the modules from FILE (separated"
+            " by newlines or NUL characters) instead of searching the"
+            " directory"
+        ),
+    )
+    args = parser.parse_args(argv)
     logging.basicConfig(level=logging.INFO,
                         format="%(levelname)s: %(message)s")
-    if not args.directory.is_dir():
+    binaries = None
+    if args.binaries_from:
+        binaries = symbol_extraction.read_binaries_manifest(args.binaries_from)
+    elif not args.directory.is_dir():
         logging.error(
             "Expected a directory with binaries, but got %s", args.directory
         )
         return 1
 
     # Locate the Kernel Binaries.
-    vmlinux, modules = find_binaries(args.directory)
+    vmlinux, modules = find_binaries(args.directory, binaries)
 
     # Extract undefined symbols and exported modules.
+    profiles = {
+        blob: symbol_extraction.read_module_profile(blob)
+        for blob in [vmlinux] + modules
+    }
     undefined_symbols_by_module = {
-        pathlib.Path(module).name: symbol_extraction.extract_undefined_symbols(
-            module
-        )
+        pathlib.Path(module).name: profiles[module].undefined_symbols
         for module in modules
     }
     exported_symbols_by_module = {
-        pathlib.Path(blob).name: symbol_extraction.extract_exported_symbols(
-            blob
-        )
+        pathlib.Path(blob).name: profiles[blob].exported_symbols
         for blob in [vmlinux] + modules
     }
 
+    paths = {}
+    for blob in [vmlinux] + modules:
+        try:
+            paths[blob.name] = blob.relative_to(args.directory).as_posix()
+        except ValueError:
+            paths[blob.name] = blob.name
+
     # Create a dependency graph.
     create_graph(
-        undefined_symbols_by_module, exported_symbols_by_module, args.output
+        undefined_symbols_by_module,
+        exported_symbols_by_module,
+        args.output,
+        paths,
     )
 
 
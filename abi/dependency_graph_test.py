@@ -0,0 +1,144 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+from absl.testing import absltest
+import dependency_graph
+
+
+def _graph(edges: str) -> dependency_graph.DependencyGraph:
+    """Creates a graph from "a->b b->c" (a exports symbols used by b)."""
+    pairs = [edge.split("->") for edge in edges.split()]
+    names = sorted({name for pair in pairs for name in pair})
+    return dependency_graph.DependencyGraph(
+        names, [(names.index(a), names.index(b)) for a, b in pairs])
+
+
+def _reachable(graph, node):
+    """Nodes reachable from node through at least one edge, the slow way."""
+    seen = set()
+    pending = list(graph.dependents(node))
+    while pending:
+        current = pending.pop()
+        if current not in seen:
+            seen.add(current)
+            pending.extend(graph.dependents(current))
+    return seen
+
+
+class DependencyGraphTest(absltest.TestCase):
+
+    def _names(self, graph, nodes):
+        return [graph.names[node] for node in nodes]
+
+    def test_adjacency_list_round_trip(self):
+        adjacency_list = {
+            "0": {"name": "vmlinux", "dependents": ["1", "2"]},
+            "1": {"name": "a.ko", "dependents": ["2"]},
+            "2": {"name": "b.ko", "dependents": []},
+        }
+        graph = dependency_graph.DependencyGraph.from_adjacency_list(
+            adjacency_list)
+        self.assertEqual(graph.to_adjacency_list(), adjacency_list)
+        self.assertEqual(
+            self._names(graph, graph.dependencies(graph.index("b.ko"))),
+            ["vmlinux", "a.ko"])
+
+    def test_topological_order(self):
+        graph = _graph("vmlinux->a vmlinux->b a->b b->c")
+        self.assertEqual(self._names(graph, graph.topological_order()),
+                         ["vmlinux", "a", "b", "c"])
+
+    def test_cycles(self):
+        graph = _graph("vmlinux->a a->b b->a b->c c->c")
+        self.assertEqual(
+            [self._names(graph, cycle) for cycle in graph.cycles()],
+            [["a", "b"], ["c"]])
+        with self.assertRaisesRegex(ValueError, "cycle between a, b"):
+            graph.topological_order()
+
+    def test_transitive_closure(self):
+        graph = _graph("vmlinux->a a->b b->c x->c")
+        c = graph.index("c")
+        self.assertEqual(self._names(graph, graph.transitive_closure([c])),
+                         ["a", "b", "vmlinux", "x"])
+        self.assertEqual(
+            self._names(graph, graph.transitive_closure(
+                [graph.index("a")], dependents=True)),
+            ["b", "c"])
+
+    def test_transitive_reduction(self):
+        graph = _graph("vmlinux->a vmlinux->b vmlinux->c a->b b->c a->c")
+        reduced = graph.transitive_reduction()
+        self.assertEqual(
+            sorted((reduced.names[a], reduced.names[b])
+                   for a, b in reduced.edges()),
+            [("a", "b"), ("b", "c"), ("vmlinux", "a")])
+
+    def test_depths(self):
+        graph = _graph("vmlinux->a vmlinux->b a->b b->c vmlinux->d")
+        self.assertEqual(
+            dict(zip(graph.names, graph.depths())),
+            {"vmlinux": 0, "a": 1, "b": 2, "c": 3, "d": 1})
+        self.assertEqual(self._names(graph, graph.critical_path()),
+                         ["vmlinux", "a", "b", "c"])
+
+    def test_random_graphs(self):
+        rng = random.Random(0)
+        for _ in range(50):
+            size = rng.randint(1, 30)
+            edges = [(rng.randrange(size), rng.randrange(size))
+                     for _ in range(rng.randint(0, 3 * size))]
+            graph = dependency_graph.DependencyGraph(
+                [str(i) for i in range(size)], edges)
+            reachable = [_reachable(graph, i) for i in range(size)]
+
+            bitsets = graph.reachability(dependents=True)
+            for i in range(size):
+                self.assertEqual(
+                    {j for j in range(size) if bitsets[i] >> j & 1},
+                    reachable[i])
+                self.assertEqual(
+                    set(graph.transitive_closure([i], dependents=True)),
+                    reachable[i] - {i})
+
+            # Components are mutually reachable and in topological order.
+            position = {}
+            for c, component in enumerate(
+                    graph.strongly_connected_components()):
+                for node in component:
+                    position[node] = c
+            self.assertLen(position, size)
+            for a, b in graph.edges():
+                self.assertLessEqual(position[a], position[b])
+                self.assertEqual(position[a] == position[b],
+                                 a in reachable[b] or a == b)
+
+            # The reduction preserves reachability with a subset of edges.
+            reduced = graph.transitive_reduction()
+            self.assertLessEqual(set(reduced.edges()), set(graph.edges()))
+            for i in range(size):
+                self.assertEqual(_reachable(reduced, i), reachable[i])
+            for a, b in reduced.edges():
+                if position[a] != position[b]:
+                    without = dependency_graph.DependencyGraph(
+                        graph.names,
+                        [edge for edge in reduced.edges()
+                         if edge != (a, b)])
+                    self.assertNotIn(b, _reachable(without, a))
+
+
+if __name__ == "__main__":
+    absltest.main()
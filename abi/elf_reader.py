@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Minimal in-process reader for ELF symbol tables.
+
+Only the parts of ELF needed by the ABI tooling are understood: the section
+header table, the static symbol table (.symtab) and its string table. Both
+ELF32 and ELF64 in either byte order are supported. The file is mapped with
+mmap, so only the pages that are actually touched are read from disk.
+
+ElfFile.open(): Maps an ELF file and parses its section headers.
+"""
+
+import collections
+import contextlib
+import mmap
+import struct
+
+_ELF_MAGIC = b"\x7fELF"
+_ELFCLASS32 = 1
+_ELFCLASS64 = 2
+_ELFDATA2LSB = 1
+_ELFDATA2MSB = 2
+
+SHT_SYMTAB = 2
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+SHN_XINDEX = 0xffff
+
+STT_SECTION = 3
+STT_FILE = 4
+
+# (header, section header, symbol) layouts, without the byte order prefix.
+_LAYOUTS = {
+    _ELFCLASS32: ("16sHHIIIIIHHHHHH", "IIIIIIIIII", "IIIBBH"),
+    _ELFCLASS64: ("16sHHIQQQIHHHHHH", "IIQQQQIIQQ", "IBBHQQ"),
+}
+
+Section = collections.namedtuple(
+    "Section", ["name", "type", "offset", "size", "link", "entsize"])
+
+Symbol = collections.namedtuple(
+    "Symbol", ["name", "value", "size", "type", "bind", "shndx"])
+
+
+class ElfError(Exception):
+  """Raised when a file is not a well-formed ELF file."""
+
+
+class ElfFile:
+  """Read-only view of the sections and symbols of an ELF file."""
+
+  def __init__(self, data):
+    """Parses the ELF and section headers found in the buffer data."""
+    self.data = data
+    if len(data) < 16 or bytes(data[:4]) != _ELF_MAGIC:
+      raise ElfError("not an ELF file")
+    elf_class, elf_data = data[4], data[5]
+    if elf_class not in _LAYOUTS or elf_data not in (_ELFDATA2LSB,
+                                                     _ELFDATA2MSB):
+      raise ElfError(f"unsupported ELF class {elf_class} / data {elf_data}")
+    self.is_64 = elf_class == _ELFCLASS64
+    order = "<" if elf_data == _ELFDATA2LSB else ">"
+    header, shdr, sym = (struct.Struct(order + l) for l in _LAYOUTS[elf_class])
+    self._sym = sym
+
+    try:
+      (_, _, _, _, _, _, e_shoff, _, _, _, _, e_shentsize, e_shnum,
+       e_shstrndx) = header.unpack_from(data, 0)
+      raw = []
+      if e_shoff:
+        first = shdr.unpack_from(data, e_shoff)
+        # Extended numbering: the real values live in section header 0.
+        if e_shnum == 0:
+          e_shnum = first[5]
+        if e_shstrndx == SHN_XINDEX:
+          e_shstrndx = first[6]
+        raw = [
+            shdr.unpack_from(data, e_shoff + i * e_shentsize)
+            for i in range(e_shnum)
+        ]
+    except struct.error as err:
+      raise ElfError(f"truncated section header table: {err}") from err
+
+    names = raw[e_shstrndx] if e_shstrndx < len(raw) else None
+    self.sections = [
+        Section(
+            name=self._string(names[4], names[5], s[0]) if names else "",
+            type=s[1],
+            offset=s[4],
+            size=s[5],
+            link=s[6],
+            entsize=s[9],
+        ) for s in raw
+    ]
+
+  @classmethod
+  @contextlib.contextmanager
+  def open(cls, path):
+    """Maps the file at path and yields an ElfFile for it."""
+    with open(path, "rb") as f:
+      try:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      except ValueError:
+        # Empty files cannot be mapped.
+        data = b""
+      try:
+        yield cls(data)
+      finally:
+        if isinstance(data, mmap.mmap):
+          data.close()
+
+  def _string(self, offset, size, index):
+    """Returns the NUL terminated string at index of a string table."""
+    if index >= size:
+      return ""
+    start = offset + index
+    end = self.data.find(b"\0", start, offset + size)
+    if end == -1:
+      end = offset + size
+    return self.data[start:end].decode("utf-8", errors="replace")
+
+  def section_by_name(self, name):
+    """Returns the first section called name, or None."""
+    for section in self.sections:
+      if section.name == name:
+        return section
+    return None
+
+  def section_data(self, section):
+    """Returns the raw contents of a section."""
+    return self.data[section.offset:section.offset + section.size]
+
+  def symbols(self):
+    """Yields every entry of .symtab except the leading null symbol."""
+    symtab = next((s for s in self.sections if s.type == SHT_SYMTAB), None)
+    if symtab is None or symtab.link >= len(self.sections):
+      return
+    strtab = self.sections[symtab.link]
+    if symtab.entsize not in (0, self._sym.size):
+      raise ElfError(f"unexpected symbol size {symtab.entsize}")
+    start = symtab.offset + self._sym.size
+    end = symtab.offset + symtab.size
+    if end <= start:
+      return
+    end -= (end - start) % self._sym.size
+    if end > len(self.data):
+      raise ElfError("truncated symbol table")
+    # Slicing the string table once is a lot cheaper than a find() on the
+    # whole mapping per name.
+    strings = self.data[strtab.offset:strtab.offset + strtab.size]
+    for fields in self._sym.iter_unpack(self.data[start:end]):
+      if self.is_64:
+        st_name, st_info, _, st_shndx, st_value, st_size = fields
+      else:
+        st_name, st_value, st_size, st_info, _, st_shndx = fields
+      name_end = strings.find(b"\0", st_name)
+      if name_end == -1:
+        name_end = len(strings)
+      yield Symbol(
+          name=strings[st_name:name_end].decode("utf-8", errors="replace"),
+          value=st_value,
+          size=st_size,
+          type=st_info & 0xf,
+          bind=st_info >> 4,
+          shndx=st_shndx,
+      )
+
+  def section_name(self, shndx):
+    """Returns the name of the section with index shndx, if there is one."""
+    if shndx == SHN_UNDEF or shndx >= SHN_LORESERVE:
+      return None
+    if shndx >= len(self.sections):
+      return None
+    return self.sections[shndx].name
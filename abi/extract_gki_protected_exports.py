@@ -49,7 +49,7 @@ def update_gki_protected_exports(directory, gki_protected_modules_list,
       protected_exports_symbol_list.write("\n")
 
 
-def main():
+def main(argv=None):
   """Extracts the required symbols for a directory full of kernel modules."""
   parser = argparse.ArgumentParser()
   parser.add_argument(
@@ -70,7 +70,7 @@ def main():
       help="A file with list of GKI protected modules (e.g. common/android/gki_protected_modules)"
   )
 
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   if not os.path.isdir(args.directory):
     print("Expected a directory to search for binaries, but got %s" %
@@ -17,12 +17,17 @@
 
 import argparse
 import collections
+import contextlib
+import dataclasses
 import functools
+import hashlib
 import itertools
+import json
 import os
 import re
 import subprocess
 import sys
+import time
 
 import symbol_extraction
 
@@ -32,6 +37,17 @@ _ALWAYS_INCLUDED = [
 ]
 _ABIGAIL_HEADER = "[abi_symbol_list]"
 
+# --incremental keeps its state next to the symbol list.
+_STATE_SUFFIX = ".state"
+# Bump when the layout of the state or the format of the symbol list changes.
+_STATE_VERSION = 2
+# Binaries modified more recently may change again within the granularity of
+# their mtime, so their profile is not remembered.
+_RACY_SECONDS = 2
+# The comments starting the sections after the commonly used symbols.
+_SECTION_PATTERN = re.compile(
+    r"^# (?:required by (.*)|preserved by --additions-only)$", re.MULTILINE)
+
 def symbol_sort(symbols):
   # Use a method similar to `LANG=en_US sort`: case insensitive and ignoring
   # underscores, that keeps symbols with related names close to each other.
@@ -52,45 +68,45 @@ def symbol_sort(symbols):
   return sorted(set(symbols), key=__key)
 
 
-def find_binaries(directory):
-  """Locates vmlinux and kernel modules (*.ko)."""
+def find_binaries(directory, binaries=None):
+  """Locates vmlinux and kernel modules (*.ko).
+
+  If binaries is set, it is searched instead of the files below directory.
+  """
+  if binaries is None:
+    binaries = symbol_extraction.list_files(directory)
   vmlinux = None
   modules = []
-  for root, dirs, files in os.walk(directory):
-    for file in files:
-      if file.endswith(".ko"):
-        modules.append(os.path.join(root, file))
-      elif file == "vmlinux":
-        vmlinux = os.path.join(root, file)
+  for path in binaries:
+    file = os.path.basename(path)
+    if file.endswith(".ko"):
+      modules.append(path)
+    elif file == "vmlinux":
+      vmlinux = path
 
   return vmlinux, modules
 
 
-def extract_undefined_symbols_multiple(modules):
+def extract_undefined_symbols_multiple(modules, profiles):
   """Extracts undefined symbols from a list of module files."""
-
-  # yes, we could pass all of them to nm, but I want to avoid hitting shell
-  # limits with long lists of modules
-  result = {}
-  for module in sorted(modules):
-    result[os.path.basename(module)] = symbol_sort(
-        symbol_extraction.extract_undefined_symbols(module))
-
-  return result
+  return {
+      os.path.basename(module): symbol_sort(profiles[module].undefined_symbols)
+      for module in sorted(modules)
+  }
 
 
-def extract_generic_exports(vmlinux, modules):
+def extract_generic_exports(vmlinux, modules, profiles):
   """Extracts the ksymtab exported symbols from vmlinux and a set of modules."""
-  symbols = symbol_extraction.extract_exported_symbols(vmlinux)
-  for module in modules:
-    symbols.extend(symbol_extraction.extract_exported_symbols(module))
-  return symbol_sort(symbols)
+  return symbol_sort(
+      itertools.chain.from_iterable(
+          profiles[binary].exported_symbols
+          for binary in [vmlinux] + list(modules)))
 
 
-def extract_exported_in_modules(modules):
+def extract_exported_in_modules(modules, profiles):
   """Extracts the ksymtab exported symbols for a list of kernel modules."""
   return {
-      module: symbol_sort(symbol_extraction.extract_exported_symbols(module))
+      module: symbol_sort(profiles[module].exported_symbols)
       for module in modules
   }
 
@@ -124,23 +140,46 @@ def add_dependent_symbols(module_symbols, exported):
     module_symbols[module].extend(syms)
 
 
+def _common_symbols(undefined_symbols, exported, module_grouping):
+  """Returns the symbols of the common section, without preserved ones."""
+  symbol_counter = collections.Counter(
+      itertools.chain.from_iterable(undefined_symbols.values()))
+  return [
+      symbol for symbol, count in symbol_counter.items()
+      if (count > 1 or not module_grouping) and symbol in exported
+  ] + _ALWAYS_INCLUDED
+
+
+def _module_section(symbols, exported, common_wl_section):
+  """Returns the sorted symbols of the section of a module."""
+  return symbol_sort([
+      symbol for symbol in symbols
+      if symbol in exported and symbol not in common_wl_section
+  ])
+
+
+def _format_section(comment, symbols):
+  return "\n# {}\n  {}\n".format(comment, "\n  ".join(symbols))
+
+
+def _section_symbols(text):
+  return [line[2:] for line in text.splitlines() if line.startswith("  ")]
+
+
 def create_symbol_list(symbol_list, undefined_symbols, exported,
                        emit_module_symbol_lists, module_grouping,
                        additions_only):
-  """Creates a libabigail format symbol list."""
+  """Creates a libabigail format symbol list, on stdout without symbol_list."""
   precious_symbols = set()
-  if additions_only:
+  if additions_only and symbol_list:
     precious_symbols.update(symbol_extraction.read_symbol_list(symbol_list))
 
-  symbol_counter = collections.Counter(
-      itertools.chain.from_iterable(undefined_symbols.values()))
-
-  with open(symbol_list, "w") as wl:
+  # sys.stdout rather than /dev/stdout, so that redirect_stdout() applies.
+  with (open(symbol_list, "w")
+        if symbol_list else contextlib.nullcontext(sys.stdout)) as wl:
 
-    common_symbols = [
-        symbol for symbol, count in symbol_counter.items()
-        if (count > 1 or not module_grouping) and symbol in exported
-    ] + _ALWAYS_INCLUDED
+    common_symbols = _common_symbols(undefined_symbols, exported,
+                                     module_grouping)
 
     # When both --additions-only and --skip-module-grouping are used together,
     # we sort the unused symbols together will all of the other symbols.
@@ -171,26 +210,170 @@ def create_symbol_list(symbol_list, undefined_symbols, exported,
           mod_wl.write("\n  ".join([s for s in symbols if s in exported]))
           mod_wl.write("\n")
 
-      new_wl_section = symbol_sort([
-          symbol for symbol in symbols
-          if symbol in exported and symbol not in common_wl_section
-      ])
+      new_wl_section = _module_section(symbols, exported, common_wl_section)
 
       if not new_wl_section:
         continue
 
-      wl.write("\n# required by {}\n  ".format(module))
-      wl.write("\n  ".join(new_wl_section))
-      wl.write("\n")
+      wl.write(_format_section("required by " + module, new_wl_section))
       precious_symbols.difference_update(new_wl_section)
 
     if precious_symbols:
-      wl.write("\n# preserved by --additions-only\n  ")
-      wl.write("\n  ".join(symbol_sort(precious_symbols)))
-      wl.write("\n")
+      wl.write(_format_section("preserved by --additions-only",
+                               symbol_sort(precious_symbols)))
+
+
+def merge_symbol_list(symbol_list, undefined_symbols, exported, changed):
+  """Merges the sections of the changed modules into a symbol list in place.
+
+  symbol_list must have been written by create_symbol_list() with
+  module_grouping and additions_only, from the same exported symbols and the
+  same undefined symbols for every module but the changed ones. The result is
+  the one create_symbol_list() would write, but the sections of the other
+  modules are copied, and the list is only rewritten from the first section
+  that changes.
+
+  Returns:
+    Whether the list could be merged. It cannot, and is left untouched, if
+    the commonly used symbols change: they affect every module's section.
+  """
+  with open(symbol_list, "rb") as f:
+    old = f.read().decode()
+  matches = list(_SECTION_PATTERN.finditer(old))
+  # Every section starts with the empty line before its comment.
+  bounds = [0] + [match.start() - 1 for match in matches] + [len(old)]
+  sections = [old[begin:end] for begin, end in zip(bounds, bounds[1:])]
+  old_module_sections = {
+      match.group(1): section
+      for match, section in zip(matches, sections[1:])
+      if match.group(1) is not None
+  }
 
+  common_wl_section = set(_common_symbols(undefined_symbols, exported, True))
+  if common_wl_section != set(_section_symbols(sections[0])):
+    return False
+
+  precious_symbols = set(_section_symbols(old))
+  precious_symbols.difference_update(common_wl_section)
+  new_sections = [sections[0]]
+  for module, symbols in undefined_symbols.items():
+    if module in changed:
+      new_wl_section = _module_section(symbols, exported, common_wl_section)
+      section = (_format_section("required by " + module, new_wl_section)
+                 if new_wl_section else "")
+    else:
+      section = old_module_sections.get(module, "")
+      new_wl_section = _section_symbols(section)
+    if section:
+      new_sections.append(section)
+    precious_symbols.difference_update(new_wl_section)
+  if precious_symbols:
+    new_sections.append(_format_section("preserved by --additions-only",
+                                        symbol_sort(precious_symbols)))
+
+  kept = 0
+  for old_section, new_section in zip(sections, new_sections):
+    if old_section != new_section:
+      break
+    kept += 1
+  if kept == len(sections) == len(new_sections):
+    return True
+  with open(symbol_list, "r+b") as f:
+    f.seek(len("".join(sections[:kept]).encode()))
+    f.write("".join(new_sections[kept:]).encode())
+    f.truncate()
+  return True
+
+
+def _stat_fingerprint(path):
+  st = os.stat(path)
+  return [st.st_size, st.st_mtime_ns]
+
+
+def _digest(value):
+  return hashlib.sha256(
+      json.dumps(value, separators=(",", ":")).encode()).hexdigest()
+
+
+def _file_digest(path):
+  try:
+    with open(path, "rb") as f:
+      return hashlib.sha256(f.read()).hexdigest()
+  except OSError:
+    return None
+
+
+def read_incremental_state(state_file):
+  """Reads the state written by write_incremental_state(), {} if unusable."""
+  try:
+    with open(state_file) as f:
+      state = json.load(f)
+  except (OSError, ValueError):
+    return {}
+  if (not isinstance(state, dict) or state.get("version") != _STATE_VERSION or
+      not isinstance(state.get("inputs"), dict) or
+      not isinstance(state["inputs"].get("modules"), dict)):
+    return {}
+  return state
+
+
+def unchanged_profiles(state, binaries):
+  """Returns the stored profiles of the binaries that did not change since."""
+  stored = state.get("binaries", {})
+  profiles = []
+  for binary in binaries:
+    entry = stored.get(os.path.abspath(binary))
+    if entry and entry["stat"] == _stat_fingerprint(binary):
+      profiles.append(
+          symbol_extraction.ModuleProfile.from_dict(entry["profile"], binary))
+  return profiles
+
+
+def symbol_list_inputs(undefined_symbols, exported, emit_module_symbol_lists,
+                       module_grouping, additions_only):
+  """Fingerprints everything create_symbol_list() uses but the old list.
+
+  Returns:
+    {"modules": {module: fingerprint of its undefined symbols},
+     "other": fingerprint of the other arguments}
+  """
+  return {
+      "modules": {
+          module: _digest(symbols)
+          for module, symbols in undefined_symbols.items()
+      },
+      "other": _digest([
+          sorted(exported),
+          emit_module_symbol_lists,
+          module_grouping,
+          additions_only,
+      ]),
+  }
 
-def main():
+
+def write_incremental_state(state_file, profiles, inputs, symbol_list):
+  """Remembers the profiles and the inputs of a symbol list just written."""
+  now = time.time()
+  binaries = {}
+  for binary, profile in profiles.items():
+    stat = _stat_fingerprint(binary)
+    if now - stat[1] / 1e9 > _RACY_SECONDS:
+      profile = dataclasses.asdict(profile)
+      del profile["path"]
+      binaries[os.path.abspath(binary)] = {"stat": stat, "profile": profile}
+  state = {
+      "version": _STATE_VERSION,
+      "binaries": binaries,
+      "inputs": inputs,
+      "output": _file_digest(symbol_list),
+  }
+  tmp = f"{state_file}.{os.getpid()}"
+  with open(tmp, "w") as f:
+    json.dump(state, f, separators=(",", ":"))
+  os.replace(tmp, state_file)
+
+
+def main(argv=None):
   """Extracts the required symbols for a directory full of kernel modules."""
   parser = argparse.ArgumentParser()
   parser.add_argument(
@@ -199,6 +382,12 @@ def main():
       default=os.getcwd(),
       help="the directory to search for kernel binaries")
 
+  parser.add_argument(
+      "--binaries-from",
+      metavar="FILE",
+      help="Read the paths of vmlinux and the modules from FILE (separated by "
+      "newlines or NUL characters) instead of searching the directory")
+
   parser.add_argument(
       "--skip-report-missing",
       action="store_false",
@@ -225,6 +414,15 @@ def main():
       action="store_true",
       help="Read the existing symbol list and ensure no symbols get removed")
 
+  parser.add_argument(
+      "--incremental",
+      action="store_true",
+      help="With --additions-only, remember the symbols of every binary next "
+      "to the symbol list (in SYMBOL_LIST%s) and only read the binaries that "
+      "changed since. When only the symbols of some modules changed, only "
+      "their sections are merged into the symbol list. It is rewritten in "
+      "full if it was edited since." % _STATE_SUFFIX)
+
   parser.add_argument(
       "--print-modules",
       action="store_true",
@@ -255,9 +453,27 @@ def main():
       help="Do not process modules matching the filter. Can be passed multiple times."
   )
 
-  args = parser.parse_args()
+  parser.add_argument(
+      "--jobs", "-j",
+      type=int,
+      default=os.cpu_count() or 1,
+      help="Number of modules to process in parallel (default: %(default)s)")
 
-  if not os.path.isdir(args.directory):
+  parser.add_argument(
+      "--symbol-cache",
+      metavar="DIR",
+      help="Cache extracted symbols in DIR across invocations (also enabled "
+      "by setting ABI_SYMBOL_CACHE_DIR)")
+
+  args = parser.parse_args(argv)
+
+  if args.symbol_cache:
+    symbol_extraction.enable_cache(args.symbol_cache)
+
+  binaries = None
+  if args.binaries_from:
+    binaries = symbol_extraction.read_binaries_manifest(args.binaries_from)
+  elif not os.path.isdir(args.directory):
     print("Expected a directory to search for binaries, but got %s" %
           args.directory)
     return 1
@@ -266,11 +482,14 @@ def main():
     print("Emitting module symbol lists requires the --symbol-list parameter.")
     return 1
 
-  if args.symbol_list is None:
-    args.symbol_list = "/dev/stdout"
+  if args.incremental and (not args.additions_only or not args.symbol_list or
+                           args.emit_module_symbol_lists):
+    print("--incremental requires --additions-only and --symbol-list, and "
+          "does not support --emit-module-symbol-lists.")
+    return 1
 
   # Locate the Kernel Binaries
-  vmlinux, modules = find_binaries(args.directory)
+  vmlinux, modules = find_binaries(args.directory, binaries)
 
   if args.module_includes:
     modules = [
@@ -284,26 +503,37 @@ def main():
             [re.search(f, os.path.basename(mod)) for f in args.module_excludes])
     ]
 
-  # Partition vendor (unsigned) and GKI modules (signed) in two lists
-  t1, t2 = itertools.tee(modules)
-  gki_modules = list(filter(symbol_extraction.is_signature_present, t1))
-  local_modules = list(
-      itertools.filterfalse(symbol_extraction.is_signature_present, t2))
-
   if vmlinux is None or not os.path.isfile(vmlinux):
     print("Could not find a suitable vmlinux file.")
     return 1
 
+  state = {}
+  if args.incremental:
+    state_file = args.symbol_list + _STATE_SUFFIX
+    state = read_incremental_state(state_file)
+    symbol_extraction.preload_profiles(
+        unchanged_profiles(state, [vmlinux] + modules))
+
+  # Read signature, imports and exports of every binary at once
+  profiles = symbol_extraction.read_module_profiles([vmlinux] + modules,
+                                                    args.jobs)
+
+  # Partition vendor (unsigned) and GKI modules (signed) in two lists
+  gki_modules = [mod for mod in modules if profiles[mod].is_signed]
+  local_modules = [mod for mod in modules if not profiles[mod].is_signed]
+
   # Get required symbols of all modules
-  gki_undefined_symbols = extract_undefined_symbols_multiple(gki_modules)
-  local_undefined_symbols = extract_undefined_symbols_multiple(local_modules)
+  gki_undefined_symbols = extract_undefined_symbols_multiple(
+      gki_modules, profiles)
+  local_undefined_symbols = extract_undefined_symbols_multiple(
+      local_modules, profiles)
   undefined_symbols = {}
   undefined_symbols.update(gki_undefined_symbols)
   undefined_symbols.update(local_undefined_symbols)
 
   # Get the actually defined and exported symbols
-  generic_exports = extract_generic_exports(vmlinux, gki_modules)
-  local_exports = extract_exported_in_modules(local_modules)
+  generic_exports = extract_generic_exports(vmlinux, gki_modules, profiles)
+  local_exports = extract_exported_in_modules(local_modules, profiles)
 
   # Build the list of all exported symbols (generic and local)
   all_exported = list(
@@ -319,15 +549,32 @@ def main():
   if args.report_missing and not (args.module_includes or args.module_excludes):
     report_missing(undefined_symbols, all_exported)
 
-  # If specified, create the symbol list
-  if args.symbol_list:
-    create_symbol_list(
-        args.symbol_list,
-        { "full-gki-abi": generic_exports } if args.full_gki_abi else local_undefined_symbols,
-        all_exported if args.include_module_exports else generic_exports,
-        args.emit_module_symbol_lists,
-        args.module_grouping,
-        args.additions_only)
+  # Create the symbol list, on stdout unless specified
+  list_args = (
+      { "full-gki-abi": generic_exports } if args.full_gki_abi else local_undefined_symbols,
+      all_exported if args.include_module_exports else generic_exports,
+      args.emit_module_symbol_lists,
+      args.module_grouping,
+      args.additions_only)
+  if args.incremental:
+    inputs = symbol_list_inputs(*list_args)
+    stored = state.get("inputs", {})
+    if (stored.get("other") != inputs["other"] or
+        state.get("output") != _file_digest(args.symbol_list)):
+      create_symbol_list(args.symbol_list, *list_args)
+    elif stored["modules"] != inputs["modules"]:
+      changed = {
+          module for module, fingerprint in inputs["modules"].items()
+          if stored["modules"].get(module) != fingerprint
+      }
+      if not (args.module_grouping and merge_symbol_list(
+          args.symbol_list, list_args[0], list_args[1], changed)):
+        create_symbol_list(args.symbol_list, *list_args)
+    # Otherwise, a list written by the previous run from the same inputs is
+    # its own fixed point.
+    write_incremental_state(state_file, profiles, inputs, args.symbol_list)
+  else:
+    create_symbol_list(args.symbol_list, *list_args)
 
   if args.print_modules:
     if local_modules:
@@ -0,0 +1,149 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+import extract_symbols
+import symbol_extraction
+import synthetic_corpus
+
+_OLD = 1_000_000_000
+
+
+class ExtractSymbolsTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.addCleanup(symbol_extraction._preloaded.clear)
+    self.dist = os.path.join(self.tmp, "dist")
+    os.makedirs(self.dist)
+    self._binary("vmlinux", [(".text", f"__ksymtab_{name}")
+                             for name in ("foo", "bar", "baz", "qux")], [])
+    self._binary("a.ko", [], ["foo", "bar"])
+    self._binary("b.ko", [], ["bar"])
+    self._binary("c.ko", [], ["qux"])
+
+  def _binary(self, name, defined, undefined, mtime=_OLD):
+    path = os.path.join(self.dist, name)
+    synthetic_corpus.write_elf(path, True, True, defined, undefined, 62)
+    # Old enough for --incremental to remember.
+    os.utime(path, ns=(mtime, mtime))
+
+  def _extract(self, symbol_list, *flags):
+    # Profiles are preloaded, and the files listed, for the rest of the
+    # process otherwise.
+    symbol_extraction._preloaded.clear()
+    symbol_extraction._list_files.cache_clear()
+    with mock.patch("sys.stdout"):
+      exit_code = extract_symbols.main([
+          "--symbol-list", symbol_list, "--additions-only", "--jobs", "1",
+          *flags, self.dist
+      ])
+    self.assertFalse(exit_code)
+    with open(symbol_list) as f:
+      return f.read()
+
+  def _write_list(self, name, content):
+    path = os.path.join(self.tmp, name)
+    with open(path, "w") as f:
+      f.write(content)
+    return path
+
+  def test_incremental_matches_full_rebuild(self):
+    initial = "[abi_symbol_list]\n  preserved\n"
+    incremental = self._write_list("incremental", initial)
+    first = self._extract(incremental, "--incremental")
+    self.assertEqual(first, self._extract(self._write_list("full", initial)))
+    self.assertIn("preserved", first)
+    self.assertTrue(os.path.exists(incremental + ".state"))
+
+    # Nothing changed: no binary is read again.
+    with mock.patch.object(symbol_extraction, "_read_module_profile") as read:
+      self.assertEqual(self._extract(incremental, "--incremental"), first)
+    read.assert_not_called()
+
+    # Only the changed module is read again, and the result still matches.
+    self._binary("b.ko", [], ["baz"], mtime=_OLD + 1)
+    real_read = symbol_extraction._read_module_profile
+    with mock.patch.object(symbol_extraction, "_read_module_profile",
+                           side_effect=real_read) as read:
+      second = self._extract(incremental, "--incremental")
+    self.assertEqual([call.args[0] for call in read.call_args_list],
+                     [os.path.join(self.dist, "b.ko")])
+    self.assertIn("baz", second)
+    self.assertEqual(
+        second, self._extract(self._write_list("full2", first)))
+
+  def test_incremental_merges_changed_modules(self):
+    initial = "[abi_symbol_list]\n  preserved\n"
+    incremental = self._write_list("incremental", initial)
+    previous = self._extract(incremental, "--incremental")
+    changes = [
+        # The section of c.ko changes, qux is preserved.
+        lambda: self._binary("c.ko", [], ["baz"], mtime=_OLD + 1),
+        # A module is added, and one removed.
+        lambda: self._binary("d.ko", [], ["qux"], mtime=_OLD + 1),
+        lambda: os.remove(os.path.join(self.dist, "c.ko")),
+    ]
+    for index, change in enumerate(changes):
+      change()
+      with mock.patch.object(
+          extract_symbols, "create_symbol_list",
+          wraps=extract_symbols.create_symbol_list) as create:
+        merged = self._extract(incremental, "--incremental")
+      create.assert_not_called()
+      self.assertEqual(
+          merged, self._extract(self._write_list(f"full{index}", previous)))
+      previous = merged
+    self.assertIn("# required by d.ko\n  qux\n", merged)
+    self.assertNotIn("c.ko", merged)
+    self.assertIn("# preserved by --additions-only\n  baz\n  preserved\n",
+                  merged)
+
+  def test_incremental_rebuilds_common_change(self):
+    incremental = self._write_list("incremental", "")
+    first = self._extract(incremental, "--incremental")
+    # bar is no longer required by two modules.
+    self._binary("b.ko", [], ["baz"], mtime=_OLD + 1)
+    with mock.patch.object(
+        extract_symbols, "create_symbol_list",
+        wraps=extract_symbols.create_symbol_list) as create:
+      second = self._extract(incremental, "--incremental")
+    create.assert_called_once()
+    self.assertEqual(second, self._extract(self._write_list("full", first)))
+
+  def test_incremental_rewrites_edited_list(self):
+    symbol_list = self._write_list("list", "")
+    first = self._extract(symbol_list, "--incremental")
+    self._write_list("list", first + "\n  added_by_hand\n")
+    second = self._extract(symbol_list, "--incremental")
+    self.assertIn("# preserved by --additions-only\n  added_by_hand", second)
+
+  def test_incremental_requires_additions_only(self):
+    with mock.patch("sys.stdout"):
+      self.assertEqual(
+          extract_symbols.main([
+              "--symbol-list", os.path.join(self.tmp, "list"),
+              "--incremental", self.dist
+          ]), 1)
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -15,24 +15,18 @@
 # limitations under the License.
 #
 
-import configparser
 import sys
 
+import symbol_list
+
 def main():
     """Convert a KMI symbol list in libabigail format to a raw list."""
     if sys.stdin.isatty():
         print("ERROR: missing KMI symbol list on the standard input")
         return 1
 
-    sl = configparser.ConfigParser(allow_no_value=True, strict=False)
-    sl.optionxform = str
-    sl.read_file(sys.stdin)
-
-    ksyms = set()
-    for section in (s for s in sl.sections() if s.endswith(('whitelist',
-                                                            'symbol_list'))):
-        ksyms.update(sl[section])
-    print('\n'.join(sorted(ksyms)))
+    sl = symbol_list.SymbolList().parse(sys.stdin, comment_prefixes="#;")
+    print('\n'.join(sorted(sl.kmi_symbols())))
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -28,11 +28,14 @@ imports.  This is a standalone program, it is not meant to be used as
 a module by other programs.
 
 This program runs under the multiprocessing module.  Work done within
-a multiprocessing.Pool does not perform error logging or affects any
-state other than the value that it computes and returns via the function
-mapped through the pool's map() function.  The reason that no external
-state is affected (for example error loggiing) is to avoid to have to
-even think about what concurrent updates would cause to shuch a facility.
+a multiprocessing.Pool does not perform error logging, and returns what it
+computes via the function mapped through the pool.  The only state it
+updates is private to its worker process: memoized tables of paths,
+archive members and file digests, which merely spare repeating work.  The
+state kept across runs (--state and --defines-cache) is only read and
+written by the main process.  The reason that no shared state is affected
+(for example error logging) is to avoid to have to even think about what
+concurrent updates would cause to such a facility.
 """
 
 #   TODO(pantin): per Matthias review feedback: "drop the .py from the
@@ -41,16 +44,23 @@ even think about what concurrent updates would cause to shuch a facility.
 
 import argparse
 import collections
+import hashlib
 import logging
+import mmap
 import multiprocessing
 import os
 import pathlib
+import pickle
 import re
 import subprocess
 import sys
-from typing import List, Optional, Tuple
+import tempfile
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
 from typing import Set  # pytype needs this, pylint: disable=unused-import
 
+import kmi_defines_index
+
 INDENT = 4  # number of spaces to indent for each depth level
 COMPILER = "clang"  # TODO(pantin): should be determined at run-time
 
@@ -72,11 +82,91 @@ COMPILER = "clang"  # TODO(pantin): should be determined at run-time
 
 HIDDEN_DEP = "include/generated/autoconf.h"
 
+#   The -D of these macros on the compiler command line differ for every
+#   file, see Target.get_flags().
+
+FILE_SPECIFIC_MACROS_RE = re.compile(
+    r"-D(KBUILD_BASENAME|KBUILD_MODNAME|__KBUILD_MODNAME)=")
+
 
 class StopError(Exception):
     """Exception raised to stop work when an unexpected error occurs."""
 
 
+class PathTable:
+    """Canonical paths, as made by os.path.realpath(), interned as integers.
+
+    Thousands of components share the same few thousand headers, resolving
+    the path of a header is done once, and the components refer to it by its
+    small integer id, which costs less to store, hash and compare than the
+    path itself.  The ids are only valid in the process that assigned them.
+    """
+    def __init__(self) -> None:
+        self._ids_by_path = {}  # type: Dict[str, int]
+        self._ids = {}  # type: Dict[str, int]
+        self._paths = []  # type: List[str]
+
+    def intern(self, path: str) -> int:
+        """Return the id of the canonical path of path."""
+        ident = self._ids_by_path.get(path)
+        if ident is None:
+            ident = self.intern_canonical(os.path.realpath(path))
+            self._ids_by_path[path] = ident
+        return ident
+
+    def intern_canonical(self, path: str) -> int:
+        """Return the id of path, which must be canonical already."""
+        ident = self._ids.get(path)
+        if ident is None:
+            ident = self._ids[path] = len(self._paths)
+            self._paths.append(path)
+        return ident
+
+    def path(self, ident: int) -> str:
+        """Return the canonical path with the id ident."""
+        return self._paths[ident]
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+
+PATHS = PathTable()
+
+
+class PathSet(set):
+    """A set of ids of canonical paths in PATHS.
+
+    It is pickled as the paths themselves, which are interned again when it
+    is unpickled, so that it can be sent between processes.
+    """
+    def __reduce__(self):
+        return (path_set_from_paths, (sorted(self.paths()),))
+
+    def paths(self) -> Set[str]:
+        """Return the paths in the set."""
+        return {PATHS.path(ident) for ident in self}
+
+
+def path_set_from_paths(paths: List[str]) -> PathSet:
+    """Return a PathSet with canonical paths."""
+    return PathSet(PATHS.intern_canonical(path) for path in paths)
+
+
+class PathList(list):
+    """A list of ids of canonical paths in PATHS, pickled like a PathSet."""
+    def __reduce__(self):
+        return (path_list_from_paths, (self.paths(),))
+
+    def paths(self) -> List[str]:
+        """Return the paths in the list."""
+        return [PATHS.path(ident) for ident in self]
+
+
+def path_list_from_paths(paths: List[str]) -> PathList:
+    """Return a PathList with canonical paths."""
+    return PathList(PATHS.intern_canonical(path) for path in paths)
+
+
 def dump(this) -> None:
     """Dump the data in this.
 
@@ -95,8 +185,12 @@ def dump(this) -> None:
         elif isinstance(this, bool):
             indent = " " * (depth * INDENT)
             print(indent + name + str(this))
+        elif isinstance(this, PathList):
+            dump_list(this.paths(), name, depth)
         elif isinstance(this, List):
             dump_list(this, name, depth)
+        elif isinstance(this, PathSet):
+            dump_set(this.paths(), name, depth)
         elif isinstance(this, Set):
             dump_set(this, name, depth)
         else:
@@ -245,8 +339,13 @@ def shell_line_to_o_files_list(line: str) -> List[str]:
 
 
 def run(args: List[str],
-        raise_on_failure: bool = True) -> subprocess.CompletedProcess:
-    """Run the program specified in args[0] with the arguments in args[1:]."""
+        raise_on_failure: bool = True,
+        cwd: Optional[str] = None,
+        stdin: Optional[str] = None) -> subprocess.CompletedProcess:
+    """Run the program specified in args[0] with the arguments in args[1:].
+
+    The program is run in the directory cwd, with stdin as its input.
+    """
     try:
         #   This argument does not always work for subprocess.run() below:
         #       check=False
@@ -255,7 +354,11 @@ def run(args: List[str],
         #   prevents an exception from being raised if the program that
         #   will be executed is not found
 
-        completion = subprocess.run(args, capture_output=True, text=True)
+        completion = subprocess.run(args,
+                                    capture_output=True,
+                                    text=True,
+                                    cwd=cwd,
+                                    input=stdin)
         if completion.returncode != 0 and raise_on_failure:
             raise StopError("execution failed for: " + " ".join(args))
         return completion
@@ -264,6 +367,107 @@ def run(args: List[str],
                         "original OSError: " + str(os_error.args))
 
 
+#   Archives, see ar(5) and the GNU ar documentation, are made of:
+#       a magic string, AR_MAGIC or AR_THIN_MAGIC for thin archives
+#       members, each a header of AR_HEADER_SIZE bytes followed by the data
+#           of size bytes, padded to an even size
+#   Thin archives only contain the symbol table and the long names table,
+#   their other members are files referred to by name.
+
+AR_MAGIC = b"!<arch>\n"
+AR_THIN_MAGIC = b"!<thin>\n"
+AR_HEADER_SIZE = 60
+AR_NAME_SIZE = 16
+AR_SIZE_OFFSET = 48
+AR_SIZE_SIZE = 10
+AR_FMAG = b"`\n"
+
+#   Archive members listed by archive_members(), by archive, with the
+#   st_mtime_ns and st_size of the archive they were listed for.
+
+_archive_members_cache = {}  # type: Dict[str, Tuple[int, int, List[str]]]
+
+
+def archive_members(archive: str) -> List[str]:
+    """Return the names of the members of an archive, like "ar t" does.
+
+    The members of thin archives are files named relative to the directory of
+    the archive, their names are returned joined to that directory.  The
+    results are memoized on the path and the modification time of the
+    archive.
+    """
+    try:
+        stat = os.stat(archive)
+    except OSError as os_error:
+        raise StopError("archive_members() failed for: " + archive + "\n"
+                        "original OSError: " + str(os_error.args))
+    cached = _archive_members_cache.get(archive)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    try:
+        with open(archive, "rb") as file:
+            if stat.st_size == 0:
+                raise StopError("not an archive: " + archive)
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                members = read_archive_members(data, archive)
+    except OSError as os_error:
+        raise StopError("archive_members() failed for: " + archive + "\n"
+                        "original OSError: " + str(os_error.args))
+    _archive_members_cache[archive] = (stat.st_mtime_ns, stat.st_size, members)
+    return members
+
+
+def read_archive_members(data, archive: str) -> List[str]:
+    """Return the names of the members of the archive in data."""
+    magic = data[:len(AR_MAGIC)]
+    if magic not in (AR_MAGIC, AR_THIN_MAGIC):
+        raise StopError("not an archive: " + archive)
+    thin = magic == AR_THIN_MAGIC
+    long_names = b""
+    members = []
+    offset = len(AR_MAGIC)
+    while offset < len(data):
+        header = data[offset:offset + AR_HEADER_SIZE]
+        if len(header) != AR_HEADER_SIZE or header[-2:] != AR_FMAG:
+            raise StopError(f"corrupt archive member header at {offset} in: "
+                            f"{archive}")
+        name = header[:AR_NAME_SIZE].rstrip(b" ")
+        try:
+            size = int(header[AR_SIZE_OFFSET:AR_SIZE_OFFSET + AR_SIZE_SIZE])
+        except ValueError:
+            raise StopError(f"corrupt archive member size at {offset} in: "
+                            f"{archive}")
+        offset += AR_HEADER_SIZE
+        end = offset + size
+
+        if name in (b"/", b"/SYM64/", b"__.SYMDEF", b"__.SYMDEF SORTED"):
+            pass  # symbol table
+        elif name == b"//":
+            long_names = data[offset:offset + size]
+        else:
+            if name.startswith(b"#1/") and name[3:].isdigit():  # BSD
+                name_size = int(name[3:])  # the name precedes the data
+                name = data[offset:offset + name_size].rstrip(b"\0")
+            elif name[:1] == b"/" and name[1:].isdigit():  # GNU, long name
+                start = int(name[1:])
+                stop = long_names.find(b"/\n", start)
+                if stop < 0:
+                    raise StopError(f"corrupt archive long name at {offset} "
+                                    f"in: {archive}")
+                name = long_names[start:stop]
+            elif name.endswith(b"/"):  # GNU, short name
+                name = name[:-1]
+            if thin:
+                members.append(
+                    os.path.join(os.path.dirname(archive), os.fsdecode(name)))
+                end = offset  # the member data is not in the archive
+            else:
+                members.append(os.fsdecode(name))
+
+        offset = end + (end & 1)
+    return members
+
+
 class KernelModule:
     """A kernel module, i.e. a *.ko file."""
     def __init__(self, kofile: str) -> None:
@@ -356,6 +560,15 @@ class KernelModule:
         build_dir = self._file[0:index]
         return build_dir
 
+    def get_input_files(self) -> List[str]:
+        """Return the files read to make the kernel module object files."""
+        kofile_name, _ = os.path.splitext(self._base)
+        return [
+            self._cmd_file,
+            os.path.join(self.get_build_dir(), self._rel_dir,
+                         "." + kofile_name + ".o.cmd")
+        ]
+
     def get_object_files(self, build_dir: str) -> List[str]:
         """Return a list object files that used to link the kernel module.
 
@@ -410,6 +623,13 @@ class Kernel:
         """
         return self._build_dir
 
+    def get_input_files(self) -> List[str]:
+        """Return the files read to make the kernel object files."""
+        return [
+            os.path.join(self._build_dir, "vmlinux.libs"),
+            os.path.join(self._build_dir, "vmlinux.objs")
+        ] + [file for file in self._archives_and_objects if file.endswith(".a")]
+
     def get_object_files(self, build_dir: str) -> List[str]:
         """Return a list object files that where used to link the kernel."""
         olist = []
@@ -423,10 +643,7 @@ class Kernel:
             if not file.endswith(".a"):
                 raise StopError("unknown file type: " + file)
 
-            completion = run(["ar", "t", file])
-            objs = lines_to_list(completion.stdout)
-
-            for obj in objs:
+            for obj in archive_members(file):
                 if not os.path.isabs(obj):
                     obj = os.path.join(build_dir, obj)
                 olist.append(os.path.realpath(obj))
@@ -458,7 +675,7 @@ class Target:  # pylint: disable=too-few-public-methods
     SRC_INDEX = -1
 
     def __init__(self, obj: str, src: str, cc_line: str,
-                 deps: List[str]) -> None:
+                 deps: "PathList") -> None:
         self._obj = obj
         self._src = src
         self._deps = deps
@@ -545,6 +762,62 @@ class Target:  # pylint: disable=too-few-public-methods
 
         self._cc_list = cc_list
 
+    def get_source(self) -> str:
+        """Return the C source file of the target."""
+        return self._src
+
+    def get_flags(self) -> List[str]:
+        """Return the compiler and its flags, without file specific ones.
+
+        The "-Wp,-MD,file.o.d", "-c -o file.o file.c" and the -D of the
+        FILE_SPECIFIC_MACROS are removed, what remains is the same for all
+        the files compiled with the same configuration.
+        """
+        flags = self._cc_list[:Target.C_FLAG_INDEX]
+        del flags[Target.WP_MD_FLAG_INDEX]
+        return [
+            flag for flag in flags
+            if not FILE_SPECIFIC_MACROS_RE.match(flag)
+        ]
+
+    def get_headers(self) -> List[str]:
+        """Return the headers the target depends on, in inclusion order."""
+        return [dep for dep in self._deps.paths() if dep.endswith(".h")]
+
+
+def get_targets(build_dir: str,
+                files_o: List[str]) -> Tuple[List[Target], PathSet]:
+    """Return the targets for files_o and the headers they depend on.
+
+    Object files that were not compiled from a C source file have no target.
+    """
+    deps_set = PathSet()
+
+    targets = []
+    for obj in files_o:
+        file_must_exist(obj)
+        result = get_src_ccline_deps(obj)
+        if result is None:
+            continue
+        src, cc_line, dependendencies = result
+
+        file_must_exist(src)
+        depends = PathList()
+        for dep in dependendencies:
+            if not os.path.isabs(dep):
+                dep = os.path.join(build_dir, dep)
+            ident = PATHS.intern(dep)
+            depends.append(ident)
+            if PATHS.path(ident).endswith(".h"):
+                deps_set.add(ident)
+
+        if not os.path.isabs(src):
+            src = os.path.join(build_dir, src)
+        src = PATHS.path(PATHS.intern(src))
+        targets.append(Target(obj, src, cc_line, depends))
+
+    return targets, deps_set
+
 
 class KernelComponentBase:  # pylint: disable=too-few-public-methods
     """Base class for KernelComponentCreationError and KernelComponent.
@@ -562,6 +835,22 @@ class KernelComponentBase:  # pylint: disable=too-few-public-methods
         """Return the set of dependencies for the kernel component."""
         return set()
 
+    def get_header_ids(self) -> PathSet:  # pylint: disable=no-self-use
+        """Return the ids in PATHS of the dependencies."""
+        return PathSet()
+
+    def get_targets(self) -> List[Target]:  # pylint: disable=no-self-use
+        """Return the targets of the kernel component."""
+        return []
+
+    def get_filename(self) -> str:  # pylint: disable=no-self-use
+        """Return the file name the kernel component was made for."""
+        return ""
+
+    def get_input_files(self) -> List[str]:  # pylint: disable=no-self-use
+        """Return the files read to make the component."""
+        return []
+
     def is_kernel(self) -> bool:  # pylint: disable=no-self-use
         """Is this the kernel?"""
         return False
@@ -583,6 +872,10 @@ class KernelComponentCreationError(KernelComponentBase):  # pylint: disable=too-
         """Return the error."""
         return self._filename + ": " + self._error
 
+    def get_filename(self) -> str:
+        """Return the file name the kernel component was made for."""
+        return self._filename
+
 
 class KernelComponent(KernelComponentBase):
     """A kernel component, either vmlinux.o or a *.ko file.
@@ -591,8 +884,14 @@ class KernelComponent(KernelComponentBase):
     determine what was used to build it: object filess, source files, header
     files, and other information that is produced as a by-product of its build.
     """
-    def __init__(self, filename: str) -> None:
-        """Construct a KernelComponent object."""
+    def __init__(self, filename: str, make_targets: bool = True) -> None:
+        """Construct a KernelComponent object.
+
+        If make_targets is False, the targets are not made, instead they can
+        be made by get_targets() for slices of get_object_files(), possibly
+        concurrently, and added with add_targets().
+        """
+        self._filename = filename
         if filename.endswith("vmlinux.o"):
             self._kernel = True
             self._kind = Kernel(filename)
@@ -603,35 +902,15 @@ class KernelComponent(KernelComponentBase):
         self._source_dir = self._get_source_dir()
         self._files_o = self._kind.get_object_files(self._build_dir)
         self._files_o.sort()
-
-        #   using a set because there is no unique flag to list.sort()
-        deps_set = set()
-
         self._targets = []
-        for obj in self._files_o:
-            file_must_exist(obj)
-            result = get_src_ccline_deps(obj)
-            if result is None:
-                continue
-            src, cc_line, dependendencies = result
-
-            file_must_exist(src)
-            depends = []
-            for dep in dependendencies:
-                if not os.path.isabs(dep):
-                    dep = os.path.join(self._build_dir, dep)
-                dep = os.path.realpath(dep)
-                depends.append(dep)
-                deps_set.add(dep)
-
-            if not os.path.isabs(src):
-                src = os.path.join(self._build_dir, src)
-            src = os.path.realpath(src)
-            self._targets.append(Target(obj, src, cc_line, depends))
-
-        for dep in [dep for dep in list(deps_set) if not dep.endswith(".h")]:
-            deps_set.remove(dep)
-        self._deps_set = deps_set
+        self._deps_set = PathSet()
+        if make_targets:
+            self.add_targets(*get_targets(self._build_dir, self._files_o))
+
+    def add_targets(self, targets: List[Target], deps_set: PathSet) -> None:
+        """Add targets made by get_targets() for some of the object files."""
+        self._targets += targets
+        self._deps_set |= deps_set
 
     def _get_source_dir(self) -> str:
         """Return the top level Linux kernel source directory."""
@@ -648,67 +927,565 @@ class KernelComponent(KernelComponentBase):
 
         return source_dir
 
+    def get_build_dir(self) -> str:
+        """Return the top level build directory."""
+        return self._build_dir
+
+    def get_object_files(self) -> List[str]:
+        """Return the sorted object files used to link the component."""
+        return self._files_o
+
+    def get_input_files(self) -> List[str]:
+        """Return the files read to make the component."""
+        files = self._kind.get_input_files()
+        files += [cmd_file(obj) for obj in self._files_o]
+        return list(dict.fromkeys(files))
+
     def get_deps_set(self) -> Set[str]:
         """Return the set of dependencies for the kernel component."""
+        return self._deps_set.paths()
+
+    def get_header_ids(self) -> PathSet:
+        """Return the ids in PATHS of the dependencies."""
         return self._deps_set
 
+    def get_targets(self) -> List[Target]:
+        """Return the targets of the kernel component."""
+        return self._targets
+
+    def get_filename(self) -> str:
+        """Return the file name the kernel component was made for."""
+        return self._filename
+
     def is_kernel(self) -> bool:
         """Is this the kernel?"""
         return self._kernel
 
 
-def kernel_component_factory(filename: str) -> KernelComponentBase:
+def kernel_component_factory(filename: str,
+                             make_targets: bool = True) -> KernelComponentBase:
     """Make an InfoKmod or an InfoKernel object for file and return it."""
     try:
-        return KernelComponent(filename)
+        return KernelComponent(filename, make_targets)
     except StopError as stop_error:
         return KernelComponentCreationError(filename,
                                             " ".join([*stop_error.args]))
 
 
-class KernelComponentProcess(multiprocessing.Process):
-    """Process to make the KernelComponent concurrently."""
-    def __init__(self) -> None:
-        multiprocessing.Process.__init__(self)
-        self._queue = multiprocessing.Queue()
-        self.start()
+#   The estimated cost of the work for an object file linked into a kernel
+#   component is the size of its .o.cmd file, which is dominated by the list
+#   of its dependencies, each of which is resolved.  Kernel modules made of
+#   several object files only list them in their .o.cmd file, each of those
+#   object files is estimated to cost OBJECT_COST, a typical .o.cmd size.
+
+OBJECT_COST = 16384
+
+#   The work is split in about CHUNKS_PER_JOB chunks for every job, so that
+#   the jobs that finish early take more chunks, while the overhead of
+#   sending the chunks and the results between processes stays low.
+
+CHUNKS_PER_JOB = 4
+
+
+class WorkItem(NamedTuple):
+    """Work to make (part of) a kernel component.
+
+    For a kernel module, objs is None and the whole component is made.  The
+    kernel has many more object files than any module, its targets are made
+    in slices of objs, the index-th slice of the kernel, each a WorkItem.
+    """
+    cost: int
+    filename: str
+    build_dir: str = ""
+    objs: Optional[List[str]] = None
+    index: int = 0
+
+
+def cmd_file(file: str) -> str:
+    """Return the name of the .cmd file for file."""
+    return os.path.join(os.path.dirname(file),
+                        "." + os.path.basename(file) + ".cmd")
+
+
+def cmd_file_size(file: str) -> int:
+    """Return the size of the .cmd file for file, 0 if there is none."""
+    try:
+        return os.stat(cmd_file(file)).st_size
+    except OSError:
+        return 0
+
+
+def estimate_module_cost(kofile: str) -> int:
+    """Return the estimated cost of making the component for kofile."""
+    obj = kofile[:-len(".ko")] + ".o"
+    cost = cmd_file_size(obj)
+    if cost < OBJECT_COST:
+        #   Possibly a single line, linking several object files, see
+        #   KernelModule.get_object_files().
+        try:
+            olines = lines_to_list(readfile(cmd_file(obj)))
+            if len(olines) == 1:
+                _, ldline = makefile_assignment_split(olines[0])
+                cost = OBJECT_COST * len(shell_line_to_o_files_list(ldline))
+        except StopError:
+            pass
+    return cost
+
+
+def make_chunks(items: List[WorkItem], target: int) -> List[List[WorkItem]]:
+    """Group the work items in chunks of similar cost, costliest first.
+
+    The items are taken by decreasing cost, so the costliest ones are started
+    first, each of them in its own chunk, the cheap ones at the end are
+    grouped in chunks up to the target cost.
+    """
+    chunks = []
+    chunk = []
+    chunk_cost = 0
+    for item in sorted(items, key=lambda item: item.cost, reverse=True):
+        chunk.append(item)
+        chunk_cost += item.cost
+        if chunk_cost >= target:
+            chunks.append(chunk)
+            chunk = []
+            chunk_cost = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def split_kernel(kernel: KernelComponent, target: int) -> List[WorkItem]:
+    """Return work items for slices of the kernel object files.
+
+    The slices have an estimated cost of about target.
+    """
+    items = []
+    objs = []
+    cost = 0
+    for obj in kernel.get_object_files():
+        objs.append(obj)
+        cost += cmd_file_size(obj)
+        if cost >= target:
+            items.append(
+                WorkItem(cost, "vmlinux.o", kernel.get_build_dir(), objs,
+                         len(items)))
+            objs = []
+            cost = 0
+    if objs or not items:
+        items.append(
+            WorkItem(cost, "vmlinux.o", kernel.get_build_dir(), objs,
+                     len(items)))
+    return items
+
+
+def work_on_item(item: WorkItem):
+    """Do the work for a work item.
+
+    Returns the KernelComponentBase of a kernel module, the result of
+    get_targets() for a slice of the kernel, or a KernelComponentCreationError.
+    """
+    if item.objs is None:
+        return kernel_component_factory(item.filename)
+    try:
+        return get_targets(item.build_dir, item.objs)
+    except StopError as stop_error:
+        return KernelComponentCreationError(item.filename,
+                                            " ".join([*stop_error.args]))
+
+
+def work_on_chunk(chunk: List[WorkItem]) -> List[Tuple[WorkItem, float, object]]:
+    """Do the work for the work items in a chunk, timing each of them."""
+    results = []
+    for item in chunk:
+        start = time.perf_counter()
+        result = work_on_item(item)
+        results.append((item, time.perf_counter() - start, result))
+    return results
 
-    def run(self) -> None:
-        """Create and save the KernelComponent."""
-        self._queue.put(kernel_component_factory("vmlinux.o"))
 
-    def get_component(self) -> KernelComponentBase:
-        """Return the kernel component."""
-        kernel_component = self._queue.get()
-        self.join()  # must be after queue.get() otherwise it deadlocks
-        return kernel_component
+#   The state saved by ComponentState.  Bump STATE_VERSION when what it holds
+#   changes.  The modification time of a file modified less than RACY_SECONDS
+#   before the state is saved is not recorded, as the file could be modified
+#   again within the granularity of the modification time, its contents are
+#   compared instead.
 
+STATE_VERSION = 1
+RACY_SECONDS = 2
 
-def work_on_all_components(options) -> List[KernelComponentBase]:
-    """Return a list of KernelComponentBase objects."""
-    files = [str(ko) for ko in pathlib.Path().rglob("*.ko")]
+#   The fingerprint of a file: its path, size, modification time in
+#   nanoseconds (or -1 if it is not recorded) and SHA-256 of the contents.
+
+Fingerprint = Tuple[str, int, int, str]
+
+
+def recorded_mtime_ns(stat: os.stat_result, now: float) -> int:
+    """Return the modification time to record, see RACY_SECONDS for now."""
+    if now - stat.st_mtime_ns / 1e9 < RACY_SECONDS:
+        return -1
+    return stat.st_mtime_ns
+
+
+def fingerprint(file: str, now: float) -> Fingerprint:
+    """Return the fingerprint of file, see RACY_SECONDS for now."""
+    stat = os.stat(file)
+    return file, stat.st_size, recorded_mtime_ns(stat, now), hash_file(file)
+
+
+class ComponentState:
+    """Kernel components saved with the fingerprints of their input files.
+
+    Reusing a kernel component whose input files did not change spares
+    reading and parsing all its .cmd files again.  A file is unchanged if
+    its size and modification time, or otherwise its contents, are the same.
+    """
+    def __init__(self, path: str) -> None:
+        """Load the state saved in path, if there is a usable one."""
+        self._path = path
+        #   The fingerprints and the component, by file.
+        self._components = {
+        }  # type: Dict[str, Tuple[List[Fingerprint], KernelComponentBase]]
+        try:
+            with open(path, "rb") as file:
+                state = pickle.load(file)
+            if state["version"] == STATE_VERSION:
+                self._components = state["components"]
+        #   Unpickling can fail in many ways, e.g. AttributeError for a class
+        #   that was renamed; any unusable state is a cold start.
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    def reusable(self, files: List[str]) -> Dict[str, KernelComponentBase]:
+        """Return the components of files that can be reused, by file."""
+        now = time.time()
+        reusable = {}
+        for file in files:
+            entry = self._components.get(file)
+            if entry is None:
+                continue
+            fingerprints = []
+            for path, size, mtime_ns, digest in entry[0]:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    break
+                if stat.st_size != size:
+                    break
+                if (stat.st_mtime_ns != mtime_ns
+                        and hash_file(path) != digest):
+                    break
+                fingerprints.append(
+                    (path, size, recorded_mtime_ns(stat, now), digest))
+            else:
+                reusable[file] = entry[1]
+                self._components[file] = (fingerprints, entry[1])
+        return reusable
+
+    def save(self, components: List[KernelComponentBase]) -> None:
+        """Save the components, with the fingerprints of their input files.
+
+        Components with errors are not saved, nor are those whose input files
+        can not be read.
+        """
+        now = time.time()
+        saved = {}
+        for comp in components:
+            if comp.get_error():
+                continue
+            filename = comp.get_filename()
+            entry = self._components.get(filename)
+            if entry and entry[1] is comp:
+                saved[filename] = entry
+                continue
+            try:
+                fingerprints = [
+                    fingerprint(file, now) for file in comp.get_input_files()
+                ]
+            except OSError:
+                continue
+            saved[filename] = (fingerprints, comp)
+        self._components = saved
+        temporary = self._path + ".tmp"
+        with open(temporary, "wb") as file:
+            pickle.dump({
+                "version": STATE_VERSION,
+                "components": saved
+            }, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self._path)
+
+
+def make_components(files: List[str], options,
+                    timing: Dict[str, float]) -> Dict[str, KernelComponentBase]:
+    """Return the KernelComponentBase objects for files, by file.
+
+    The time to make each is added to timing, the time to make the kernel is
+    the sum of the time for all its slices.
+    """
     if options.sequential:
-        return [
-            kernel_component_factory(file) for file in ["vmlinux.o"] + files
-        ]
+        components = {}
+        for file in files:
+            start = time.perf_counter()
+            components[file] = kernel_component_factory(file)
+            timing[file] += time.perf_counter() - start
+        return components
 
     #  There is significantly more work to be done for the vmlinux.o than
-    #  the *.ko kernel modules.  A dedicated process is started to do the
-    #  work for vmlinux.o as soon as possible instead of leaving it to the
-    #  vagaries of multiprocessing.Pool() and how it would spreads the work.
-    #  This significantly reduces the elapsed time for this work.
+    #  for any of the *.ko kernel modules.  Instead of making it in one
+    #  process, which would be the last one to finish, its object files are
+    #  split in slices that are worked on like the kernel modules.  All the
+    #  work is ordered by its estimated cost and handed out in chunks to the
+    #  processes as they become idle.
+
+    kernel = None
+    if "vmlinux.o" in files:
+        start = time.perf_counter()
+        kernel = kernel_component_factory("vmlinux.o", make_targets=False)
+        timing["vmlinux.o"] += time.perf_counter() - start
+
+    jobs = options.jobs or os.cpu_count() or 1
+    items = [
+        WorkItem(estimate_module_cost(file), file) for file in files
+        if file != "vmlinux.o"
+    ]
+    total = sum(item.cost for item in items)
+    if kernel and not kernel.get_error():
+        total += sum(cmd_file_size(obj) for obj in kernel.get_object_files())
+    target = max(1, total // (jobs * CHUNKS_PER_JOB))
+    if kernel and not kernel.get_error():
+        items += split_kernel(kernel, target)
+    chunks = make_chunks(items, target)
+
+    components = {}
+    kernel_slices = {}
+    if chunks:
+        with multiprocessing.Pool(min(jobs, len(chunks))) as pool:
+            for results in pool.imap_unordered(work_on_chunk, chunks):
+                for item, seconds, result in results:
+                    timing[item.filename] += seconds
+                    if item.objs is None:
+                        components[item.filename] = result
+                    else:
+                        kernel_slices[item.index] = result
+
+    for index in sorted(kernel_slices):
+        result = kernel_slices[index]
+        if isinstance(result, KernelComponentBase):
+            kernel = result
+            break
+        kernel.add_targets(*result)
+    if kernel:
+        components["vmlinux.o"] = kernel
+    return components
+
+
+def work_on_all_components(
+        options) -> Tuple[List[KernelComponentBase], Dict[str, float]]:
+    """Return a list of KernelComponentBase objects and the time to make each.
+
+    With options.state, the components whose input files did not change
+    since the state was saved are reused, see ComponentState.
+    """
+    files = ["vmlinux.o"] + [str(ko) for ko in pathlib.Path().rglob("*.ko")]
+    timing = collections.defaultdict(float)
+    state = ComponentState(options.state) if options.state else None
+    components = state.reusable(files) if state else {}
+    components.update(
+        make_components([file for file in files if file not in components],
+                        options, timing))
+    result = [components[file] for file in files]
+    if state:
+        state.save(result)
+    return result, timing
+
+
+def report_timing(timing: Dict[str, float], count: int) -> None:
+    """Print the time to make the count slowest kernel components."""
+    print(f"{sum(timing.values()):10.3f}s total for {len(timing)} components",
+          file=sys.stderr)
+    slowest = sorted(timing.items(), key=lambda entry: entry[1], reverse=True)
+    for file, seconds in slowest[:count]:
+        print(f"{seconds:10.3f}s {file}", file=sys.stderr)
+
+
+#   The #define compile time constants are extracted by running the
+#   preprocessor with -E -dM on a translation unit made of #include
+#   directives for the headers a target depends on, in the order in which
+#   they were first included.  The result only depends on the flags (see
+#   Target.get_flags()) and on the contents of those headers, that is what
+#   the key of a DefinesJob is computed from.  All the targets with the same
+#   key share one run of the preprocessor, whose result can be kept in a
+#   DefinesCache for later runs.  The number of runs is then the number of
+#   distinct configurations, rather than the number of files.
+#
+#   Some headers can only be included in a specific context, for example
+#   trace event headers, and the preprocessor fails on them.  For the targets
+#   depending on those the preprocessor is run on the C source file instead,
+#   the key of that run also covers the contents of the source file, and the
+#   macros defined in the source file itself are part of its result.
+#
+#   The macros of FILE_SPECIFIC_MACROS_RE are left out, headers are assumed
+#   not to depend on their definition.
+
+DEFINES_VERSION = "1"
 
-    kernel_component_process = KernelComponentProcess()
+#   The result of a run of the preprocessor that failed.  A successful run
+#   is never empty, it at least defines the predefined macros.
 
-    chunk_size = 128
-    processes = max(1, len(files) // (chunk_size * 3))
-    processes = min(processes, os.cpu_count())
-    with multiprocessing.Pool(processes) as pool:
-        components = pool.map(kernel_component_factory, files, chunk_size)
+DEFINES_FAILED = ""
 
-    kernel_component = kernel_component_process.get_component()
+_file_digests = {}  # type: Dict[str, str]
 
-    return [kernel_component] + components
+
+def hash_file(file: str) -> str:
+    """Return the SHA-256 of the contents of file."""
+    try:
+        with open(file, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return "missing"
+
+
+def file_digest(file: str) -> str:
+    """Return hash_file(file), memoized on the path for the whole run."""
+    digest = _file_digests.get(file)
+    if digest is None:
+        digest = _file_digests[file] = hash_file(file)
+    return digest
+
+
+class DefinesJob(NamedTuple):
+    """A run of the preprocessor to extract macro definitions.
+
+    The headers are preprocessed, or the source if it is not None.
+    """
+    key: str
+    build_dir: str
+    flags: List[str]
+    headers: List[str]
+    source: Optional[str] = None
+
+
+def make_defines_job(build_dir: str,
+                     target: Target,
+                     on_source: bool = False) -> DefinesJob:
+    """Return the DefinesJob for target, see DefinesJob."""
+    flags = target.get_flags()
+    headers = target.get_headers()
+    digest = hashlib.sha256()
+    for part in [DEFINES_VERSION, build_dir, *flags, ""]:
+        digest.update(part.encode() + b"\0")
+    for header in headers:
+        digest.update(f"{header}\0{file_digest(header)}\0".encode())
+    source = None
+    if on_source:
+        source = target.get_source()
+        digest.update(f"{source}\0{file_digest(source)}\0".encode())
+    return DefinesJob(digest.hexdigest(), build_dir, flags, headers, source)
+
+
+def run_defines_job(job: DefinesJob) -> Tuple[str, str]:
+    """Return the key of job and the -dM output, or DEFINES_FAILED."""
+    if job.source is None:
+        args = [*job.flags, "-E", "-dM", "-x", "c", "-"]
+        stdin = "".join(f'#include "{header}"\n' for header in job.headers)
+    else:
+        args = [*job.flags, "-E", "-dM", job.source]
+        stdin = None
+    try:
+        completion = run(args,
+                         raise_on_failure=False,
+                         cwd=job.build_dir,
+                         stdin=stdin)
+    except StopError:
+        return job.key, DEFINES_FAILED
+    if completion.returncode != 0:
+        return job.key, DEFINES_FAILED
+    return job.key, completion.stdout
+
+
+class DefinesCache:
+    """The results of DefinesJob runs stored in a directory, by key."""
+    def __init__(self, directory: str) -> None:
+        self._directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the result of the job with key, None if it is not cached."""
+        try:
+            with open(self._path(key)) as file:
+                # Failures stored by earlier versions are not results.
+                return file.read() or None
+        except OSError:
+            return None
+
+    def put(self, key: str, defines: str) -> None:
+        """Store the result of the job with key."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile("w",
+                                         dir=os.path.dirname(path),
+                                         delete=False) as file:
+            file.write(defines)
+        os.replace(file.name, path)
+
+
+def extract_defines(
+        components: List[KernelComponentBase],
+        options) -> Tuple[List[List[str]], List[str]]:
+    """Return the sorted #define lines of every component and the errors."""
+    cache = DefinesCache(options.defines_cache) if options.defines_cache else None
+    results = {}  # type: Dict[str, str]
+
+    def run_jobs(jobs: Dict[str, DefinesJob]) -> None:
+        """Run the jobs that are not cached, and store their results."""
+        pending = []
+        for key, job in jobs.items():
+            defines = cache.get(key) if cache else None
+            if defines is None:
+                pending.append(job)
+            else:
+                results[key] = defines
+        processes = min(options.jobs or os.cpu_count() or 1, len(pending))
+        if options.sequential or processes <= 1:
+            outcomes = [run_defines_job(job) for job in pending]
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                outcomes = list(pool.imap_unordered(run_defines_job, pending))
+        for key, defines in outcomes:
+            results[key] = defines
+            # A failure may be transient, e.g. a header being rewritten.
+            if cache and defines != DEFINES_FAILED:
+                cache.put(key, defines)
+
+    targets = [(index, comp.get_build_dir(), target)
+               for index, comp in enumerate(components)
+               for target in comp.get_targets()]
+    keys = []
+    jobs = {}
+    for _, build_dir, target in targets:
+        job = make_defines_job(build_dir, target)
+        jobs.setdefault(job.key, job)
+        keys.append(job.key)
+    run_jobs(jobs)
+
+    jobs = {}
+    for i, (_, build_dir, target) in enumerate(targets):
+        if results[keys[i]] == DEFINES_FAILED:
+            job = make_defines_job(build_dir, target, on_source=True)
+            jobs.setdefault(job.key, job)
+            keys[i] = job.key
+    run_jobs(jobs)
+
+    defines = [set() for _ in components]  # type: List[Set[str]]
+    errors = []
+    for (index, _, target), key in zip(targets, keys):
+        if results[key] == DEFINES_FAILED:
+            errors.append("could not extract the macros of: " +
+                          target.get_source())
+            continue
+        defines[index].update(lines_to_list(results[key]))
+    return [sorted(lines) for lines in defines], errors
 
 
 def work_on_whole_build(options) -> int:
@@ -716,17 +1493,18 @@ def work_on_whole_build(options) -> int:
     if not os.path.isfile("vmlinux.o"):
         logging.error("file not found: vmlinux.o")
         return 1
-    components = work_on_all_components(options)
+    components, timing = work_on_all_components(options)
+    if options.timing:
+        report_timing(timing, options.timing)
     failed = False
-    header_count = collections.defaultdict(int)
+    header_count = [0] * len(PATHS)
     for comp in components:
         error = comp.get_error()
         if error:
             logging.error(error)
             failed = True
             continue
-        deps_set = comp.get_deps_set()
-        for header in deps_set:
+        for header in comp.get_header_ids():
             header_count[header] += 1
     if failed:
         return 1
@@ -734,14 +1512,31 @@ def work_on_whole_build(options) -> int:
         dump(components)
     if options.dump and options.includes:
         print()
+    if options.index:
+        kmi_defines_index.write_index(
+            options.index, {
+                comp.get_filename(): comp.get_deps_set()
+                for comp in components
+            })
     if options.includes:
-        for header, count in header_count.items():
+        for header, count in enumerate(header_count):
             if count >= 2:
-                print(header)
+                print(PATHS.path(header))
+    if options.defines:
+        defines, errors = extract_defines(components, options)
+        for error in errors:
+            logging.error(error)
+        for comp, lines in zip(components, defines):
+            print(comp.get_filename() + ":")
+            for line in lines:
+                print(line)
+            print()
+        if errors:
+            return 1
     return 0
 
 
-def main() -> int:
+def main(argv: Optional[List[str]] = None) -> int:
     """Extract #define compile time constants from a Linux build."""
     def existing_file(file):
         if not os.path.isfile(file):
@@ -758,16 +1553,43 @@ def main() -> int:
                         "--sequential",
                         action="store_true",
                         help="execute without concurrency")
+    parser.add_argument("-j",
+                        "--jobs",
+                        type=int,
+                        help="number of processes (default: CPU count)")
+    parser.add_argument("-t",
+                        "--timing",
+                        type=int,
+                        nargs="?",
+                        const=20,
+                        metavar="COUNT",
+                        help="show the time to make the COUNT (default: 20)"
+                        " slowest components")
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-i",
                        "--includes",
                        action="store_true",
                        help="show relevant include files")
+    group.add_argument("-D",
+                       "--defines",
+                       action="store_true",
+                       help="show the #define macros of every component")
     group.add_argument("-c",
                        "--component",
                        type=existing_file,
                        help="show information for a component")
-    options = parser.parse_args()
+    parser.add_argument("--index",
+                        metavar="FILE",
+                        help="write the index of the headers used by every"
+                        " component to FILE, see kmi_defines_index")
+    parser.add_argument("--state",
+                        metavar="FILE",
+                        help="reuse the components whose files did not"
+                        " change since the state was saved in FILE")
+    parser.add_argument("--defines-cache",
+                        metavar="DIR",
+                        help="keep the results of --defines in DIR")
+    options = parser.parse_args(argv)
 
     if not options.component:
         return work_on_whole_build(options)
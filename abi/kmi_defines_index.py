@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Inverted index of the headers used by the components of a Linux build.
+
+The index is written by kmi_defines --index, it answers which kernel
+components (vmlinux.o and *.ko) depend on a header, and which headers a
+component depends on, without reparsing the build.  It is queried in place
+through mmap, so a query costs a few binary searches.
+
+The file is made of little endian 32 bit unsigned integers, followed by
+NUL separated strings:
+
+    magic               MAGIC
+    header              C = component count, H = header count, E = edge
+                        count, S = size of the strings
+    string_offsets      C + H + 1 offsets in the strings, the components
+                        sorted, then the headers sorted
+    header_offsets      H + 1 offsets in header_components
+    header_components   E component ids, for every header
+    component_offsets   C + 1 offsets in component_headers
+    component_headers   E header ids, for every component
+    strings             S bytes
+
+Usage:
+
+    kmi_defines_index INDEX HEADER...
+    kmi_defines_index INDEX --headers COMPONENT...
+"""
+
+import argparse
+import array
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, Iterable, List, Optional
+
+MAGIC = b"KMIDIDX\x01"
+FILE_HEADER = struct.Struct("<IIII")
+
+
+def _csr(count: int, edges: List[List[int]]) -> bytes:
+    """Return the offsets and the targets of edges, as array bytes."""
+    offsets = array.array("I", [0])
+    targets = array.array("I")
+    for index in range(count):
+        targets.extend(sorted(edges[index]))
+        offsets.append(len(targets))
+    return _little_endian(offsets) + _little_endian(targets)
+
+
+def _little_endian(values: array.array) -> bytes:
+    if sys.byteorder != "little":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_index(path: str, component_headers: Dict[str, Iterable[str]]) -> None:
+    """Write the index of component_headers, a component to headers dict."""
+    components = sorted(component_headers)
+    headers = sorted({
+        header
+        for component_headers_set in component_headers.values()
+        for header in component_headers_set
+    })
+    header_ids = {header: index for index, header in enumerate(headers)}
+    headers_of = []
+    components_of = [[] for _ in headers]  # type: List[List[int]]
+    for component_id, component in enumerate(components):
+        ids = sorted({header_ids[header]
+                      for header in component_headers[component]})
+        headers_of.append(ids)
+        for header_id in ids:
+            components_of[header_id].append(component_id)
+    edges = sum(len(ids) for ids in headers_of)
+
+    strings = bytearray()
+    string_offsets = array.array("I")
+    for string in components + headers:
+        string_offsets.append(len(strings))
+        strings += os.fsencode(string) + b"\0"
+    string_offsets.append(len(strings))
+
+    data = b"".join([
+        MAGIC,
+        FILE_HEADER.pack(len(components), len(headers), edges, len(strings)),
+        _little_endian(string_offsets),
+        _csr(len(headers), components_of),
+        _csr(len(components), headers_of),
+        bytes(strings),
+    ])
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+
+class Index:
+    """An index written by write_index(), read in place."""
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = len(MAGIC) + FILE_HEADER.size
+        if (len(self._data) < offset
+                or self._data[:len(MAGIC)] != MAGIC):
+            self._data.close()
+            raise ValueError("not a kmi_defines index: " + path)
+        (self._component_count, self._header_count, edges,
+         strings_size) = FILE_HEADER.unpack_from(self._data, len(MAGIC))
+        integers = (2 * self._component_count + 2 * self._header_count + 3 +
+                    2 * edges)
+        if len(self._data) != offset + 4 * integers + strings_size:
+            self._data.close()
+            raise ValueError("truncated kmi_defines index: " + path)
+        self._string_offsets, offset = self._array(
+            offset, self._component_count + self._header_count + 1)
+        self._header_offsets, offset = self._array(offset,
+                                                   self._header_count + 1)
+        self._header_components, offset = self._array(offset, edges)
+        self._component_offsets, offset = self._array(
+            offset, self._component_count + 1)
+        self._component_headers, offset = self._array(offset, edges)
+        self._strings = offset
+
+    def _array(self, offset: int, count: int):
+        """Return count integers at offset, and the offset after them."""
+        end = offset + 4 * count
+        view = memoryview(self._data)[offset:end]
+        if sys.byteorder == "little":
+            return view.cast("I"), end
+        values = array.array("I")
+        values.frombytes(view)
+        view.release()
+        values.byteswap()
+        return values, end
+
+    def close(self) -> None:
+        """Release the mapping of the index."""
+        for name in ("_string_offsets", "_header_offsets",
+                     "_header_components", "_component_offsets",
+                     "_component_headers"):
+            values = getattr(self, name)
+            if isinstance(values, memoryview):
+                values.release()
+        self._data.close()
+
+    def __enter__(self) -> "Index":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _string(self, index: int) -> str:
+        start = self._strings + self._string_offsets[index]
+        end = self._strings + self._string_offsets[index + 1] - 1
+        return os.fsdecode(self._data[start:end])
+
+    def _find(self, string: str, first: int, count: int) -> Optional[int]:
+        """Return the index of string among the count sorted from first."""
+        low, high = first, first + count
+        while low < high:
+            middle = (low + high) // 2
+            if self._string(middle) < string:
+                low = middle + 1
+            else:
+                high = middle
+        if low < first + count and self._string(low) == string:
+            return low - first
+        return None
+
+    def components(self) -> List[str]:
+        """Return all the components, sorted."""
+        return [self._string(i) for i in range(self._component_count)]
+
+    def headers(self) -> List[str]:
+        """Return all the headers, sorted."""
+        return [
+            self._string(self._component_count + i)
+            for i in range(self._header_count)
+        ]
+
+    def find_headers(self, header: str) -> List[str]:
+        """Return the headers in the index matching header.
+
+        That is header itself, as a canonical path, or otherwise all the
+        headers with a path ending with /header.
+        """
+        canonical = os.path.realpath(header)
+        if self._find(canonical, self._component_count,
+                      self._header_count) is not None:
+            return [canonical]
+        suffix = "/" + os.path.normpath(header).lstrip("/")
+        return [path for path in self.headers() if path.endswith(suffix)]
+
+    def components_of(self, header: str) -> List[str]:
+        """Return the components depending on header, a canonical path."""
+        index = self._find(header, self._component_count, self._header_count)
+        if index is None:
+            return []
+        return [
+            self._string(self._header_components[i])
+            for i in range(self._header_offsets[index],
+                           self._header_offsets[index + 1])
+        ]
+
+    def has_component(self, component: str) -> bool:
+        """Return whether component is in the index."""
+        return self._find(component, 0, self._component_count) is not None
+
+    def headers_of(self, component: str) -> List[str]:
+        """Return the headers component depends on."""
+        index = self._find(component, 0, self._component_count)
+        if index is None:
+            return []
+        return [
+            self._string(self._component_count + self._component_headers[i])
+            for i in range(self._component_offsets[index],
+                           self._component_offsets[index + 1])
+        ]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Query an index written by kmi_defines --index."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("index", help="the index file")
+    parser.add_argument("names",
+                        nargs="+",
+                        metavar="NAME",
+                        help="headers, or components with --headers")
+    parser.add_argument("--headers",
+                        action="store_true",
+                        help="show the headers of the components")
+    options = parser.parse_args(argv)
+
+    result = set()
+    missing = []
+    with Index(options.index) as index:
+        for name in options.names:
+            if options.headers:
+                found = index.has_component(name)
+                result.update(index.headers_of(name))
+            else:
+                headers = index.find_headers(name)
+                found = bool(headers)
+                for header in headers:
+                    result.update(index.components_of(header))
+            if not found:
+                missing.append(name)
+    for name in missing:
+        print("not in the index: " + name, file=sys.stderr)
+    for name in sorted(result):
+        print(name)
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+
+from absl.testing import absltest
+import kmi_defines_index
+
+_COMPONENTS = {
+    "vmlinux.o": ["/b/include/linux/a.h", "/b/include/linux/b.h"],
+    "drivers/x.ko": ["/b/include/linux/a.h", "/b/drivers/x.h"],
+    "drivers/y.ko": ["/b/include/linux/b.h", "/b/include/linux/a.h"],
+    "empty.ko": [],
+}
+
+
+class KmiDefinesIndexTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.path = os.path.join(self.tmp, "index")
+    kmi_defines_index.write_index(self.path, _COMPONENTS)
+
+  def _main(self, *args):
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout), \
+         contextlib.redirect_stderr(io.StringIO()):
+      exit_code = kmi_defines_index.main([self.path, *args])
+    return exit_code, stdout.getvalue().splitlines()
+
+  def test_queries(self):
+    with kmi_defines_index.Index(self.path) as index:
+      self.assertEqual(index.components(), sorted(_COMPONENTS))
+      self.assertEqual(index.headers(), sorted({
+          header for headers in _COMPONENTS.values() for header in headers
+      }))
+      for component, headers in _COMPONENTS.items():
+        self.assertTrue(index.has_component(component))
+        self.assertEqual(index.headers_of(component), sorted(headers))
+        for header in headers:
+          self.assertIn(component, index.components_of(header))
+      self.assertEqual(index.components_of("/b/include/linux/a.h"),
+                       ["drivers/x.ko", "drivers/y.ko", "vmlinux.o"])
+      self.assertEqual(index.components_of("/b/missing.h"), [])
+      self.assertFalse(index.has_component("missing.ko"))
+
+  def test_find_headers(self):
+    with kmi_defines_index.Index(self.path) as index:
+      self.assertEqual(index.find_headers("/b/drivers/x.h"), ["/b/drivers/x.h"])
+      self.assertEqual(index.find_headers("linux/b.h"),
+                       ["/b/include/linux/b.h"])
+      self.assertEqual(index.find_headers("include/linux"), [])
+      self.assertEqual(index.find_headers("x/b.h"), [])
+
+  def test_main(self):
+    self.assertEqual(
+        self._main("linux/b.h", "drivers/x.h"),
+        (0, ["drivers/x.ko", "drivers/y.ko", "vmlinux.o"]))
+    self.assertEqual(
+        self._main("--headers", "drivers/x.ko", "empty.ko"),
+        (0, ["/b/drivers/x.h", "/b/include/linux/a.h"]))
+    self.assertEqual(self._main("missing.h"), (1, []))
+
+  def test_empty(self):
+    kmi_defines_index.write_index(self.path, {})
+    with kmi_defines_index.Index(self.path) as index:
+      self.assertEqual(index.components(), [])
+      self.assertEqual(index.components_of("/a.h"), [])
+
+  def test_invalid(self):
+    with open(self.path, "rb") as f:
+      data = f.read()
+    for content in (b"not an index file", data[:-1]):
+      with open(self.path, "wb") as f:
+        f.write(content)
+      with self.assertRaises(ValueError):
+        kmi_defines_index.Index(self.path)
+
+
+if __name__ == "__main__":
+  absltest.main()
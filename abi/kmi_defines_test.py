@@ -0,0 +1,439 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import contextlib
+import io
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+import kmi_defines
+import kmi_defines_index
+
+_OLD = 1_000_000_000
+_KERNEL_OBJECTS = [f"kernel/file_{i}.o" for i in range(20)]
+_MODULES = {
+    # module: its object files, a single one is compiled rather than linked.
+    "drivers/single.ko": ["drivers/single.o"],
+    "drivers/net/linked.ko": ["drivers/net/part_a.o", "drivers/net/part_b.o"],
+    "sound/other.ko": ["sound/other.o"],
+}
+
+
+class KmiDefinesTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    root = os.path.realpath(tempfile.mkdtemp())
+    self.addCleanup(shutil.rmtree, root)
+    self.source = os.path.join(root, "source")
+    self.build = os.path.join(root, "build")
+    os.makedirs(self.source)
+    os.makedirs(self.build)
+    os.symlink(self.source, os.path.join(self.build, "source"))
+
+    self._write(kmi_defines.HIDDEN_DEP, "#define CONFIG_TEST 1\n")
+    self._write("vmlinux.o", "")
+    # Half of the kernel objects are linked from a thin archive.
+    self._write("vmlinux.libs", "kernel/built-in.a\n")
+    self._write("vmlinux.objs", " ".join(_KERNEL_OBJECTS[::2]) + "\n")
+    self._write_archive(
+        "kernel/built-in.a",
+        [os.path.relpath(obj, "kernel") for obj in _KERNEL_OBJECTS[1::2]],
+        thin=True)
+    for i, obj in enumerate(_KERNEL_OBJECTS):
+      self._compile(obj, [f"include/linux/kernel_{i % 3}.h", "kernel/local.c"])
+    for module, objs in _MODULES.items():
+      name = module[:-len(".ko")]
+      self._write(module, "")
+      self._write(
+          kmi_defines.cmd_file(module), f"cmd_{module} := ld.lld -r -o "
+          f"{module} {name}.o {name}.mod.o\n")
+      for obj in objs:
+        self._compile(obj, ["include/linux/kernel_0.h", f"{name}.h"])
+      if len(objs) > 1:
+        self._write(name + ".o", "")
+        self._write(
+            kmi_defines.cmd_file(name + ".o"),
+            f"cmd_{name}.o := ld.lld -r -o {name}.o {' '.join(objs)}\n")
+
+    cwd = os.getcwd()
+    os.chdir(self.build)
+    self.addCleanup(os.chdir, cwd)
+
+  def _write(self, name, content):
+    path = os.path.join(self.build, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+      f.write(content)
+
+  def _write_archive(self, name, members, thin=False):
+    """Writes a GNU archive, thin ones only use the long names table."""
+    long_names = b""
+    headers = []
+    for member in members:
+      content = b"" if thin else member.encode() * 3
+      if len(member) < 16 and not thin:
+        member_name = member + "/"
+      else:
+        member_name = f"/{len(long_names)}"
+        long_names += member.encode() + b"/\n"
+      headers.append((member_name, content))
+
+    def member_bytes(name, content, size=None):
+      size = len(content) if size is None else size
+      header = f"{name:<16}{0:<12}{0:<6}{0:<6}{644:<8}{size:<10}`\n"
+      return header.encode() + content + b"\n" * (len(content) & 1)
+
+    data = b"!<thin>\n" if thin else b"!<arch>\n"
+    data += member_bytes("/", b"\0\0\0\0")  # an empty symbol table
+    if long_names:
+      data += member_bytes("//", long_names)
+    for member_name, content in headers:
+      data += member_bytes(member_name, content, 1234 if thin else None)
+    path = os.path.join(self.build, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+      f.write(data)
+    return path
+
+  def _compile(self, obj, deps):
+    source = os.path.join(self.source, obj[:-len(".o")] + ".c")
+    os.makedirs(os.path.dirname(source), exist_ok=True)
+    with open(source, "w") as f:
+      f.write("int x;\n")
+    self._write(obj, "")
+    for dep in deps:
+      name = os.path.basename(dep)[:-len(".h")]
+      if dep.endswith(".h") and not os.path.exists(
+          os.path.join(self.build, dep)):
+        self._write(dep, f"#define MACRO_{name} 1\n")
+    self._write(
+        kmi_defines.cmd_file(obj),
+        f"cmd_{obj} := clang -Wp,-MD,{obj}.d -nostdinc -O2 -c -o {obj} "
+        f"{source}\n\nsource_{obj} := {source}\n\ndeps_{obj} := \\\n" +
+        "".join(f"  {dep} \\\n" for dep in deps) + "\n")
+
+  def _work(self, **options):
+    options.setdefault("sequential", False)
+    options.setdefault("jobs", 3)
+    options.setdefault("state", None)
+    return kmi_defines.work_on_all_components(argparse.Namespace(**options))
+
+  def _defines(self, *flags):
+    """Returns the output of --defines by component and the compiler runs."""
+    if not shutil.which("gcc"):
+      self.skipTest("gcc is not available")
+    # The compile lines use clang.
+    bin_dir = os.path.join(self.build, "bin")
+    self._write("bin/clang", '#!/bin/sh\nexec gcc "$@"\n')
+    os.chmod(os.path.join(bin_dir, "clang"), 0o755)
+    self.addCleanup(kmi_defines._file_digests.clear)
+    stdout = io.StringIO()
+    with mock.patch.dict(os.environ,
+                         {"PATH": bin_dir + os.pathsep + os.environ["PATH"]}), \
+         mock.patch.object(kmi_defines, "run",
+                           side_effect=kmi_defines.run) as run, \
+         contextlib.redirect_stdout(stdout):
+      self.assertEqual(
+          kmi_defines.main(["--defines", "--jobs", "1", *flags]), 0)
+    defines = {}
+    for block in stdout.getvalue().strip().split("\n\n"):
+      component, *lines = block.splitlines()
+      defines[component] = lines
+    return defines, run.call_count
+
+  def _summary(self, components):
+    return [(sorted(target._obj for target in component._targets),
+             sorted(component.get_deps_set())) for component in components]
+
+  def test_parallel_matches_sequential(self):
+    sequential, _ = self._work(sequential=True)
+    parallel, timing = self._work()
+    for component in parallel:
+      self.assertIsNone(component.get_error())
+    self.assertTrue(parallel[0].is_kernel())
+    self.assertLen(parallel[0]._targets, len(_KERNEL_OBJECTS))
+    self.assertEqual(self._summary(parallel), self._summary(sequential))
+    self.assertCountEqual(timing, ["vmlinux.o", *_MODULES])
+
+  def test_archive_members(self):
+    members = ["short.o", "a_rather_long_member_name.o", "odd.o",
+               "another_long_member_name.o"]
+    regular = self._write_archive("regular.a", members)
+    thin = self._write_archive("dir/thin.a", ["../" + m for m in members],
+                               thin=True)
+    self.assertEqual(kmi_defines.archive_members(regular), members)
+    self.assertEqual(
+        kmi_defines.archive_members(thin),
+        [os.path.join(self.build, "dir", "..", m) for m in members])
+    if shutil.which("ar"):
+      for member in members:
+        self._write(member, "")  # ar t needs the members of thin archives
+      for archive in (regular, "dir/thin.a"):
+        completion = kmi_defines.run(["ar", "t", archive])
+        self.assertEqual(kmi_defines.archive_members(archive),
+                         completion.stdout.split())
+
+  def test_archive_members_memoized(self):
+    archive = self._write_archive("lib.a", ["a.o"])
+    self.assertEqual(kmi_defines.archive_members(archive), ["a.o"])
+    with mock.patch.object(kmi_defines, "read_archive_members") as read:
+      self.assertEqual(kmi_defines.archive_members(archive), ["a.o"])
+      read.assert_not_called()
+    os.utime(archive, ns=(1, 1))
+    self._write_archive("lib.a", ["b.o"])
+    os.utime(archive, ns=(1, 1))
+    self.assertEqual(kmi_defines.archive_members(archive), ["b.o"])
+
+  def test_archive_members_errors(self):
+    self._write("not_an_archive.a", "!<arch>")
+    self._write("truncated.a", "!<arch>\nname.o/  1")
+    for archive in ("not_an_archive.a", "truncated.a", "missing.a"):
+      with self.assertRaises(kmi_defines.StopError):
+        kmi_defines.archive_members(archive)
+
+  def test_path_table(self):
+    table = kmi_defines.PathTable()
+    with mock.patch.object(os.path, "realpath",
+                           side_effect=os.path.realpath) as realpath:
+      first = table.intern("source/include/a.h")
+      self.assertEqual(table.intern("source/include/a.h"), first)
+      realpath.assert_called_once()
+    self.assertEqual(table.path(first),
+                     os.path.join(self.source, "include/a.h"))
+    self.assertEqual(table.intern(os.path.join(self.source, "include/a.h")),
+                     first)
+    self.assertNotEqual(table.intern("include/b.h"), first)
+    self.assertLen(table, 2)
+
+  def test_path_set_pickled_as_paths(self):
+    paths = kmi_defines.path_set_from_paths(["/a.h", "/b.h"])
+    data = pickle.dumps(paths)
+    # Ids are different in another process.
+    with mock.patch.object(kmi_defines, "PATHS", kmi_defines.PathTable()):
+      kmi_defines.PATHS.intern_canonical("/other.h")
+      unpickled = pickle.loads(data)
+      self.assertIsInstance(unpickled, kmi_defines.PathSet)
+      self.assertEqual(unpickled.paths(), {"/a.h", "/b.h"})
+      self.assertNotEqual(set(unpickled), set(paths))
+
+  def test_dump(self):
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+      self.assertEqual(
+          kmi_defines.main(["--dump", "--component", "drivers/single.ko"]), 0)
+    self.assertIn(os.path.join(self.build, "drivers/single.h"),
+                  stdout.getvalue())
+
+  def test_defines(self):
+    defines, runs = self._defines()
+    self.assertCountEqual(defines, ["vmlinux.o:", *(f"{m}:" for m in _MODULES)])
+    self.assertContainsSubset(
+        ["#define CONFIG_TEST 1", "#define MACRO_kernel_0 1",
+         "#define MACRO_kernel_1 1", "#define MACRO_kernel_2 1"],
+        defines["vmlinux.o:"])
+    self.assertContainsSubset(
+        ["#define CONFIG_TEST 1", "#define MACRO_kernel_0 1",
+         "#define MACRO_linked 1"],
+        defines["drivers/net/linked.ko:"])
+    self.assertNotIn("#define MACRO_kernel_1 1",
+                     defines["drivers/net/linked.ko:"])
+    # One run for every distinct set of headers, not one for every file.
+    self.assertEqual(runs, 6)
+
+  def test_defines_cache(self):
+    cache = os.path.join(self.build, "cache")
+    first, _ = self._defines("--defines-cache", cache)
+    kmi_defines._file_digests.clear()
+    second, runs = self._defines("--defines-cache", cache)
+    self.assertEqual(first, second)
+    self.assertEqual(runs, 0)
+
+    # A header change is a different configuration.
+    self._write("drivers/single.h", "#define MACRO_single 2\n")
+    kmi_defines._file_digests.clear()
+    third, runs = self._defines("--defines-cache", cache)
+    self.assertEqual(runs, 1)
+    self.assertIn("#define MACRO_single 2", third["drivers/single.ko:"])
+
+  def test_defines_from_source(self):
+    # A header that can only be included from its source file.
+    header = os.path.join(self.build, "drivers/single.h")
+    self._write(header, "#ifndef FROM_SOURCE\n#error\n#endif\n")
+    with open(os.path.join(self.source, "drivers/single.c"), "w") as f:
+      f.write(f'#define FROM_SOURCE 1\n#include "{header}"\n')
+    defines, runs = self._defines()
+    self.assertIn("#define FROM_SOURCE 1", defines["drivers/single.ko:"])
+    self.assertEqual(runs, 7)
+
+  def test_defines_cache_skips_failures(self):
+    header = os.path.join(self.build, "drivers/single.h")
+    self._write(header, "#ifndef FROM_SOURCE\n#error\n#endif\n")
+    with open(os.path.join(self.source, "drivers/single.c"), "w") as f:
+      f.write(f'#define FROM_SOURCE 1\n#include "{header}"\n')
+    cache = os.path.join(self.build, "cache")
+    first, _ = self._defines("--defines-cache", cache)
+    kmi_defines._file_digests.clear()
+    second, runs = self._defines("--defines-cache", cache)
+    self.assertEqual(first, second)
+    # Only the failing run on the headers is repeated.
+    self.assertEqual(runs, 1)
+
+  def test_index(self):
+    index_file = os.path.join(self.build, "index")
+    self.assertEqual(kmi_defines.main(["--index", index_file]), 0)
+    with kmi_defines_index.Index(index_file) as index:
+      self.assertEqual(index.components(),
+                       sorted(["vmlinux.o", *_MODULES]))
+      self.assertEqual(
+          index.components_of(
+              os.path.join(self.build, "include/linux/kernel_0.h")),
+          sorted(["vmlinux.o", *_MODULES]))
+      self.assertEqual(
+          index.components_of(os.path.join(self.build, "drivers/single.h")),
+          ["drivers/single.ko"])
+      self.assertEqual(
+          index.headers_of("drivers/net/linked.ko"),
+          sorted(
+              os.path.join(self.build, header) for header in [
+                  kmi_defines.HIDDEN_DEP, "drivers/net/linked.h",
+                  "include/linux/kernel_0.h"
+              ]))
+
+  def test_flags(self):
+    target = kmi_defines.Target(
+        "/b/dir/file.o", "/s/dir/file.c",
+        "clang -Wp,-MD,dir/.file.o.d -nostdinc -Iinclude -O2 "
+        "-DKBUILD_MODNAME='\"mod\"' -DKBUILD_BASENAME='\"file\"' "
+        "-D__KBUILD_MODNAME=kmod_mod -DOTHER=1 -c -o dir/file.o /s/dir/file.c",
+        kmi_defines.PathList())
+    self.assertEqual(target.get_flags(),
+                     ["clang", "-nostdinc", "-Iinclude", "-O2", "-DOTHER=1"])
+
+  def test_state(self):
+    # Old enough for their modification time to be recorded.
+    for directory, _, files in os.walk(self.build):
+      for file in files:
+        os.utime(os.path.join(directory, file), ns=(_OLD, _OLD))
+    state = os.path.join(self.build, "state")
+    first, _ = self._work(sequential=True, state=state)
+    self.assertTrue(os.path.exists(state))
+
+    # Nothing changed, not even a .cmd file is read.
+    with mock.patch.object(kmi_defines, "kernel_component_factory") as factory, \
+         mock.patch.object(kmi_defines, "hash_file") as digest:
+      second, timing = self._work(sequential=True, state=state)
+    factory.assert_not_called()
+    digest.assert_not_called()
+    self.assertEmpty(timing)
+    self.assertEqual(self._summary(second), self._summary(first))
+
+    # Touched, but with the same contents: still reused.
+    os.utime(kmi_defines.cmd_file("kernel/file_3.o"), ns=(_OLD, _OLD + 1))
+    with mock.patch.object(kmi_defines, "kernel_component_factory") as factory:
+      self._work(sequential=True, state=state)
+    factory.assert_not_called()
+
+    # Only the changed module is made again.
+    self._compile("drivers/single.o",
+                  ["include/linux/kernel_1.h", "drivers/single.h"])
+    real_factory = kmi_defines.kernel_component_factory
+    with mock.patch.object(kmi_defines, "kernel_component_factory",
+                           side_effect=real_factory) as factory:
+      third, _ = self._work(sequential=True, state=state)
+    self.assertEqual([call.args[0] for call in factory.call_args_list],
+                     ["drivers/single.ko"])
+    single = [c for c in third if c.get_filename() == "drivers/single.ko"]
+    self.assertIn(os.path.join(self.build, "include/linux/kernel_1.h"),
+                  single[0].get_deps_set())
+
+    # The kernel is made again, in parallel, when one of its objects changed.
+    self._compile("kernel/file_4.o", ["include/linux/kernel_2.h"])
+    fourth, timing = self._work(state=state)
+    self.assertEqual(list(timing), ["vmlinux.o"])
+    self.assertEqual(self._summary(fourth),
+                     self._summary(self._work(sequential=True)[0]))
+
+  def test_unusable_state(self):
+    state = os.path.join(self.build, "state")
+    self._write("state", "not a state")
+    components, timing = self._work(state=state)
+    self.assertLen(timing, len(components))
+    self.assertEqual(kmi_defines.ComponentState(state).reusable(
+        ["vmlinux.o", *_MODULES]).keys(), {"vmlinux.o", *_MODULES})
+
+  def test_stale_state(self):
+    state = os.path.join(self.build, "state")
+    for content in [
+        # A class that does not exist anymore.
+        b"ckmi_defines\nNoSuchComponent\n.",
+        b"cno_such_module\nComponent\n.",
+        # A pickle protocol from the future.
+        b"\x80\x09.",
+    ]:
+      with open(state, "wb") as f:
+        f.write(content)
+      self.assertEqual(kmi_defines.ComponentState(state).reusable(
+          ["vmlinux.o"]), {})
+
+  def test_kernel_is_split(self):
+    kernel = kmi_defines.kernel_component_factory(
+        "vmlinux.o", make_targets=False)
+    self.assertEmpty(kernel._targets)
+    items = kmi_defines.split_kernel(kernel, 1000)
+    self.assertGreater(len(items), 1)
+    self.assertEqual([obj for item in items for obj in item.objs],
+                     kernel.get_object_files())
+    self.assertEqual([item.index for item in items], list(range(len(items))))
+
+  def test_make_chunks(self):
+    items = [kmi_defines.WorkItem(cost, str(cost)) for cost in
+             (1, 50, 3, 200, 2, 40)]
+    chunks = kmi_defines.make_chunks(items, 45)
+    self.assertEqual([[item.cost for item in chunk] for chunk in chunks],
+                     [[200], [50], [40, 3, 2], [1]])
+
+  def test_estimate_module_cost(self):
+    linked = kmi_defines.estimate_module_cost("drivers/net/linked.ko")
+    single = kmi_defines.estimate_module_cost("drivers/single.ko")
+    self.assertGreater(linked, single)
+    self.assertEqual(kmi_defines.estimate_module_cost("missing.ko"), 0)
+
+  def test_errors_are_reported(self):
+    os.remove(kmi_defines.cmd_file("sound/other.o"))
+    components, _ = self._work()
+    errors = [component.get_error() for component in components]
+    self.assertIsNone(errors[0])
+    self.assertLen([error for error in errors if error], 1)
+
+  def test_includes_and_timing(self):
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+      self.assertEqual(kmi_defines.main(["--includes", "--timing", "2"]), 0)
+    self.assertEqual(
+        sorted(stdout.getvalue().splitlines()),
+        sorted(
+            os.path.join(self.build, header) for header in
+            ["include/generated/autoconf.h", "include/linux/kernel_0.h"]))
+    self.assertLen(stderr.getvalue().splitlines(), 3)
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Reads the signature appended to a kernel module.
+
+A signed module ends with the signature, a struct module_signature and the
+"~Module signature appended~\\n" marker (see include/linux/module_signature.h
+in the kernel tree):
+
+  struct module_signature {
+    u8 algo, hash, id_type, signer_len, key_id_len, __pad[3];
+    __be32 sig_len;
+  };
+
+For PKCS#7 signatures the signer and key identifier are not stored in the
+struct but in the SignerInfo of the PKCS#7 message, so a minimal DER reader
+extracts them the same way `modinfo` does: the signer is the common name of
+the issuer, the key id is the serial number of the certificate.
+
+parse(): Parses the signature at the end of a buffer.
+read(): Reads the signature at the end of a file with a single read.
+"""
+
+import dataclasses
+import os
+import struct
+
+MAGIC = b"~Module signature appended~\n"
+_INFO = struct.Struct(">BBBBB3xI")
+
+PKEY_ID_PGP = 0
+PKEY_ID_X509 = 1
+PKEY_ID_PKCS7 = 2
+_ID_TYPES = {
+    PKEY_ID_PGP: "PGP",
+    PKEY_ID_X509: "X509",
+    PKEY_ID_PKCS7: "PKCS#7",
+}
+
+# Index of struct module_signature.hash, as in crypto/hash_info.c.
+_LEGACY_HASH_ALGOS = [
+    "md4", "md5", "sha1", "rmd160", "sha256", "sha384", "sha512", "sha224",
+    "rmd128", "rmd256", "rmd320", "wp256", "wp384", "wp512", "tgr128",
+    "tgr160", "tgr192", "sm3", "streebog256", "streebog512",
+]
+
+_HASH_OIDS = {
+    "1.2.840.113549.2.5": "md5",
+    "1.3.14.3.2.26": "sha1",
+    "2.16.840.1.101.3.4.2.1": "sha256",
+    "2.16.840.1.101.3.4.2.2": "sha384",
+    "2.16.840.1.101.3.4.2.3": "sha512",
+    "2.16.840.1.101.3.4.2.4": "sha224",
+    "2.16.840.1.101.3.4.2.8": "sha3-256",
+    "2.16.840.1.101.3.4.2.9": "sha3-384",
+    "2.16.840.1.101.3.4.2.10": "sha3-512",
+    "1.2.156.10197.1.401": "sm3",
+}
+_OID_COMMON_NAME = "2.5.4.3"
+
+# Covers the trailer and a typical PKCS#7 signature in a single read.
+_TAIL_SIZE = 4096
+
+
+@dataclasses.dataclass(frozen=True)
+class ModuleSignature:
+  """The signature appended to a kernel module."""
+  # "PKCS#7", "X509" or "PGP", as reported by `modinfo -F sig_id`.
+  id_type: str
+  # Common name of the signing certificate's issuer, if known.
+  signer: str | None
+  # Colon separated hex bytes of the key identifier, if known.
+  key_id: str | None
+  # Name of the digest algorithm, e.g. "sha256", if known.
+  hash_algo: str | None
+  # Size of the signature data in bytes.
+  sig_len: int
+
+
+class _DerError(Exception):
+  pass
+
+
+def _tlv(data, pos, end):
+  """Returns (tag, content start, content end) of the DER element at pos."""
+  if pos + 2 > end:
+    raise _DerError("truncated")
+  tag = data[pos]
+  if tag & 0x1f == 0x1f:
+    raise _DerError("high tag numbers are not supported")
+  length = data[pos + 1]
+  pos += 2
+  if length & 0x80:
+    count = length & 0x7f
+    if count == 0 or count > 4 or pos + count > end:
+      raise _DerError("unsupported length")
+    length = int.from_bytes(data[pos:pos + count], "big")
+    pos += count
+  if pos + length > end:
+    raise _DerError("truncated")
+  return tag, pos, pos + length
+
+
+def _children(data, start, end):
+  """Yields (tag, start, end) of every element in the range."""
+  while start < end:
+    tag, child_start, child_end = _tlv(data, start, end)
+    yield tag, child_start, child_end
+    start = child_end
+
+
+def _oid(data, start, end):
+  """Decodes an OBJECT IDENTIFIER into its dotted form."""
+  value = bytes(data[start:end])
+  if not value:
+    raise _DerError("empty OID")
+  parts = list(divmod(value[0], 40)) if value[0] < 80 else [2, value[0] - 80]
+  current = 0
+  for byte in value[1:]:
+    current = (current << 7) | (byte & 0x7f)
+    if not byte & 0x80:
+      parts.append(current)
+      current = 0
+  return ".".join(str(p) for p in parts)
+
+
+def _hex(value):
+  return ":".join(f"{b:02X}" for b in value)
+
+
+def _common_name(data, start, end):
+  """Returns the CN of an X.501 Name, if any."""
+  for _, rdn_start, rdn_end in _children(data, start, end):
+    for _, attr_start, attr_end in _children(data, rdn_start, rdn_end):
+      attr = list(_children(data, attr_start, attr_end))
+      if len(attr) == 2 and _oid(data, *attr[0][1:]) == _OID_COMMON_NAME:
+        return bytes(data[attr[1][1]:attr[1][2]]).decode(
+            "utf-8", errors="replace")
+  return None
+
+
+def _parse_pkcs7(data, start, end):
+  """Returns (signer, key_id, hash_algo) of the first PKCS#7 SignerInfo."""
+  _, start, end = _tlv(data, start, end)  # ContentInfo
+  content = list(_children(data, start, end))
+  if len(content) < 2 or content[1][0] != 0xa0:
+    raise _DerError("no content")
+  _, start, end = _tlv(data, content[1][1], content[1][2])  # SignedData
+  signed_data = list(_children(data, start, end))
+  signer_infos = signed_data[-1]
+  if signer_infos[0] != 0x31:
+    raise _DerError("no signerInfos")
+  _, start, end = _tlv(data, signer_infos[1], signer_infos[2])
+  signer_info = list(_children(data, start, end))
+  if len(signer_info) < 3:
+    raise _DerError("short SignerInfo")
+
+  signer = key_id = None
+  sid_tag, sid_start, sid_end = signer_info[1]
+  if sid_tag == 0x30:  # IssuerAndSerialNumber
+    issuer, serial = list(_children(data, sid_start, sid_end))[:2]
+    signer = _common_name(data, issuer[1], issuer[2])
+    key_id = _hex(data[serial[1]:serial[2]])
+  elif sid_tag == 0x80:  # [0] SubjectKeyIdentifier
+    key_id = _hex(data[sid_start:sid_end])
+
+  _, algo_start, algo_end = signer_info[2]
+  oid = next(_children(data, algo_start, algo_end))
+  oid_str = _oid(data, oid[1], oid[2])
+  return signer, key_id, _HASH_OIDS.get(oid_str, oid_str)
+
+
+def parse(data):
+  """Parses the signature at the end of the buffer data.
+
+  Args:
+    data: The contents of the module, or any tail of it that includes the
+      whole signature.
+
+  Returns:
+    A ModuleSignature, or None if data does not end with a signature.
+  """
+  trailer = len(MAGIC) + _INFO.size
+  if len(data) < trailer or bytes(data[-len(MAGIC):]) != MAGIC:
+    return None
+  info_start = len(data) - trailer
+  algo, hash_index, id_type, signer_len, key_id_len, sig_len = (
+      _INFO.unpack_from(data, info_start))
+  del algo  # Unused, the algorithm is implied by the key.
+  sig_start = info_start - sig_len
+  if sig_start < 0:
+    return None
+
+  if id_type == PKEY_ID_PKCS7:
+    try:
+      signer, key_id, hash_algo = _parse_pkcs7(data, sig_start, info_start)
+    except (_DerError, IndexError, ValueError, StopIteration):
+      signer = key_id = hash_algo = None
+  else:
+    key_start = sig_start - key_id_len
+    signer_start = key_start - signer_len
+    if signer_start < 0:
+      return None
+    signer = bytes(data[signer_start:key_start]).decode(
+        "utf-8", errors="replace") or None
+    key_id = _hex(data[key_start:sig_start]) or None
+    hash_algo = (_LEGACY_HASH_ALGOS[hash_index]
+                 if hash_index < len(_LEGACY_HASH_ALGOS) else None)
+
+  return ModuleSignature(
+      id_type=_ID_TYPES.get(id_type, str(id_type)),
+      signer=signer,
+      key_id=key_id,
+      hash_algo=hash_algo,
+      sig_len=sig_len,
+  )
+
+
+def read(path):
+  """Reads the signature of the module at path; None if it is unsigned."""
+  with open(path, "rb") as f:
+    size = f.seek(0, os.SEEK_END)
+    f.seek(max(0, size - _TAIL_SIZE))
+    tail = f.read()
+    if len(tail) < size and bytes(tail[-len(MAGIC):]) == MAGIC:
+      # Signatures larger than the first read need one more.
+      info_start = len(tail) - len(MAGIC) - _INFO.size
+      _, _, _, signer_len, key_id_len, sig_len = _INFO.unpack_from(
+          tail, info_start)
+      needed = len(MAGIC) + _INFO.size + sig_len + signer_len + key_id_len
+      if needed > len(tail):
+        f.seek(max(0, size - needed))
+        tail = f.read()
+  return parse(tail)
@@ -0,0 +1,142 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import struct
+import tempfile
+
+from absl.testing import absltest
+import module_signature
+import symbol_extraction
+
+
+def _der(tag, *children):
+  content = b"".join(children)
+  length = len(content)
+  if length < 0x80:
+    encoded = bytes([length])
+  else:
+    raw = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    encoded = bytes([0x80 | len(raw)]) + raw
+  return bytes([tag]) + encoded + content
+
+
+def _oid(dotted):
+  parts = [int(p) for p in dotted.split(".")]
+  out = bytearray([parts[0] * 40 + parts[1]])
+  for part in parts[2:]:
+    chunk = [part & 0x7f]
+    part >>= 7
+    while part:
+      chunk.insert(0, 0x80 | (part & 0x7f))
+      part >>= 7
+    out.extend(chunk)
+  return _der(0x06, bytes(out))
+
+
+def _pkcs7(signer, serial, hash_oid, signature=b"\x5a" * 256):
+  """Creates a detached PKCS#7 message like scripts/sign-file does."""
+  issuer = _der(
+      0x30,
+      _der(0x31, _der(0x30, _oid("2.5.4.10"), _der(0x0c, b"Android"))),
+      _der(0x31, _der(0x30, _oid("2.5.4.3"), _der(0x0c, signer.encode()))))
+  digest_algo = _der(0x30, _oid(hash_oid), _der(0x05))
+  signer_info = _der(
+      0x30,
+      _der(0x02, b"\x01"),
+      _der(0x30, issuer, _der(0x02, serial)),
+      digest_algo,
+      _der(0x30, _oid("1.2.840.113549.1.1.1"), _der(0x05)),
+      _der(0x04, signature),
+  )
+  signed_data = _der(
+      0x30,
+      _der(0x02, b"\x01"),
+      _der(0x31, digest_algo),
+      _der(0x30, _oid("1.2.840.113549.1.7.1")),
+      _der(0x31, signer_info),
+  )
+  return _der(0x30, _oid("1.2.840.113549.1.7.2"), _der(0xa0, signed_data))
+
+
+def _trailer(sig, id_type=2, hash_index=0, signer=b"", key_id=b""):
+  info = struct.pack(">BBBBB3xI", 1, hash_index, id_type, len(signer),
+                     len(key_id), len(sig))
+  return signer + key_id + sig + info + module_signature.MAGIC
+
+
+class ModuleSignatureTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+
+  def _module(self, content):
+    path = os.path.join(self.tmp, "test.ko")
+    with open(path, "wb") as f:
+      f.write(b"\x7fELF" + b"\0" * 60 + content)
+    return path
+
+  def test_unsigned(self):
+    path = self._module(b"")
+    self.assertIsNone(module_signature.read(path))
+    self.assertFalse(symbol_extraction.is_signature_present(path))
+
+  def test_pkcs7(self):
+    path = self._module(
+        _trailer(_pkcs7("GKI key", b"\x01\xab", "2.16.840.1.101.3.4.2.3")))
+    signature = module_signature.read(path)
+    self.assertEqual(signature.id_type, "PKCS#7")
+    self.assertEqual(signature.signer, "GKI key")
+    self.assertEqual(signature.key_id, "01:AB")
+    self.assertEqual(signature.hash_algo, "sha512")
+    self.assertTrue(symbol_extraction.is_signature_present(path))
+
+  def test_large_pkcs7(self):
+    sig = _pkcs7("GKI key", b"\x07", "2.16.840.1.101.3.4.2.1",
+                 signature=b"\x01" * 8000)
+    path = self._module(_trailer(sig))
+    signature = module_signature.read(path)
+    self.assertEqual(signature.signer, "GKI key")
+    self.assertEqual(signature.hash_algo, "sha256")
+    self.assertEqual(signature.sig_len, len(sig))
+
+  def test_unparsable_pkcs7(self):
+    path = self._module(_trailer(b"\x30\x03\x01\x02"))
+    signature = module_signature.read(path)
+    self.assertEqual(signature.id_type, "PKCS#7")
+    self.assertIsNone(signature.signer)
+    self.assertTrue(symbol_extraction.is_signature_present(path))
+
+  def test_legacy(self):
+    path = self._module(
+        _trailer(b"sig", id_type=1, hash_index=4, signer=b"Vendor",
+                 key_id=b"\xde\xad"))
+    signature = module_signature.read(path)
+    self.assertEqual(signature.id_type, "X509")
+    self.assertEqual(signature.signer, "Vendor")
+    self.assertEqual(signature.key_id, "DE:AD")
+    self.assertEqual(signature.hash_algo, "sha256")
+    self.assertFalse(symbol_extraction.is_signature_present(path))
+
+  def test_bogus_length(self):
+    path = self._module(_trailer(b"")[:-len(module_signature.MAGIC) - 4] +
+                        struct.pack(">I", 1 << 30) + module_signature.MAGIC)
+    self.assertIsNone(module_signature.read(path))
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -18,6 +18,8 @@ import argparse
 import os
 import sys
 
+import symbol_list as symbol_list_lib
+
 
 _TRACE_POINT = '__tracepoint_'
 _TRACE_ITER = '__traceiter_'
@@ -72,30 +74,28 @@ def _read_denied_symbols_config(deny_file):
 
 
 def _read_symbol_lists(symbol_lists):
-  """Reads libabigail symbol list files as a list of lines."""
+  """Reads libabigail symbol list files.
+
+  Returns:
+    (lines, symbol_list): the lines of all files, and their symbols as a
+    symbol_list.SymbolList.
+  """
   all_lines = []
+  merged = symbol_list_lib.SymbolList()
   for symbol_list in symbol_lists:
     with open(symbol_list) as sl:
       lines = sl.read().splitlines(keepends=True)
     all_lines.extend(lines)
     # Separate files or at least protect against missing final newlines.
     all_lines.append('\n')
+    parsed = symbol_list_lib.SymbolList().parse(lines)
     # validate symbols by file
-    _validate_symbols(symbol_list, _get_symbols(lines))
-  return all_lines
-
+    _validate_symbols(symbol_list, set(parsed.symbols()))
+    merged.merge(parsed)
+  return all_lines, merged
 
-def _get_symbols(lines):
-  """Gets symbols from symbol list lines."""
-  symbols = set()
-  for line in lines:
-    stripped = line.strip()
-    if stripped and not stripped.startswith(('#', '[')):
-      symbols.add(stripped)
-  return symbols
 
-
-def main():
+def main(argv=None):
   dir = os.path.dirname(sys.argv[0])
   deny_file = os.path.join(dir, 'symbols.deny')
 
@@ -118,11 +118,16 @@ def main():
   parser.add_argument(
       '--out-file', required=True, help='combined symbol list file name'
   )
+  parser.add_argument(
+      '--out-snapshot',
+      help='also write a binary snapshot of the combined symbol list, which'
+      ' tools reading symbol lists load faster',
+  )
   parser.add_argument(
       '--verbose', action='store_true', help='increase verbosity of the output'
   )
 
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   in_directory = args.in_dir
   out_directory = args.out_dir
@@ -130,14 +135,16 @@ def main():
   out_file = os.path.join(out_directory, args.out_file)
 
   denied_symbols = _read_denied_symbols_config(deny_file)
-  lines = _read_symbol_lists(symbol_lists)
-  symbols = _get_symbols(lines)
+  lines, merged = _read_symbol_lists(symbol_lists)
+  symbols = merged.symbols()
 
   if args.verbose:
     print('========================================================')
     print(f'Generating ABI symbol list definition in {out_file}')
   with open(out_file, 'w') as sl:
     sl.writelines(lines)
+  if args.out_snapshot:
+    merged.save_snapshot(os.path.join(out_directory, args.out_snapshot))
 
   exit_status = 0
   if args.verbose:
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Content addressed on-disk cache for symbols extracted from binaries.
+
+Entries are keyed on the SHA-256 of the binary, so a module that did not
+change is never read twice, no matter where it lives or how often it is
+copied around. To avoid hashing on every lookup, the digest of a file is
+remembered under its (path, device, inode, size, mtime); that shortcut is
+only recorded for files that have not been modified in the last few seconds,
+so a file rewritten within the mtime granularity is always hashed again.
+
+The layout of the cache directory is:
+
+  objects/ab/abcdef...-<kind>   zlib compressed JSON, usually a symbol list
+  stat/01/0123456...            digest of the file with that stat signature
+
+The cache is bounded: once it grows beyond max_size bytes, the least recently
+used files are removed until it is back under 90% of the limit. That is
+checked when the process exits, and only if an entry was written since the
+last check (by any process, as recorded by the DIRTY file). The cache is
+optional: if it can not be written to, symbols are just not cached.
+"""
+
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import time
+import zlib
+
+# Bump when the format or the semantics of the stored symbols change.
+_VERSION = "2"
+_RACY_SECONDS = 2
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# Created when an entry is written, removed when the cache is trimmed.
+DIRTY = "DIRTY"
+
+# The caches to trim when the process exits, by directory.
+_caches = {}
+
+
+@atexit.register
+def _trim_caches():
+  for cache in _caches.values():
+    cache.trim_if_dirty()
+
+
+def _file_digest(path):
+  """Returns the SHA-256 hex digest of the contents of path."""
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    try:
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        digest.update(data)
+    except ValueError:
+      # Empty files cannot be mapped.
+      pass
+  return digest.hexdigest()
+
+
+class SymbolCache:
+  """Stores symbols (or any JSON value) keyed on the contents of a binary."""
+
+  def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+    self.directory = directory
+    self.max_size = max_size
+    self._dirty = False
+    # Entries may also be added by worker processes, so check the size when
+    # the process that set up the cache exits.
+    _caches[directory] = self
+
+  def _path(self, kind, key):
+    return os.path.join(self.directory, kind, key[:2], key)
+
+  def _write(self, path, content):
+    """Writes content to path, unless the cache can not be written to."""
+    try:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      if not self._dirty:
+        open(os.path.join(self.directory, DIRTY), "a").close()
+        self._dirty = True
+      # Write atomically, concurrent processes may share the cache.
+      fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+    except OSError:
+      return
+    try:
+      with os.fdopen(fd, "wb") as f:
+        f.write(content)
+      os.replace(tmp, path)
+    except BaseException as e:
+      os.unlink(tmp)
+      if not isinstance(e, OSError):
+        raise
+
+  def _read(self, path):
+    try:
+      with open(path, "rb") as f:
+        content = f.read()
+    except OSError:
+      return None
+    # Refresh the mtime, which is what the LRU eviction looks at.
+    try:
+      os.utime(path)
+    except OSError:
+      pass
+    return content
+
+  def digest(self, binary):
+    """Returns the content digest of binary, using the stat shortcut."""
+    st = os.stat(binary)
+    signature = "\0".join(
+        str(x) for x in (_VERSION, os.path.abspath(binary), st.st_dev,
+                         st.st_ino, st.st_size, st.st_mtime_ns))
+    stat_key = hashlib.sha256(signature.encode()).hexdigest()
+    stat_path = self._path("stat", stat_key)
+    content = self._read(stat_path)
+    if content:
+      return content.decode()
+
+    digest = _file_digest(binary)
+    if time.time() - st.st_mtime_ns / 1e9 > _RACY_SECONDS:
+      self._write(stat_path, digest.encode())
+    return digest
+
+  def get(self, kind, binary, extract):
+    """Returns the cached result of extract(binary), computing it if needed.
+
+    Args:
+      kind: Name of the kind of symbols, e.g. "undefined" or "exported".
+      binary: Path of the binary file.
+      extract: Function extracting the list of symbols (or any other JSON
+        serializable value) from binary.
+    """
+    path = self._path("objects", f"{self.digest(binary)}-{_VERSION}-{kind}")
+    content = self._read(path)
+    if content is not None:
+      try:
+        return json.loads(zlib.decompress(content))
+      except (zlib.error, ValueError):
+        pass  # Corrupt entry, recompute and overwrite it.
+
+    value = extract(binary)
+    self._write(path, zlib.compress(json.dumps(value).encode()))
+    return value
+
+  def trim_if_dirty(self):
+    """Trims the cache if an entry was written since it was last trimmed."""
+    try:
+      os.unlink(os.path.join(self.directory, DIRTY))
+    except OSError:
+      return
+    self._dirty = False
+    self.trim()
+
+  def trim(self):
+    """Evicts the least recently used entries beyond max_size."""
+    entries = []
+    total = 0
+    for root, _, files in os.walk(self.directory):
+      for name in files:
+        path = os.path.join(root, name)
+        try:
+          st = os.stat(path)
+        except FileNotFoundError:
+          continue
+        entries.append((st.st_mtime_ns, st.st_size, path))
+        total += st.st_size
+    if total <= self.max_size:
+      return
+    entries.sort()
+    target = self.max_size * 9 // 10
+    for _, size, path in entries:
+      if total <= target:
+        break
+      try:
+        os.unlink(path)
+      except FileNotFoundError:
+        pass
+      total -= size
+
+
+def from_environment():
+  """Creates a SymbolCache as configured by ABI_SYMBOL_CACHE_DIR, or None.
+
+  ABI_SYMBOL_CACHE_MAX_SIZE optionally sets the size limit in bytes.
+  """
+  directory = os.environ.get("ABI_SYMBOL_CACHE_DIR")
+  if not directory:
+    return None
+  max_size = int(
+      os.environ.get("ABI_SYMBOL_CACHE_MAX_SIZE", DEFAULT_MAX_SIZE))
+  return SymbolCache(directory, max_size)
@@ -0,0 +1,134 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+import symbol_cache
+
+
+class SymbolCacheTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.cache = symbol_cache.SymbolCache(os.path.join(self.tmp, "cache"))
+    self.calls = []
+
+  def _binary(self, name, content, mtime=1000):
+    path = os.path.join(self.tmp, name)
+    with open(path, "wb") as f:
+      f.write(content)
+    # Pretend the file is old enough for the stat shortcut.
+    os.utime(path, (mtime, mtime))
+    return path
+
+  def _extract(self, binary):
+    self.calls.append(binary)
+    with open(binary, "rb") as f:
+      return sorted(f.read().decode().split())
+
+  def test_hit(self):
+    path = self._binary("a.ko", b"foo bar")
+    self.assertEqual(self.cache.get("undefined", path, self._extract),
+                     ["bar", "foo"])
+    self.assertEqual(self.cache.get("undefined", path, self._extract),
+                     ["bar", "foo"])
+    self.assertLen(self.calls, 1)
+
+  def test_kinds_are_separate(self):
+    path = self._binary("a.ko", b"foo")
+    self.cache.get("undefined", path, self._extract)
+    self.cache.get("exported", path, self._extract)
+    self.assertLen(self.calls, 2)
+
+  def test_empty_list(self):
+    path = self._binary("a.ko", b"")
+    self.assertEqual(self.cache.get("undefined", path, self._extract), [])
+    self.assertEqual(self.cache.get("undefined", path, self._extract), [])
+    self.assertLen(self.calls, 1)
+
+  def test_same_content_is_shared(self):
+    a = self._binary("a.ko", b"foo")
+    b = self._binary("b.ko", b"foo")
+    self.cache.get("undefined", a, self._extract)
+    self.cache.get("undefined", b, self._extract)
+    self.assertEqual(self.calls, [a])
+
+  def test_changed_content(self):
+    path = self._binary("a.ko", b"foo")
+    self.cache.get("undefined", path, self._extract)
+    path = self._binary("a.ko", b"bar", mtime=2000)
+    self.assertEqual(self.cache.get("undefined", path, self._extract),
+                     ["bar"])
+    self.assertLen(self.calls, 2)
+
+  def test_trim(self):
+    self.cache.max_size = 1
+    path = self._binary("a.ko", b"foo")
+    self.cache.get("undefined", path, self._extract)
+    self.cache.trim()
+    self.cache.get("undefined", path, self._extract)
+    self.assertLen(self.calls, 2)
+
+  def test_trim_keeps_recent_entries(self):
+    old = self._binary("old.ko", b"old")
+    self.cache.get("undefined", old, self._extract)
+    sizes = 0
+    for root, _, files in os.walk(self.cache.directory):
+      for name in files:
+        path = os.path.join(root, name)
+        sizes += os.path.getsize(path)
+        os.utime(path, (1, 1))
+    new = self._binary("new.ko", b"new")
+    self.cache.get("undefined", new, self._extract)
+    # Room for roughly one generation of entries.
+    self.cache.max_size = sizes + 8
+    self.cache.trim()
+    self.cache.get("undefined", new, self._extract)
+    self.cache.get("undefined", old, self._extract)
+    self.assertEqual(self.calls, [old, new, old])
+
+  def test_trim_if_dirty(self):
+    path = self._binary("a.ko", b"foo")
+    self.cache.get("undefined", path, self._extract)
+    with mock.patch.object(self.cache, "trim") as trim:
+      self.cache.trim_if_dirty()
+      self.cache.trim_if_dirty()
+    trim.assert_called_once()
+    # Entries written by another process, e.g. a worker.
+    other = symbol_cache.SymbolCache(self.cache.directory)
+    other.get("exported", path, self._extract)
+    with mock.patch.object(self.cache, "trim") as trim:
+      self.cache.trim_if_dirty()
+    trim.assert_called_once()
+
+  def test_unwritable(self):
+    directory = os.path.join(self.tmp, "file")
+    with open(directory, "w"):
+      pass
+    cache = symbol_cache.SymbolCache(directory)
+    path = self._binary("a.ko", b"foo")
+    self.assertEqual(cache.get("undefined", path, self._extract), ["foo"])
+    self.assertEqual(cache.get("undefined", path, self._extract), ["foo"])
+    self.assertLen(self.calls, 2)
+    cache.trim_if_dirty()
+
+
+if __name__ == "__main__":
+  absltest.main()
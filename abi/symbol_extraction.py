@@ -22,15 +22,108 @@ extract_undefined_symbols(): Extracts the undefined symbols from an ELF file at
 binary_path.
 is_signature_present(): Checks whether a kernel module file has a PKCS#7
 signature appended.
+read_signature(): Reads the signer, hash algorithm and key id of the signature
+appended to a kernel module.
+read_module_profile(): Reads imports, exports, signature and modinfo of a
+kernel module in a single pass.
+read_module_profiles(): Reads the profiles of many binaries in parallel.
+preload_profiles(): Makes all of the above reuse already read profiles.
+list_files(): Lists the files below a directory, once per process.
+read_binaries_manifest(): Reads an explicit list of binaries, e.g. written by
+Bazel, instead of discovering them with list_files().
 read_symbol_list(): Reads a previously created libabigail format symbol list
-into a list of symbols.
+(or a snapshot of one, see symbol_list.py) into a list of symbols.
+set_backend(): Selects how symbols are read from binaries.
+enable_cache(): Caches extracted symbols on disk across invocations.
+
+By default symbols are read in-process from the ELF symbol table. Setting
+ABI_SYMBOL_EXTRACTION_BACKEND=llvm-nm in the environment (or calling
+set_backend(BACKEND_LLVM_NM)) falls back to running llvm-nm for every binary.
+
+Setting ABI_SYMBOL_CACHE_DIR (or calling enable_cache()) keeps the extracted
+symbols in a content addressed cache, see symbol_cache.py.
 """
 
+import concurrent.futures
+import dataclasses
+import functools
+import os
 import subprocess
 
+import elf_reader
+import module_signature
+import symbol_cache
+import symbol_list as symbol_list_lib
+
+BACKEND_ELF = "elf"
+BACKEND_LLVM_NM = "llvm-nm"
+_BACKENDS = (BACKEND_ELF, BACKEND_LLVM_NM)
+_KSYMTAB_PREFIX = "__ksymtab_"
+
+_backend = os.environ.get("ABI_SYMBOL_EXTRACTION_BACKEND", BACKEND_ELF)
+_cache = symbol_cache.from_environment()
+# Profiles handed to preload_profiles(), keyed by absolute path.
+_preloaded = {}
+
+
+def set_backend(backend):
+  """Selects the implementation used by the extract_*_symbols() functions."""
+  global _backend
+  if backend not in _BACKENDS:
+    raise ValueError(f"unknown symbol extraction backend {backend!r}")
+  _backend = backend
+
+
+def enable_cache(directory, max_size=symbol_cache.DEFAULT_MAX_SIZE):
+  """Caches extracted symbols in directory, evicting beyond max_size bytes."""
+  global _cache
+  _cache = symbol_cache.SymbolCache(directory, max_size)
+
+
+def _use_llvm_nm():
+  return _backend == BACKEND_LLVM_NM
+
+
+def preload_profiles(profiles):
+  """Serves later lookups of the given binaries from memory.
+
+  Args:
+    profiles: ModuleProfiles, e.g. from read_module_profiles(). The binaries
+      must not change for the rest of the process.
+  """
+  for profile in profiles:
+    _preloaded[os.path.abspath(profile.path)] = profile
+
+
+def _preloaded_profile(binary):
+  if not _preloaded:
+    return None
+  return _preloaded.get(os.path.abspath(binary))
+
 
 def extract_exported_symbols(binary):
   """Extracts the ksymtab exported symbols from an ELF binary."""
+  profile = _preloaded_profile(binary)
+  if profile:
+    return profile.exported_symbols
+  if _cache:
+    return _cache.get("exported", binary, _extract_exported_symbols)
+  return _extract_exported_symbols(binary)
+
+
+def extract_undefined_symbols(binary_path):
+  """Extracts the undefined symbols from an ELF file at  binary_path."""
+  profile = _preloaded_profile(binary_path)
+  if profile:
+    return list(profile.undefined_symbols)
+  if _cache:
+    return _cache.get("undefined", binary_path, _extract_undefined_symbols)
+  return _extract_undefined_symbols(binary_path)
+
+
+def _extract_exported_symbols(binary):
+  if not _use_llvm_nm():
+    return _elf_exported_symbols(binary)
   symbols = []
   out = subprocess.check_output(["llvm-nm", "--defined-only", binary],
                                 stderr=subprocess.DEVNULL).decode("ascii")
@@ -42,8 +135,9 @@ def extract_exported_symbols(binary):
   return symbols
 
 
-def extract_undefined_symbols(binary_path):
-  """Extracts the undefined symbols from an ELF file at  binary_path."""
+def _extract_undefined_symbols(binary_path):
+  if not _use_llvm_nm():
+    return _elf_undefined_symbols(binary_path)
   symbols = []
   out = subprocess.check_output(["llvm-nm", "--undefined-only", binary_path],
                                 stderr=subprocess.DEVNULL).decode("ascii")
@@ -53,19 +147,221 @@ def extract_undefined_symbols(binary_path):
   return symbols
 
 
+def _is_ksymtab_entry(sym):
+  return (sym.shndx != elf_reader.SHN_UNDEF and
+          sym.name.startswith(_KSYMTAB_PREFIX) and
+          sym.type not in (elf_reader.STT_SECTION, elf_reader.STT_FILE))
+
+
+def _elf_exported_symbols(binary):
+  """Like `llvm-nm --defined-only`, filtered on __ksymtab_ entries."""
+  with elf_reader.ElfFile.open(binary) as elf:
+    return sorted(
+        sym.name[len(_KSYMTAB_PREFIX):]
+        for sym in elf.symbols()
+        if _is_ksymtab_entry(sym))
+
+
+def _elf_undefined_symbols(binary_path):
+  """Like `llvm-nm --undefined-only`."""
+  with elf_reader.ElfFile.open(binary_path) as elf:
+    return sorted(
+        sym.name
+        for sym in elf.symbols()
+        if sym.shndx == elf_reader.SHN_UNDEF and sym.name)
+
+
+@dataclasses.dataclass
+class ModuleProfile:
+  """Everything the ABI tools need to know about a kernel binary."""
+  path: str
+  # Undefined symbols, sorted like `llvm-nm --undefined-only`.
+  undefined_symbols: list[str]
+  # __ksymtab exports, sorted, split on the license they are exported with.
+  gpl_exports: list[str]
+  non_gpl_exports: list[str]
+  # The appended signature, None if the binary is not signed.
+  signature: module_signature.ModuleSignature | None
+  # Key/value pairs of .modinfo. Keys like "alias" may be present repeatedly.
+  modinfo: dict[str, list[str]]
+
+  @classmethod
+  def from_dict(cls, fields, path):
+    """Recreates a profile from dataclasses.asdict() of a profile of path."""
+    fields = dict(fields, path=os.fspath(path))
+    if fields["signature"]:
+      fields["signature"] = module_signature.ModuleSignature(
+          **fields["signature"])
+    return cls(**fields)
+
+  @property
+  def exported_symbols(self):
+    """All __ksymtab exports, as extract_exported_symbols() returns them."""
+    return sorted(self.gpl_exports + self.non_gpl_exports)
+
+  @property
+  def is_signed(self):
+    """Same as is_signature_present()."""
+    return self.signature is not None and self.signature.id_type == "PKCS#7"
+
+
+def _is_gpl_ksymtab(section):
+  # ___ksymtab_gpl+<symbol> in objects, __ksymtab_gpl once linked.
+  return section is not None and (section == "__ksymtab_gpl" or
+                                  section.startswith("___ksymtab_gpl+"))
+
+
+def _parse_modinfo(data):
+  modinfo = {}
+  for entry in bytes(data).split(b"\0"):
+    key, sep, value = entry.decode("utf-8", errors="replace").partition("=")
+    if sep:
+      modinfo.setdefault(key, []).append(value)
+  return modinfo
+
+
+def read_module_profile(binary):
+  """Reads a ModuleProfile of a kernel module (or vmlinux) in a single pass.
+
+  The file is mapped once; symbols, .modinfo and the signature trailer are
+  all read from that mapping. With the llvm-nm backend selected by
+  set_backend(), the symbols are read by a single llvm-nm run instead, while
+  .modinfo and the signature are still read in-process.
+  """
+  profile = _preloaded_profile(binary)
+  if profile:
+    return dataclasses.replace(profile, path=os.fspath(binary))
+  if not _cache:
+    return _read_module_profile(binary)
+  fields = _cache.get("profile", binary,
+                      lambda b: dataclasses.asdict(_read_module_profile(b)))
+  # Entries are shared by identical files, the path is the one asked for.
+  return ModuleProfile.from_dict(fields, binary)
+
+
+def _llvm_nm_module_symbols(binary):
+  """Returns the undefined symbols, GPL and non-GPL exports using llvm-nm."""
+  undefined = []
+  gpl = []
+  non_gpl = []
+  # The SysV format is the only one naming the section of every symbol.
+  out = subprocess.check_output(["llvm-nm", "--format=sysv", binary],
+                                stderr=subprocess.DEVNULL).decode("ascii")
+  for line in out.splitlines():
+    fields = line.split("|")
+    if len(fields) != 7:
+      continue
+    name = fields[0].strip()
+    section = fields[6].strip()
+    if section == "*UND*":
+      if name:
+        undefined.append(name)
+    elif (name.startswith(_KSYMTAB_PREFIX) and
+          fields[3].strip() not in ("SECTION", "FILE")):
+      name = name[len(_KSYMTAB_PREFIX):]
+      if _is_gpl_ksymtab(section):
+        gpl.append(name)
+      else:
+        non_gpl.append(name)
+  return undefined, gpl, non_gpl
+
+
+def _read_module_profile(binary):
+  undefined = []
+  gpl = []
+  non_gpl = []
+  with elf_reader.ElfFile.open(binary) as elf:
+    if _use_llvm_nm():
+      undefined, gpl, non_gpl = _llvm_nm_module_symbols(binary)
+    else:
+      for sym in elf.symbols():
+        if sym.shndx == elf_reader.SHN_UNDEF:
+          if sym.name:
+            undefined.append(sym.name)
+        elif _is_ksymtab_entry(sym):
+          name = sym.name[len(_KSYMTAB_PREFIX):]
+          if _is_gpl_ksymtab(elf.section_name(sym.shndx)):
+            gpl.append(name)
+          else:
+            non_gpl.append(name)
+    modinfo_section = elf.section_by_name(".modinfo")
+    modinfo = (_parse_modinfo(elf.section_data(modinfo_section))
+               if modinfo_section else {})
+    signature = module_signature.parse(elf.data)
+
+  return ModuleProfile(
+      path=os.fspath(binary),
+      undefined_symbols=sorted(undefined),
+      gpl_exports=sorted(gpl),
+      non_gpl_exports=sorted(non_gpl),
+      signature=signature,
+      modinfo=modinfo,
+  )
+
+
+def read_signature(module):
+  """Returns the ModuleSignature appended to module, or None if unsigned."""
+  return module_signature.read(module)
+
+
 def is_signature_present(module):
   """Checks whether module has a signature appended (GKI) or not (vendor)"""
-  out = subprocess.check_output(["modinfo", "-F", "sig_id", module],
-                                stderr=subprocess.STDOUT).decode("ascii")
-  return out == "PKCS#7\n"
+  profile = _preloaded_profile(module)
+  if profile:
+    return profile.is_signed
+  # Same as `modinfo -F sig_id` printing "PKCS#7", without the process.
+  signature = module_signature.read(module)
+  return signature is not None and signature.id_type == "PKCS#7"
+
+
+def read_module_profiles(binaries, jobs=1):
+  """Reads the ModuleProfile of every binary, keyed by path.
+
+  Up to jobs binaries are read in parallel worker processes. The result does
+  not depend on the number of jobs.
+  """
+  binaries = list(binaries)
+  # Only farm out what has not been preloaded already.
+  missing = [binary for binary in binaries if not _preloaded_profile(binary)]
+  if jobs is None or jobs <= 1 or len(missing) <= 1:
+    return {binary: read_module_profile(binary) for binary in binaries}
+  jobs = min(jobs, len(missing))
+  chunksize = max(1, len(missing) // (jobs * 4))
+  with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+    read = dict(
+        zip(missing,
+            executor.map(read_module_profile, missing, chunksize=chunksize)))
+  return {
+      binary: read[binary] if binary in read else read_module_profile(binary)
+      for binary in binaries
+  }
+
+
+@functools.lru_cache(maxsize=None)
+def _list_files(directory):
+  files = []
+  for root, _, names in os.walk(directory):
+    files.extend(os.path.join(root, name) for name in names)
+  return tuple(files)
+
+
+def list_files(directory):
+  """Lists all files below directory, walking it only once per process."""
+  return _list_files(os.fspath(directory))
+
+
+def read_binaries_manifest(manifest):
+  """Reads a list of paths separated by newlines or NUL characters."""
+  with open(manifest, "rb") as f:
+    content = f.read()
+  separator = b"\0" if b"\0" in content else b"\n"
+  return [os.fsdecode(path) for path in content.split(separator) if path]
 
 
 def read_symbol_list(symbol_list):
-  """Reads a previously created libabigail symbol symbol list."""
-  symbols = []
-  with open(symbol_list) as symbol_list_file:
-    for line in [l.strip() for l in symbol_list_file]:
-      if not line or line.startswith("#") or line.startswith("["):
-        continue
-      symbols.append(line)
-  return symbols
+  """Reads a previously created libabigail symbol symbol list.
+
+  symbol_list may also be a snapshot written by symbol_list.SymbolList.
+  Every symbol is returned once, in the order it is first listed.
+  """
+  return symbol_list_lib.load(symbol_list).symbols()
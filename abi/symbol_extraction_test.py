@@ -0,0 +1,162 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import elf_reader
+import module_signature
+import symbol_extraction
+import synthetic_corpus
+
+
+_DEFINED = [
+    ("___ksymtab+foo", "__ksymtab_foo"),
+    ("___ksymtab_gpl+bar", "__ksymtab_bar"),
+    (".text", "foo"),
+    (".text", "bar"),
+    (".text", "not__ksymtab_baz"),
+]
+_UNDEFINED = ["printk", "__tracepoint_x", "_mcount", "Zeta"]
+
+
+class SymbolExtractionTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.addCleanup(symbol_extraction.set_backend,
+                    symbol_extraction.BACKEND_ELF)
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+
+  def _make(self, is_64=True, little_endian=True, machine=62):
+    path = os.path.join(self.tmp, "test.ko")
+    synthetic_corpus.write_elf(path, is_64, little_endian, _DEFINED,
+                               _UNDEFINED, machine)
+    return path
+
+  @parameterized.named_parameters(
+      ("elf64le", True, True, 62),
+      ("elf64be", True, False, 21),
+      ("elf32le", False, True, 3),
+      ("elf32be", False, False, 20),
+  )
+  def test_native(self, is_64, little_endian, machine):
+    path = self._make(is_64, little_endian, machine)
+    self.assertEqual(
+        symbol_extraction.extract_exported_symbols(path), ["bar", "foo"])
+    self.assertEqual(
+        symbol_extraction.extract_undefined_symbols(path),
+        ["Zeta", "__tracepoint_x", "_mcount", "printk"])
+
+  @parameterized.named_parameters(
+      ("elf64le", True, True, 62),
+      ("elf32be", False, False, 20),
+  )
+  def test_parity_with_llvm_nm(self, is_64, little_endian, machine):
+    if not shutil.which("llvm-nm"):
+      self.skipTest("llvm-nm is not available")
+    path = self._make(is_64, little_endian, machine)
+    native = (symbol_extraction.extract_exported_symbols(path),
+              symbol_extraction.extract_undefined_symbols(path))
+    symbol_extraction.set_backend(symbol_extraction.BACKEND_LLVM_NM)
+    nm = (symbol_extraction.extract_exported_symbols(path),
+          symbol_extraction.extract_undefined_symbols(path))
+    self.assertEqual(native, nm)
+
+  def test_module_profile_parity_with_llvm_nm(self):
+    if not shutil.which("llvm-nm"):
+      self.skipTest("llvm-nm is not available")
+    path = self._make()
+    native = symbol_extraction.read_module_profile(path)
+    symbol_extraction.set_backend(symbol_extraction.BACKEND_LLVM_NM)
+    with mock.patch.object(
+        subprocess, "check_output", wraps=subprocess.check_output) as run:
+      nm = symbol_extraction.read_module_profile(path)
+    run.assert_called_once()
+    self.assertEqual(native, nm)
+    self.assertEqual(nm.gpl_exports, ["bar"])
+    self.assertEqual(nm.non_gpl_exports, ["foo"])
+
+  def test_no_symbols(self):
+    path = os.path.join(self.tmp, "empty.ko")
+    synthetic_corpus.write_elf(path, True, True, [], [], 62)
+    self.assertEqual(symbol_extraction.extract_exported_symbols(path), [])
+    self.assertEqual(symbol_extraction.extract_undefined_symbols(path), [])
+
+  def test_not_elf(self):
+    path = os.path.join(self.tmp, "garbage.ko")
+    with open(path, "wb") as f:
+      f.write(b"not an elf file")
+    with self.assertRaises(elf_reader.ElfError):
+      symbol_extraction.extract_undefined_symbols(path)
+
+  def test_module_profile(self):
+    path = os.path.join(self.tmp, "test.ko")
+    trailer = (b"\x30\x00" + struct.pack(">BBBBB3xI", 1, 0, 2, 0, 0, 2) +
+               module_signature.MAGIC)
+    synthetic_corpus.write_elf(
+        path, True, True, _DEFINED, _UNDEFINED, 62,
+        modinfo=b"license=GPL\0alias=a\0alias=b\0\0depends=\0",
+        trailer=trailer)
+    profile = symbol_extraction.read_module_profile(path)
+    self.assertEqual(profile.path, path)
+    self.assertEqual(profile.undefined_symbols,
+                     symbol_extraction.extract_undefined_symbols(path))
+    self.assertEqual(profile.exported_symbols,
+                     symbol_extraction.extract_exported_symbols(path))
+    self.assertEqual(profile.gpl_exports, ["bar"])
+    self.assertEqual(profile.non_gpl_exports, ["foo"])
+    self.assertEqual(profile.modinfo, {
+        "license": ["GPL"],
+        "alias": ["a", "b"],
+        "depends": [""],
+    })
+    self.assertTrue(profile.is_signed)
+    self.assertTrue(symbol_extraction.is_signature_present(path))
+
+  def test_module_profile_cached(self):
+    symbol_extraction.enable_cache(os.path.join(self.tmp, "cache"))
+    self.addCleanup(setattr, symbol_extraction, "_cache", None)
+    path = self._make()
+    first = symbol_extraction.read_module_profile(path)
+    second = symbol_extraction.read_module_profile(path)
+    self.assertEqual(first, second)
+    self.assertFalse(second.is_signed)
+    self.assertEqual(second.modinfo, {})
+
+  @parameterized.named_parameters(
+      ("newline", b"a/vmlinux\nb c.ko\n\n"),
+      ("nul", b"a/vmlinux\0b c.ko\0"),
+  )
+  def test_read_binaries_manifest(self, content):
+    path = os.path.join(self.tmp, "binaries")
+    with open(path, "wb") as f:
+      f.write(content)
+    self.assertEqual(
+        symbol_extraction.read_binaries_manifest(path), ["a/vmlinux", "b c.ko"])
+
+  def test_unknown_backend(self):
+    with self.assertRaises(ValueError):
+      symbol_extraction.set_backend("objdump")
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Reads and writes symbol lists in libabigail format.
+
+A symbol list is a sequence of sections, each listing one symbol per line:
+
+  [abi_symbol_list]
+  # commented out or informative lines
+    symbol_a
+    symbol_b
+
+The parser streams over the lines and keeps which section every symbol is
+listed in. Symbol names are interned, so the many lists sharing most of
+their symbols only keep one copy of each name in memory.
+
+A symbol list can also be stored as a binary snapshot, which is much faster
+to load than text:
+
+  magic       b"ABISYML\\x01"
+  header      <symbol count> <section count> <string table size> (u32 LE)
+  strings     the sorted symbols, then the section names, NUL separated
+  bitmaps     for every section, one bit per symbol of the string table
+
+Symbols of a section loaded from a snapshot are in sorted order.
+
+load(): Reads a symbol list, either as text or as a snapshot.
+load_all(): Reads and merges several symbol lists.
+"""
+
+import io
+import itertools
+import struct
+import sys
+
+SNAPSHOT_MAGIC = b"ABISYML\x01"
+_HEADER = struct.Struct("<III")
+
+# The bits of every byte value as 8 bytes, least significant bit first.
+_BYTE_BITS = [
+    bytes((value >> bit) & 1 for bit in range(8)) for value in range(256)
+]
+
+# Sections holding the symbols of the KMI.
+KMI_SECTION_SUFFIXES = ("whitelist", "symbol_list")
+
+
+class SymbolList:
+  """The symbols of a symbol list, grouped by section.
+
+  Symbols listed before the first section header are in the "" section.
+  """
+
+  def __init__(self):
+    # Dicts are used as insertion ordered sets.
+    self._sections = {}
+
+  def add(self, section, symbol):
+    """Adds symbol to section."""
+    members = self._sections.get(section)
+    if members is None:
+      members = self._sections[sys.intern(section)] = {}
+    members[sys.intern(symbol)] = None
+
+  def parse(self, lines, comment_prefixes="#"):
+    """Adds the symbols of an iterable of lines in libabigail format.
+
+    Args:
+      lines: The lines to parse.
+      comment_prefixes: The characters starting a comment line. Pass "#;" to
+        also skip the ";" comments configparser skips.
+    """
+    section = ""
+    members = None
+    intern = sys.intern
+    for line in lines:
+      line = line.strip()
+      if not line or line[0] in comment_prefixes:
+        continue
+      if line[0] == "[":
+        section = line[1:line.find("]")] if "]" in line else line[1:]
+        members = None
+        continue
+      if members is None:
+        members = self._sections.setdefault(intern(section), {})
+      members[intern(line)] = None
+    return self
+
+  def merge(self, other):
+    """Adds all symbols of another SymbolList."""
+    for section, members in other._sections.items():  # pylint: disable=protected-access
+      self._sections.setdefault(section, {}).update(members)
+    return self
+
+  def sections(self):
+    """Returns the names of the sections, in the order they were read."""
+    return list(self._sections)
+
+  def symbols(self, sections=None):
+    """Returns the symbols of some or all sections, without duplicates.
+
+    Args:
+      sections: Names of the sections to return the symbols of, or a
+        predicate on section names. All sections if None.
+    """
+    if sections is None:
+      selected = self._sections.values()
+    elif callable(sections):
+      selected = (members for name, members in self._sections.items()
+                  if sections(name))
+    else:
+      selected = (self._sections.get(name, {}) for name in sections)
+    result = {}
+    for members in selected:
+      result.update(members)
+    return list(result)
+
+  def kmi_symbols(self):
+    """Returns the symbols of the sections making up the KMI."""
+    return self.symbols(lambda name: name.endswith(KMI_SECTION_SUFFIXES))
+
+  def __contains__(self, symbol):
+    return any(symbol in members for members in self._sections.values())
+
+  def __len__(self):
+    return len(self.symbols())
+
+  def to_snapshot(self):
+    """Returns the binary snapshot of the symbol list."""
+    table = sorted(self.symbols())
+    index = {symbol: i for i, symbol in enumerate(table)}
+    names = list(self._sections)
+    strings = "\0".join(itertools.chain(table, names)).encode()
+    bitmap_size = (len(table) + 7) // 8
+    bitmaps = []
+    for members in self._sections.values():
+      bitmap = bytearray(bitmap_size)
+      for symbol in members:
+        i = index[symbol]
+        bitmap[i >> 3] |= 1 << (i & 7)
+      bitmaps.append(bitmap)
+    return b"".join([
+        SNAPSHOT_MAGIC,
+        _HEADER.pack(len(table), len(names), len(strings)),
+        strings,
+        *bitmaps,
+    ])
+
+  @classmethod
+  def from_snapshot(cls, data):
+    """Loads a binary snapshot created by to_snapshot().
+
+    Raises:
+      ValueError: if data is not a valid snapshot.
+    """
+    if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+      raise ValueError("not a symbol list snapshot")
+    offset = len(SNAPSHOT_MAGIC)
+    try:
+      symbol_count, section_count, strings_size = _HEADER.unpack_from(
+          data, offset)
+    except struct.error as e:
+      raise ValueError("truncated symbol list snapshot") from e
+    offset += _HEADER.size
+    bitmap_size = (symbol_count + 7) // 8
+    if len(data) != offset + strings_size + section_count * bitmap_size:
+      raise ValueError("truncated symbol list snapshot")
+    strings = bytes(data[offset:offset + strings_size]).decode()
+    offset += strings_size
+    # The names in the table are unique already, so they are not interned;
+    # that would cost more than the rest of the loading.
+    strings = strings.split("\0") if symbol_count + section_count else []
+    if len(strings) != symbol_count + section_count:
+      raise ValueError("corrupt symbol list snapshot")
+    table = strings[:symbol_count]
+    full = b"\xff" * (symbol_count // 8) + (
+        bytes([(1 << symbol_count % 8) - 1]) if symbol_count % 8 else b"")
+
+    symbol_list = cls()
+    for name in strings[symbol_count:]:
+      bitmap = data[offset:offset + bitmap_size]
+      offset += bitmap_size
+      if bitmap == full:
+        members = table
+      else:
+        members = itertools.compress(
+            table, b"".join(_BYTE_BITS[byte] for byte in bitmap))
+      symbol_list._sections[sys.intern(name)] = dict.fromkeys(members)  # pylint: disable=protected-access
+    return symbol_list
+
+  def save_snapshot(self, path):
+    """Writes the binary snapshot of the symbol list to path."""
+    with open(path, "wb") as f:
+      f.write(self.to_snapshot())
+
+
+def load(path):
+  """Reads the symbol list or the snapshot at path."""
+  with open(path, "rb") as f:
+    magic = f.read(len(SNAPSHOT_MAGIC))
+    if magic == SNAPSHOT_MAGIC:
+      return SymbolList.from_snapshot(magic + f.read())
+    f.seek(0)
+    with io.TextIOWrapper(f, encoding="utf-8") as text:
+      return SymbolList().parse(text)
+
+
+def load_all(paths):
+  """Reads and merges several symbol lists or snapshots."""
+  merged = SymbolList()
+  for path in paths:
+    merged.merge(load(path))
+  return merged
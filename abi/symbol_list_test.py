@@ -0,0 +1,111 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from absl.testing import absltest
+import symbol_list
+import symbol_extraction
+
+_LIST = """\
+[abi_symbol_list]
+# commented out
+  foo
+  bar
+
+[abi_symbol_list_gpl]
+  baz
+  foo
+
+[other]
+  qux
+"""
+
+
+class SymbolListTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+
+  def _write(self, name, content):
+    path = os.path.join(self.tmp, name)
+    with open(path, "wb" if isinstance(content, bytes) else "w") as f:
+      f.write(content)
+    return path
+
+  def test_parse(self):
+    sl = symbol_list.SymbolList().parse(_LIST.splitlines())
+    self.assertEqual(sl.sections(),
+                     ["abi_symbol_list", "abi_symbol_list_gpl", "other"])
+    self.assertEqual(sl.symbols(), ["foo", "bar", "baz", "qux"])
+    self.assertEqual(sl.symbols(["abi_symbol_list_gpl"]), ["baz", "foo"])
+    self.assertEqual(sl.kmi_symbols(), ["foo", "bar"])
+    self.assertIn("qux", sl)
+    self.assertNotIn("abi_symbol_list", sl)
+
+  def test_parse_comment_prefixes(self):
+    # Only "#" starts a comment, unless ";" is asked for as configparser does.
+    lines = ["[abi_symbol_list]", "# comment", "; comment", "foo"]
+    self.assertEqual(symbol_list.SymbolList().parse(lines).symbols(),
+                     ["; comment", "foo"])
+    self.assertEqual(
+        symbol_list.SymbolList().parse(lines, comment_prefixes="#;").symbols(),
+        ["foo"])
+
+  def test_read_symbol_list_duplicates(self):
+    # Symbols listed in several sections are returned once.
+    path = self._write("list", _LIST)
+    self.assertEqual(symbol_extraction.read_symbol_list(path).count("foo"), 1)
+
+  def test_merge(self):
+    first = symbol_list.SymbolList().parse(["[abi_symbol_list]", "a", "b"])
+    second = symbol_list.SymbolList().parse(["[abi_symbol_list]", "b", "c"])
+    self.assertEqual(first.merge(second).symbols(), ["a", "b", "c"])
+
+  def test_snapshot(self):
+    sl = symbol_list.SymbolList().parse(_LIST.splitlines())
+    snapshot = symbol_list.SymbolList.from_snapshot(sl.to_snapshot())
+    self.assertEqual(snapshot.sections(), sl.sections())
+    for section in sl.sections():
+      self.assertEqual(snapshot.symbols([section]),
+                       sorted(sl.symbols([section])))
+
+  def test_empty_snapshot(self):
+    sl = symbol_list.SymbolList()
+    self.assertEqual(
+        symbol_list.SymbolList.from_snapshot(sl.to_snapshot()).symbols(), [])
+
+  def test_corrupt_snapshot(self):
+    data = symbol_list.SymbolList().parse(_LIST.splitlines()).to_snapshot()
+    with self.assertRaises(ValueError):
+      symbol_list.SymbolList.from_snapshot(data[:-1])
+
+  def test_load(self):
+    text = self._write("list", _LIST)
+    snapshot = self._write(
+        "list.snapshot", symbol_list.load(text).to_snapshot())
+    self.assertEqual(symbol_extraction.read_symbol_list(text),
+                     ["foo", "bar", "baz", "qux"])
+    self.assertEqual(symbol_extraction.read_symbol_list(snapshot),
+                     ["bar", "foo", "baz", "qux"])
+    self.assertEqual(
+        symbol_list.load_all([text, snapshot]).kmi_symbols(), ["foo", "bar"])
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Generates synthetic kernel binaries for tests and benchmarks.
+
+The binaries are relocatable ELF files written directly, without a
+toolchain, with just what the ABI tools look at: the symbol table, the
+__ksymtab sections, .modinfo and an optional signature trailer.
+
+write_elf(): Writes one ELF file with the given symbols.
+generate(): Writes a fake vmlinux and N modules depending on it and on each
+other.
+"""
+
+import dataclasses
+import os
+import random
+import struct
+
+import module_signature
+
+EM_X86_64 = 62
+
+
+def write_elf(path, is_64, little_endian, defined, undefined, machine,
+              modinfo=None, trailer=b""):
+  """Writes a relocatable ELF file with the given symbols.
+
+  defined is a list of (section name, symbol name) pairs; every section is
+  created on the fly. undefined is a list of symbol names. modinfo, if set,
+  is the content of a .modinfo section and trailer is appended to the file.
+  """
+  order = "<" if little_endian else ">"
+  if is_64:
+    ehdr = struct.Struct(order + "16sHHIQQQIHHHHHH")
+    shdr = struct.Struct(order + "IIQQQQIIQQ")
+    sym = struct.Struct(order + "IBBHQQ")
+  else:
+    ehdr = struct.Struct(order + "16sHHIIIIIHHHHHH")
+    shdr = struct.Struct(order + "IIIIIIIIII")
+    sym = struct.Struct(order + "IIIBBH")
+
+  def pack_sym(name, info, shndx):
+    if is_64:
+      return sym.pack(name, info, 0, shndx, 0, 0)
+    return sym.pack(name, 0, 0, info, 0, shndx)
+
+  shstrtab = bytearray(b"\0")
+  strtab = bytearray(b"\0")
+
+  def add(table, name):
+    offset = len(table)
+    table.extend(name.encode() + b"\0")
+    return offset
+
+  # Section 0 is the null section, sections 1..n hold the defined symbols.
+  progbits = []
+  for section, _ in defined:
+    if section not in progbits:
+      progbits.append(section)
+  contents = {section: b"\0" * 8 for section in progbits}
+  if modinfo is not None:
+    progbits.append(".modinfo")
+    contents[".modinfo"] = modinfo
+  symtab_index = len(progbits) + 1
+  strtab_index = symtab_index + 1
+  shstrtab_index = strtab_index + 1
+
+  symbols = [pack_sym(0, 0, 0)]
+  # STB_LOCAL section symbol, then a file symbol, then globals.
+  symbols.append(pack_sym(0, 3, 1 if progbits else 0))
+  symbols.append(pack_sym(add(strtab, "test.c"), 4, 0xfff1))
+  for section, name in defined:
+    symbols.append(
+        pack_sym(add(strtab, name), (1 << 4) | 1,
+                 progbits.index(section) + 1))
+  for name in undefined:
+    symbols.append(pack_sym(add(strtab, name), (1 << 4), 0))
+  symtab = b"".join(symbols)
+
+  body = bytearray(b"\0" * ehdr.size)
+  headers = [shdr.pack(*([0] * 10))]
+  for section in progbits:
+    headers.append(
+        shdr.pack(add(shstrtab, section), 1, 2, 0, len(body),
+                  len(contents[section]), 0, 0, 8, 0))
+    body.extend(contents[section])
+  headers.append(
+      shdr.pack(add(shstrtab, ".symtab"), 2, 0, 0, len(body), len(symtab),
+                strtab_index, 3, 8, sym.size))
+  body.extend(symtab)
+  headers.append(
+      shdr.pack(add(shstrtab, ".strtab"), 3, 0, 0, len(body), len(strtab), 0,
+                0, 1, 0))
+  body.extend(strtab)
+  name = add(shstrtab, ".shstrtab")
+  headers.append(
+      shdr.pack(name, 3, 0, 0, len(body), len(shstrtab), 0, 0, 1, 0))
+  body.extend(shstrtab)
+  while len(body) % 8:
+    body.append(0)
+  shoff = len(body)
+  body.extend(b"".join(headers))
+
+  ident = b"\x7fELF" + bytes([2 if is_64 else 1, 1 if little_endian else 2, 1])
+  body[:ehdr.size] = ehdr.pack(
+      ident.ljust(16, b"\0"), 1, machine, 1, 0, 0, shoff, 0, ehdr.size, 0, 0,
+      shdr.size, len(headers), shstrtab_index)
+  with open(path, "wb") as f:
+    f.write(body)
+    f.write(trailer)
+
+
+def signature_trailer(id_type=module_signature.PKEY_ID_PKCS7):
+  """Returns a (fake) module signature to append to a module."""
+  signature = b"\x30\x00"
+  return (signature + struct.pack(">BBBBB3xI", 1, 4, id_type, 0, 0,
+                                  len(signature)) + module_signature.MAGIC)
+
+
+@dataclasses.dataclass
+class Corpus:
+  """The binaries written by generate()."""
+  vmlinux: str
+  modules: list[str]
+  # Modules with a signature, i.e. GKI modules.
+  signed_modules: list[str]
+  # Symbols used by the unsigned modules, as a raw symbol list would.
+  vendor_symbols: list[str]
+
+
+def _exports(names, gpl_every=4):
+  """Returns ksymtab definitions for names, one in gpl_every GPL-only."""
+  return [("__ksymtab_gpl" if i % gpl_every == 0 else "__ksymtab",
+           f"__ksymtab_{name}") for i, name in enumerate(names)]
+
+
+def generate(directory, modules, vmlinux_exports=2000, exports=20, imports=40,
+             signed_fraction=0.25, seed=0):
+  """Writes vmlinux and kernel modules below directory.
+
+  Module i exports `exports` symbols and imports `imports` symbols, mostly
+  from vmlinux and otherwise from modules before it, so the dependency graph
+  has no cycles. Every third module is put in a subdirectory.
+
+  Args:
+    directory: Where to write the binaries.
+    modules: The number of modules.
+    vmlinux_exports: The number of symbols exported by vmlinux.
+    exports: The number of symbols exported by every module.
+    imports: The number of symbols imported by every module.
+    signed_fraction: The fraction of modules with a signature.
+    seed: Seed of the random choices, the corpus only depends on arguments.
+
+  Returns:
+    A Corpus.
+  """
+  rng = random.Random(seed)
+  os.makedirs(directory, exist_ok=True)
+  kernel_symbols = [f"kernel_symbol_{i}" for i in range(vmlinux_exports)]
+  vmlinux = os.path.join(directory, "vmlinux")
+  write_elf(vmlinux, True, True, _exports(kernel_symbols), [], EM_X86_64)
+
+  corpus = Corpus(vmlinux=vmlinux, modules=[], signed_modules=[],
+                  vendor_symbols=[])
+  module_symbols = []
+  vendor_symbols = set()
+  for i in range(modules):
+    name = f"module_{i}"
+    subdirectory = os.path.join(directory, f"drivers/group_{i % 10}"
+                                if i % 3 == 0 else "")
+    os.makedirs(subdirectory, exist_ok=True)
+    path = os.path.join(subdirectory, f"{name}.ko")
+
+    own = [f"{name}_symbol_{j}" for j in range(exports)]
+    from_modules = min(len(module_symbols), imports // 4)
+    undefined = set(rng.sample(module_symbols, from_modules))
+    undefined.update(
+        rng.sample(kernel_symbols,
+                   min(len(kernel_symbols), imports - from_modules)))
+    signed = rng.random() < signed_fraction
+    write_elf(
+        path, True, True, _exports(own) + [(".text", s) for s in own],
+        sorted(undefined), EM_X86_64,
+        modinfo=f"license=GPL\0name={name}\0".encode(),
+        trailer=signature_trailer() if signed else b"")
+
+    module_symbols.extend(own)
+    corpus.modules.append(path)
+    if signed:
+      corpus.signed_modules.append(path)
+    else:
+      vendor_symbols.update(undefined)
+  corpus.vendor_symbols = sorted(vendor_symbols)
+  return corpus
@@ -0,0 +1,84 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+import benchmark_abi_tools
+import symbol_extraction
+import synthetic_corpus
+
+
+class SyntheticCorpusTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+
+  def test_generate(self):
+    corpus = synthetic_corpus.generate(
+        self.tmp, 12, vmlinux_exports=50, exports=5, imports=8,
+        signed_fraction=0.5)
+    self.assertLen(corpus.modules, 12)
+    self.assertTrue(
+        os.path.dirname(corpus.modules[0]).endswith("drivers/group_0"))
+
+    kernel_exports = set(
+        symbol_extraction.extract_exported_symbols(corpus.vmlinux))
+    self.assertLen(kernel_exports, 50)
+    defined = set(kernel_exports)
+    for path in corpus.modules:
+      profile = symbol_extraction.read_module_profile(path)
+      self.assertLen(profile.exported_symbols, 5)
+      self.assertLen(profile.undefined_symbols, 8)
+      # Modules only import from vmlinux and modules before them.
+      self.assertLessEqual(set(profile.undefined_symbols), defined)
+      defined.update(profile.exported_symbols)
+      self.assertEqual(profile.is_signed, path in corpus.signed_modules)
+      self.assertEqual(profile.modinfo["license"], ["GPL"])
+
+  def test_deterministic(self):
+    first = synthetic_corpus.generate(os.path.join(self.tmp, "a"), 5)
+    second = synthetic_corpus.generate(os.path.join(self.tmp, "b"), 5)
+    self.assertEqual(first.vendor_symbols, second.vendor_symbols)
+    for a, b in zip(first.modules, second.modules):
+      with open(a, "rb") as fa, open(b, "rb") as fb:
+        self.assertEqual(fa.read(), fb.read())
+
+  def test_benchmark(self):
+    results = benchmark_abi_tools.benchmark(
+        [3], work_dir=self.tmp, jobs=1, vmlinux_exports=50, exports=5,
+        imports=8)
+    self.assertEqual([result["tool"] for result in results],
+                     list(benchmark_abi_tools.TOOLS))
+    for result in results:
+      self.assertEqual(result["modules"], 3)
+      self.assertEqual(result["exit_code"], 0)
+      self.assertGreater(result["peak_rss_kb"], 0)
+
+  def test_run_tool_failure(self):
+    with open(os.path.join(self.tmp, "broken_tool.py"), "w") as f:
+      f.write("def main(argv):\n  raise RuntimeError('broken')\n")
+    with mock.patch.dict(os.environ, PYTHONPATH=self.tmp):
+      result = benchmark_abi_tools.run_tool("broken_tool", [], self.tmp)
+    self.assertEqual(result["exit_code"], 1)
+    self.assertIsNone(result["peak_rss_kb"])
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -27,27 +27,107 @@ Conducting this validation during the build time provides an early
 warning of a possible runtime failure. This step guarantees that
 the vendor (unsigned) module does not use any symbols that are not
 included in the KMI symbol list.
+
+Both arguments may be repeated to check many symbol lists in one run, e.g.
+every device list for several architectures. Every Module.symvers is then
+loaded once, and every symbol list is checked against the ksymtab of its
+architecture. Arguments may be prefixed with an architecture, as in
+--symvers-file aarch64=Module.symvers; a symbol list without one is checked
+against every symvers file. The prefix is only taken as an architecture if
+the path after it exists and the whole argument does not. --json-report
+writes the result of every check:
+
+  {"ok": false, "results": [{"architecture": "aarch64",
+                             "symvers_file": "...", "symbol_list": "...",
+                             "symbols": 2, "missing": ["foo"]}]}
 """
 
 import argparse
+import json
 import os
+import re
 import sys
 
+import module_symvers
 import symbol_extraction
 
 
-def main():
-  parser = argparse.ArgumentParser()
+_ARCHITECTURE_PREFIX = re.compile(r"^(\w+)=(.+)$")
+
+
+def split_architecture(argument):
+  """Splits an [ARCH=]PATH argument into (ARCH or None, PATH)."""
+  match = _ARCHITECTURE_PREFIX.match(argument)
+  # A relative path like a=b is not an architecture.
+  if (match and os.path.exists(match.group(2)) and
+      not os.path.exists(argument)):
+    return match.group(1), match.group(2)
+  return None, argument
+
+
+def verify(symvers_files, symbol_lists, objects):
+  """Checks every symbol list against the ksymtab of its architecture.
+
+  Args:
+    symvers_files: (architecture, path) of the symvers files.
+    symbol_lists: (architecture, path) of the symbol lists. A list with a None
+      architecture is checked against every symvers file.
+    objects: Kernel binaries to consider for the ksymtab.
+
+  Returns:
+    A list of dicts, one per check, as described in the module docstring.
+  """
+  # Parse every Module.symvers once, and ignore non-exported and
+  # vendor-specific symbols.
+  ksymtabs = [
+      (architecture, path,
+       module_symvers.ModuleSymvers.load(path).exported_symbols(
+           objects=objects))
+      for architecture, path in symvers_files
+  ]
+
+  results = []
+  for list_architecture, symbol_list in symbol_lists:
+    # List of symbols defined in the raw_kmi_symbol_list
+    kmi_symbols = symbol_extraction.read_symbol_list(symbol_list)
+    matched = False
+    for architecture, symvers_file, ksymtab_symbols in ksymtabs:
+      if list_architecture not in (None, architecture):
+        continue
+      matched = True
+      results.append({
+          "architecture": architecture,
+          "symvers_file": symvers_file,
+          "symbol_list": symbol_list,
+          "symbols": len(kmi_symbols),
+          # Elements in symbol list but not in ksymtab
+          "missing": sorted(
+              symbol for symbol in kmi_symbols
+              if symbol not in ksymtab_symbols),
+      })
+    if not matched:
+      raise ValueError(f"{symbol_list}: no symvers file for architecture "
+                       f"{list_architecture}")
+  return results
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
   parser.add_argument(
       "--raw-kmi-symbol-list",
+      action="append",
       required=True,
-      help="KMI symbol list",
+      help="[ARCH=]KMI symbol list. Can be passed multiple times",
   )
 
   parser.add_argument(
       "--symvers-file",
+      action="append",
       required=True,
-      help="symvers file to extract ksymtab information (e.g. Module.symvers)",
+      help="[ARCH=]symvers file to extract ksymtab information (e.g. "
+      "Module.symvers). Can be passed multiple times",
   )
 
   parser.add_argument(
@@ -57,28 +137,38 @@ def main():
       help="Kernel binaries to consider for ksymtab verification",
   )
 
-  args = parser.parse_args()
+  parser.add_argument(
+      "--json-report",
+      help="Write the result of every check to this JSON file",
+  )
 
-  # Parse Module.symvers, and ignore non-exported and vendor-specific symbols
-  ksymtab_symbols = []
-  with open(args.symvers_file) as symvers_file:
-    for line in symvers_file:
-      _, symbol, object, export_type = line.strip().split("\t", maxsplit=3)
-      if export_type.startswith("EXPORT_SYMBOL") and object in args.objects:
-        ksymtab_symbols.append(symbol)
+  args = parser.parse_args(argv)
 
-  # List of symbols defined in the raw_kmi_symbol_list
-  kmi_symbols = symbol_extraction.read_symbol_list(args.raw_kmi_symbol_list)
+  symvers_files = [split_architecture(argument)
+                   for argument in args.symvers_file]
+  symbol_lists = [split_architecture(argument)
+                  for argument in args.raw_kmi_symbol_list]
+  try:
+    results = verify(symvers_files, symbol_lists, args.objects)
+  except ValueError as e:
+    parser.error(str(e))
 
-  # Set difference to get elements in symbol list but not in ksymtab
-  missing_ksymtab_symbols = set(kmi_symbols) - set(ksymtab_symbols)
-  if missing_ksymtab_symbols:
-    print("Symbols missing from the ksymtab:", file=sys.stderr)
-    for symbol in sorted(missing_ksymtab_symbols):
-      print(f"  {symbol}", file=sys.stderr)
-    return 1
+  batch = len(results) > 1
+  for result in results:
+    if result["missing"]:
+      if batch:
+        print(f"{result['symbol_list']} ({result['symvers_file']}): ",
+              end="", file=sys.stderr)
+      print("Symbols missing from the ksymtab:", file=sys.stderr)
+      for symbol in result["missing"]:
+        print(f"  {symbol}", file=sys.stderr)
 
-  return 0
+  ok = not any(result["missing"] for result in results)
+  if args.json_report:
+    with open(args.json_report, "w") as f:
+      json.dump({"ok": ok, "results": results}, f, indent=2)
+      f.write("\n")
+  return 0 if ok else 1
 
 
 if __name__ == "__main__":
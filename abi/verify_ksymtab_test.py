@@ -0,0 +1,122 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+import module_symvers
+import verify_ksymtab
+
+
+class VerifyKsymtabTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.arm64 = self._write(
+        "arm64.symvers",
+        "0x0\tfoo\tvmlinux\tEXPORT_SYMBOL\t\n"
+        "0x0\tbar\tvmlinux\tEXPORT_SYMBOL_GPL\t\n"
+        "0x0\tbaz\tdrivers/baz.ko\tEXPORT_SYMBOL\t\n")
+    self.x86 = self._write(
+        "x86.symvers",
+        "0x0\tfoo\tvmlinux\tEXPORT_SYMBOL\t\n")
+    self.good = self._write("good", "[abi_symbol_list]\n  foo\n")
+    self.bad = self._write("bad", "[abi_symbol_list]\n  foo\n  bar\n  baz\n")
+    self.report = os.path.join(self.tmp, "report.json")
+
+  def _write(self, name, content):
+    path = os.path.join(self.tmp, name)
+    with open(path, "w") as f:
+      f.write(content)
+    return path
+
+  def _report(self):
+    with open(self.report) as f:
+      return json.load(f)
+
+  def test_single(self):
+    self.assertEqual(verify_ksymtab.main([
+        "--raw-kmi-symbol-list", self.good, "--symvers-file", self.arm64]), 0)
+    self.assertEqual(verify_ksymtab.main([
+        "--raw-kmi-symbol-list", self.bad, "--symvers-file", self.arm64]), 1)
+    self.assertEqual(verify_ksymtab.main([
+        "--raw-kmi-symbol-list", self.bad, "--symvers-file", self.arm64,
+        "--objects", "vmlinux", "drivers/baz.ko"]), 0)
+
+  def test_batch(self):
+    with mock.patch.object(module_symvers.ModuleSymvers, "load",
+                           wraps=module_symvers.ModuleSymvers.load) as load:
+      exit_code = verify_ksymtab.main([
+          "--symvers-file", f"aarch64={self.arm64}",
+          "--symvers-file", f"x86_64={self.x86}",
+          "--raw-kmi-symbol-list", self.good,
+          "--raw-kmi-symbol-list", f"aarch64={self.bad}",
+          "--json-report", self.report,
+      ])
+    self.assertEqual(exit_code, 1)
+    self.assertEqual(load.call_count, 2)
+    report = self._report()
+    self.assertFalse(report["ok"])
+    self.assertEqual(
+        [(result["architecture"], result["symbol_list"], result["symbols"],
+          result["missing"]) for result in report["results"]],
+        [("aarch64", self.good, 1, []),
+         ("x86_64", self.good, 1, []),
+         ("aarch64", self.bad, 3, ["baz"])])
+
+  def test_batch_ok(self):
+    self.assertEqual(verify_ksymtab.main([
+        "--symvers-file", self.arm64, "--symvers-file", self.x86,
+        "--raw-kmi-symbol-list", self.good,
+        "--raw-kmi-symbol-list", self.good,
+        "--json-report", self.report,
+    ]), 0)
+    report = self._report()
+    self.assertTrue(report["ok"])
+    self.assertLen(report["results"], 4)
+    self.assertIsNone(report["results"][0]["architecture"])
+
+  def test_split_architecture(self):
+    self.assertEqual(
+        verify_ksymtab.split_architecture(f"aarch64={self.arm64}"),
+        ("aarch64", self.arm64))
+    self.assertEqual(verify_ksymtab.split_architecture(self.arm64),
+                     (None, self.arm64))
+    # Paths containing "=" are not mistaken for an architecture.
+    path = self._write("a=b", "")
+    self.assertEqual(verify_ksymtab.split_architecture(path), (None, path))
+    self.addCleanup(os.chdir, os.getcwd())
+    os.chdir(self.tmp)
+    self.assertEqual(verify_ksymtab.split_architecture("a=b"), (None, "a=b"))
+    self._write("b", "")
+    self.assertEqual(verify_ksymtab.split_architecture("a=b"), (None, "a=b"))
+    os.remove(path)
+    self.assertEqual(verify_ksymtab.split_architecture("a=b"), ("a", "b"))
+
+  def test_unknown_architecture(self):
+    with self.assertRaises(SystemExit):
+      verify_ksymtab.main([
+          "--symvers-file", f"aarch64={self.arm64}",
+          "--raw-kmi-symbol-list", f"riscv64={self.good}",
+      ])
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -12,19 +12,32 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import argparse
-import dataclasses
+# Startup time matters: most invocations end in os.execve(). Modules that are
+# not needed then (e.g. argparse, asyncio, shutil, kleaf_help) are imported
+# where they are used. See BazelWrapperStartupTest in bazel_test.py.
+
+from __future__ import annotations
+
+import time
+
+# When the wrapper started importing modules, for KLEAF_WRAPPER_PROFILE.
+_START_NS = time.monotonic_ns()
+
 import os
 import pathlib
+import pickle
 import re
-import shlex
-import shutil
 import sys
 import textwrap
-from typing import BinaryIO, Generator, Tuple, Optional
+import types
+from collections.abc import Generator
 
-from impl.default_host_tools import DEFAULT_HOST_TOOLS
-from kleaf_help import KleafHelpPrinter, FLAGS_BAZEL_RC
+# Only for type checkers; typing is slow to import.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import BinaryIO
+
+_IMPORTS_END_NS = time.monotonic_ns()
 
 _BAZEL_REL_PATH = "prebuilts/kernel-build-tools/bazel/linux-x86_64/bazel"
 
@@ -67,18 +80,38 @@ _ACTION_EXTRA_HOST_TOOLS = [
     "git",
 ]
 
-@dataclasses.dataclass
+# Bump when the content of the default hermetic PATH directory changes.
+_DEFAULT_HERMETIC_PATH_VERSION = 1
+
+# Bump when the arguments or bazelrc files generated by the wrapper change.
+_ARGS_CACHE_VERSION = 3
+# Number of invocations (e.g. build and test of different targets) whose
+# arguments are kept in the arguments cache.
+_ARGS_CACHE_SIZE = 16
+# Attributes of BazelWrapper restored from the arguments cache.
+_ARGS_CACHE_ATTRIBUTES = (
+    "known_startup_options",
+    "user_startup_options",
+    "absolute_out_dir",
+    "absolute_user_root",
+    "transformed_startup_options",
+    "known_args",
+    "transformed_command_args",
+    "gen_bazelrc_dir",
+    "generated_files",
+)
+
 class BazelWrapperException(Exception):
     """A generic Bazel-wrapper error."""
 
-    # error message
-    message: str = ""
+    def __init__(self, message: str = "", code: int = 1):
+        # error message
+        self.message = message
 
-    # exit code of the program.
-    # Default is 1, "Build failed". See https://bazel.build/run/scripts
-    code: int = 1
+        # exit code of the program.
+        # Default is 1, "Build failed". See https://bazel.build/run/scripts
+        self.code = code
 
-    def __post_init__(self):
         super().__init__(self, self.message)
 
 
@@ -126,12 +159,133 @@ class MultipleBazelWrapperException(BazelWrapperException):
 def _require_absolute_path(p: str | pathlib.Path) -> pathlib.Path:
     p = pathlib.Path(p)
     if not p.is_absolute():
+        import argparse
         raise argparse.ArgumentTypeError("need to specify an absolute path")
     return p
 
 
-def _partition(lst: list[str], index: Optional[int]) \
-        -> Tuple[list[str], Optional[str], list[str]]:
+class _ProfilePhase:
+    """Records a phase of the wrapper in a _Profile, as a context manager."""
+
+    def __init__(self, profile: "_Profile", name: str):
+        self._profile = profile
+        self._name = name
+        self._start_ns = 0
+        self.args = {}
+
+    def __enter__(self) -> "_ProfilePhase":
+        self._start_ns = time.monotonic_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._profile.add(self._name, self._start_ns, time.monotonic_ns(),
+                          self.args)
+
+
+class _Profile:
+    """Records the time spent in the phases of the wrapper.
+
+    If KLEAF_WRAPPER_PROFILE is set, the phases are written to the file it
+    names as Chrome trace events, e.g. to be loaded in https://ui.perfetto.dev
+    together with the output of Bazel's --profile. Timestamps are microseconds
+    since the epoch, so events of several profiles can be aligned.
+    """
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self._events = []
+        # To convert monotonic timestamps to timestamps since the epoch.
+        self._epoch_offset_ns = time.time_ns() - time.monotonic_ns()
+
+    def phase(self, name: str) -> _ProfilePhase:
+        """Returns a context manager recording the phase name."""
+        return _ProfilePhase(self, name)
+
+    def _timestamp(self, monotonic_ns: int) -> float:
+        return (monotonic_ns + self._epoch_offset_ns) / 1000
+
+    def add(self, name: str, start_ns: int, end_ns: int,
+            args: dict | None = None):
+        """Records the phase name, between two time.monotonic_ns() values."""
+        if self.path is None:
+            return
+        self._events.append({
+            "name": name,
+            "cat": "kleaf_wrapper",
+            "ph": "X",
+            "ts": self._timestamp(start_ns),
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": os.getpid(),
+            "tid": 0,
+            "args": args or {},
+        })
+
+    def add_instant(self, name: str, args: dict | None = None):
+        """Records the event name, which happens now."""
+        if self.path is None:
+            return
+        self._events.append({
+            "name": name,
+            "cat": "kleaf_wrapper",
+            "ph": "i",
+            "s": "p",
+            "ts": self._timestamp(time.monotonic_ns()),
+            "pid": os.getpid(),
+            "tid": 0,
+            "args": args or {},
+        })
+
+    def write(self):
+        """Writes the recorded events, if KLEAF_WRAPPER_PROFILE is set."""
+        if self.path is None:
+            return
+        metadata = [
+            {"name": "process_name", "ph": "M", "pid": os.getpid(), "tid": 0,
+             "args": {"name": "Kleaf Bazel wrapper"}},
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": 0,
+             "args": {"name": "main"}},
+        ]
+        import json
+        path = pathlib.Path(self.path)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}")
+        try:
+            tmp.write_text(json.dumps({
+                "traceEvents": metadata + self._events,
+                "displayTimeUnit": "ms",
+            }))
+            os.replace(tmp, path)
+        except OSError as e:
+            sys.stderr.write(
+                f"WARNING: Unable to write KLEAF_WRAPPER_PROFILE={self.path}: {e}\n")
+
+
+def _write_if_changed(path: pathlib.Path, content: str) -> None:
+    """Writes content to path, unless path already has this content.
+
+    This keeps the mtime of generated bazelrc files that did not change.
+    """
+    try:
+        if path.read_text() == content:
+            return
+    except (OSError, UnicodeDecodeError):
+        pass
+    path.write_text(content)
+
+
+def _stat_key(path: str | pathlib.Path) -> list[int] | None:
+    """Returns the inode and mtime of path, or None if it does not exist.
+
+    This is a list, not a tuple, so it compares equal after a JSON round trip.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_ino, stat.st_mtime_ns]
+
+
+def _partition(lst: list[str], index: int | None) \
+        -> tuple[list[str], str | None, list[str]]:
     """Returns the triple split by index.
 
     That is, return a tuple:
@@ -144,7 +298,7 @@ def _partition(lst: list[str], index: Optional[int]) \
     return lst[:index], lst[index], lst[index + 1:]
 
 
-class BazelWrapper(KleafHelpPrinter):
+class BazelWrapper:
     def __init__(self, kleaf_repo_dir: pathlib.Path, bazel_args: list[str], env):
         """Splits arguments to the bazel binary based on the functionality.
 
@@ -159,13 +313,16 @@ class BazelWrapper(KleafHelpPrinter):
             env: existing environment
         """
 
+        self.profile = _Profile(env.get("KLEAF_WRAPPER_PROFILE"))
+
         # Path to repository that contains Kleaf tooling.
         self.kleaf_repo_dir = kleaf_repo_dir
         self.env = env.copy()
 
         self.bazel_path = self.kleaf_repo_dir / _BAZEL_REL_PATH
 
-        self.workspace_dir = self._get_workspace_dir()
+        with self.profile.phase("find_workspace"):
+            self.workspace_dir = self._get_workspace_dir()
 
         command_idx = None
         for idx, arg in enumerate(bazel_args):
@@ -188,11 +345,26 @@ class BazelWrapper(KleafHelpPrinter):
         self.command_args, self.dash_dash, self.target_patterns = _partition(remaining_args,
                                                                              dash_dash_idx)
 
-        self._parse_startup_options()
-        self._parse_command_args()
-        self._add_extra_startup_options()
-        self._rebuild_kleaf_help_args()
-        self._add_default_hermetic_path()
+        # Whether the parsed arguments may be stored in the arguments cache.
+        # Invocations that print something while parsing are not cached.
+        self._cacheable = self.command != "help"
+        # Content of the bazelrc files generated for the arguments, by path.
+        self.generated_files: dict[str, str] = {}
+        with self.profile.phase("load_args_cache") as phase:
+            args_cache_key = self._args_cache_key(bazel_args, env)
+            phase.args["hit"] = self._load_args_cache(args_cache_key, env)
+        if not phase.args["hit"]:
+            with self.profile.phase("parse_startup_options"):
+                self._parse_startup_options()
+            with self.profile.phase("parse_command_args"):
+                self._parse_command_args()
+            with self.profile.phase("bazelrc"):
+                self._add_extra_startup_options()
+            self._rebuild_kleaf_help_args()
+            with self.profile.phase("save_args_cache"):
+                self._save_args_cache(args_cache_key, env)
+        with self.profile.phase("hermetic_path"):
+            self._add_default_hermetic_path()
 
     @classmethod
     def _get_workspace_dir(cls):
@@ -225,6 +397,117 @@ class BazelWrapper(KleafHelpPrinter):
         return False
 
 
+    def _args_cache_path(self) -> pathlib.Path | None:
+        """Returns the arguments cache file, in the generated bazelrc directory.
+
+        It goes away with the generated bazelrc files on `bazel clean`.
+        """
+        output_root = self.workspace_dir / "out"
+        for idx, option in enumerate(self.startup_options):
+            if option.startswith("--output_root="):
+                output_root = pathlib.Path(option.partition("=")[2])
+            elif option == "--output_root" and idx + 1 < len(self.startup_options):
+                output_root = pathlib.Path(self.startup_options[idx + 1])
+        if not output_root.is_absolute():
+            # Let _parse_startup_options report the error.
+            return None
+        return output_root / "bazel/bazelrc/wrapper_args_cache.pickle"
+
+    def _args_cache_key(self, bazel_args: list[str], env) -> str:
+        """Returns a key describing everything the parsed arguments depend on.
+
+        That is the arguments, the KLEAF_* environment variables (but
+        KLEAF_WRAPPER_PROFILE), whether outputs are terminals (for --color)
+        and the size and mtime of the bazelrc files in the Kleaf repository.
+        """
+        bazelrc_files = []
+        for bazelrc_dir in (self.kleaf_repo_dir / "build/kernel/kleaf",
+                            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc"):
+            try:
+                with os.scandir(bazelrc_dir) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(".bazelrc"):
+                            stat = entry.stat()
+                            bazelrc_files.append(
+                                (entry.path, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                pass
+        key = (
+            _ARGS_CACHE_VERSION,
+            str(self.kleaf_repo_dir),
+            str(self.workspace_dir),
+            bazel_args,
+            sorted((name, value) for name, value in env.items()
+                   if name.startswith("KLEAF_") and
+                   name != "KLEAF_WRAPPER_PROFILE"),
+            sys.stdout.isatty(),
+            sys.stderr.isatty(),
+            sorted(bazelrc_files),
+        )
+        return repr(key)
+
+    def _load_args_cache(self, key: str, env) -> bool:
+        """Restores the parsed arguments from the arguments cache.
+
+        Returns:
+            Whether they are restored. If not, the arguments must be parsed.
+        """
+        path = self._args_cache_path()
+        if path is None:
+            return False
+        try:
+            with open(path, "rb") as file:
+                attributes, env_changes = pickle.load(file)[key]
+        except (OSError, EOFError, KeyError, TypeError, ValueError,
+                AttributeError, pickle.UnpicklingError):
+            return False
+
+        # The generated bazelrc files are shared by all entries, and may have
+        # been written for other arguments or deleted since.
+        try:
+            for file, content in attributes["generated_files"].items():
+                self._write_generated_file(pathlib.Path(file), content)
+        except OSError:
+            return False
+
+        for name, value in attributes.items():
+            setattr(self, name, value)
+        self.env.update(env_changes)
+        return True
+
+    def _save_args_cache(self, key: str, env) -> None:
+        """Stores the parsed arguments in the arguments cache."""
+        path = self._args_cache_path()
+        if not self._cacheable or path is None:
+            return
+        attributes = {name: getattr(self, name)
+                      for name in _ARGS_CACHE_ATTRIBUTES}
+        # Unpickling an argparse.Namespace would import argparse.
+        for name in ("known_startup_options", "known_args"):
+            attributes[name] = types.SimpleNamespace(**vars(attributes[name]))
+        env_changes = {name: value for name, value in self.env.items()
+                       if env.get(name) != value}
+        try:
+            with open(path, "rb") as file:
+                entries = pickle.load(file)
+        except (OSError, EOFError, TypeError, ValueError, AttributeError,
+                pickle.UnpicklingError):
+            entries = {}
+        if not isinstance(entries, dict):
+            entries = {}
+        # Most recently used last.
+        entries.pop(key, None)
+        entries[key] = (attributes, env_changes)
+        while len(entries) > _ARGS_CACHE_SIZE:
+            del entries[next(iter(entries))]
+        try:
+            tmp = path.with_name(f".{path.name}.{os.getpid()}")
+            with open(tmp, "wb") as file:
+                pickle.dump(entries, file)
+            os.replace(tmp, path)
+        except OSError:
+            pass  # Just don't cache.
+
     def add_startup_option_to_parser(self, parser):
         group = parser.add_argument_group(
             title="Startup options - Wrapper flags",
@@ -265,6 +548,7 @@ class BazelWrapper(KleafHelpPrinter):
           existing startup_options to be fed to the Bazel binary
         """
 
+        import argparse
         parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
         self.add_startup_option_to_parser(parser)
 
@@ -276,6 +560,7 @@ class BazelWrapper(KleafHelpPrinter):
             self.absolute_out_dir / "bazel/output_user_root"
 
         if self.known_startup_options.help:
+            self._cacheable = False
             self.transformed_startup_options = [
                 "--help"
             ]
@@ -412,6 +697,7 @@ class BazelWrapper(KleafHelpPrinter):
         match len(tokens):
             case 0: return (None, None)
             case 1:
+                self._cacheable = False
                 sys.stderr.write(textwrap.dedent(f"""\
                     WARNING: --repo_manifest=<path> is deprecated. Use
                         --repo_manifest={self.workspace_dir}:{value}
@@ -422,6 +708,7 @@ class BazelWrapper(KleafHelpPrinter):
                 repo_root, repo_manifest = tokens
                 return (_require_absolute_path(repo_root),
                         _require_absolute_path(repo_manifest))
+        import argparse
         raise argparse.ArgumentTypeError(
             "Must be <REPO_MANIFEST> or <REPO_ROOT>:<REPO_MANIFEST>"
         )
@@ -432,6 +719,7 @@ class BazelWrapper(KleafHelpPrinter):
             return path
         if path.is_relative_to(self.kleaf_repo_dir):
             return path.relative_to(self.kleaf_repo_dir)
+        import argparse
         raise argparse.ArgumentTypeError(
             f"Must be a relative path against {self.kleaf_repo_dir}",
         )
@@ -446,6 +734,7 @@ class BazelWrapper(KleafHelpPrinter):
         - env: A dictionary containing the new environment variables for the subprocess.
         """
 
+        import argparse
         parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
         self.add_command_args_to_parser(parser)
 
@@ -457,6 +746,7 @@ class BazelWrapper(KleafHelpPrinter):
             self.command_args)
 
         if self.known_args.experimental_strip_sandbox_path:
+            self._cacheable = False
             sys.stderr.write(
                 "WARNING: --experimental_strip_sandbox_path is deprecated; use "
                 "--strip_execroot.\n"
@@ -513,6 +803,8 @@ class BazelWrapper(KleafHelpPrinter):
         if self.known_startup_options.help:
             return
 
+        import shlex
+
         self.gen_bazelrc_dir = self.absolute_out_dir / "bazel/bazelrc"
         os.makedirs(self.gen_bazelrc_dir, exist_ok=True)
 
@@ -531,12 +823,12 @@ class BazelWrapper(KleafHelpPrinter):
             self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/stamp.bazelrc",
         ])
         stamp_extra_bazelrc = self.gen_bazelrc_dir / "stamp_extra.bazelrc"
-        with open(stamp_extra_bazelrc, "w") as f:
+        with self.profile.phase("stamp_bazelrc"):
             workspace_status_common_sh = self._kleaf_repo_rel() / \
                 "build/kernel/kleaf/workspace_status_common.sh"
             workspace_status_sh = self._kleaf_repo_rel() / \
                 "build/kernel/kleaf/workspace_status.sh"
-            f.write(textwrap.dedent(f"""\
+            self._write_generated_file(stamp_extra_bazelrc, textwrap.dedent(f"""\
                 # By default, do not embed scmversion.
                 build --workspace_status_command={shlex.quote(str(workspace_status_common_sh))}
                 # With --config=stamp, embed scmversion.
@@ -548,15 +840,15 @@ class BazelWrapper(KleafHelpPrinter):
 
         self.transformed_startup_options += self._transform_bazelrc_files([
             self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/release.bazelrc",
-            self.kleaf_repo_dir / FLAGS_BAZEL_RC,
+            # Sync with FLAGS_BAZEL_RC in kleaf_help.py
+            self.kleaf_repo_dir / "build/kernel/kleaf/bazelrc/flags.bazelrc",
         ])
 
         cache_dir_bazelrc = self.gen_bazelrc_dir / "cache_dir.bazelrc"
-        with open(cache_dir_bazelrc, "w") as f:
-            # The label //build/... will be re-written by _transform_bazelrc_files.
-            f.write(textwrap.dedent(f"""\
-                build --//build/kernel/kleaf:cache_dir={shlex.quote(str(self.known_args.cache_dir))}
-            """))
+        # The label //build/... will be re-written by _transform_bazelrc_files.
+        self._write_generated_file(cache_dir_bazelrc, textwrap.dedent(f"""\
+            build --//build/kernel/kleaf:cache_dir={shlex.quote(str(self.known_args.cache_dir))}
+        """))
 
         self.transformed_startup_options += self._transform_bazelrc_files([
             cache_dir_bazelrc,
@@ -565,7 +857,7 @@ class BazelWrapper(KleafHelpPrinter):
         if self.known_args.hermetic_actions:
             hermetic_actions_bazelrc = (
                 self.gen_bazelrc_dir / "hermetic_actions.bazelrc")
-            hermetic_actions_bazelrc.write_text(textwrap.dedent("""\
+            self._write_generated_file(hermetic_actions_bazelrc, textwrap.dedent("""\
                 build --action_env=PATH
             """))
             self.transformed_startup_options += self._transform_bazelrc_files([
@@ -604,6 +896,7 @@ class BazelWrapper(KleafHelpPrinter):
         final_args += self.target_patterns
 
         if self.command == "clean":
+            import shutil
             sys.stderr.write(
                 f"INFO: Removing cache directory for $OUT_DIR: {self.known_args.cache_dir}\n")
             shutil.rmtree(self.known_args.cache_dir, ignore_errors=True)
@@ -633,11 +926,15 @@ class BazelWrapper(KleafHelpPrinter):
             "//build", f"{self._kleaf_repo_name()}//build")
 
         new_path = self.gen_bazelrc_dir / old_path.name
-        os.makedirs(new_path.parent, exist_ok=True)
-        with open(new_path, "w") as new_file:
-            new_file.write(content)
+        self._write_generated_file(new_path, content)
         return new_path
 
+    def _write_generated_file(self, path: pathlib.Path, content: str) -> None:
+        """Writes a generated bazelrc file, and remembers it for the cache."""
+        os.makedirs(path.parent, exist_ok=True)
+        _write_if_changed(path, content)
+        self.generated_files[str(path)] = content
+
     def _kleaf_repository_is_top_workspace(self):
         """Returns true if the Kleaf repository is the top-level workspace @."""
         return self.workspace_dir == self.kleaf_repo_dir
@@ -671,7 +968,10 @@ class BazelWrapper(KleafHelpPrinter):
 
         if show_kleaf_help_menu:
             print("Kleaf help menu:")
-            self.print_kleaf_help(self.kleaf_repo_dir)
+            # Imported here because it is slow to import.
+            from kleaf_help import KleafHelpPrinter
+            # BazelWrapper provides the methods KleafHelpPrinter needs.
+            KleafHelpPrinter.print_kleaf_help(self, self.kleaf_repo_dir)
         else:
             print("Kleaf help menu:")
             print("  $ bazel help kleaf")
@@ -723,16 +1023,74 @@ class BazelWrapper(KleafHelpPrinter):
             self.absolute_out_dir / "bazel/default_hermetic_path")
         if not self.known_args.hermetic_actions:
             return
+
+        host_path = os.environ.get("PATH") or os.defpath
+        # The directories on PATH change mtime when tools are added to or
+        # removed from them, so they are part of the key with PATH.
+        key = [
+            _DEFAULT_HERMETIC_PATH_VERSION,
+            str(self.kleaf_repo_dir),
+            [[directory, _stat_key(directory)]
+             for directory in host_path.split(os.pathsep)],
+        ]
+        if not self._default_hermetic_path_is_current(key):
+            self._make_default_hermetic_path(key)
+
+        # TODO(b/228105413): Drop provided $PATH after allow list is settled.
+        self.env["PATH"] = str(self.gen_default_hermetic_path_dir)
+
+    def _default_hermetic_path_stamp(self) -> pathlib.Path:
+        """Returns the file describing the default hermetic PATH directory.
+
+        It is next to the directory, so it is not on PATH itself.
+        """
+        return self.gen_default_hermetic_path_dir.with_name(
+            self.gen_default_hermetic_path_dir.name + ".json")
+
+    def _default_hermetic_path_is_current(self, key: list) -> bool:
+        """Returns whether the default hermetic PATH directory is up to date.
+
+        That is, it was made for key, it has the expected tools, and the
+        binaries they point to did not change.
+        """
+        import json
+        try:
+            stamp = json.loads(self._default_hermetic_path_stamp().read_text())
+            with os.scandir(self.gen_default_hermetic_path_dir) as entries:
+                tools = set()
+                for entry in entries:
+                    # A link whose target is gone needs to be made again.
+                    if entry.is_symlink() and not os.path.exists(entry.path):
+                        return False
+                    tools.add(entry.name)
+        except (OSError, ValueError):
+            return False
+        if (not isinstance(stamp, dict) or stamp.get("key") != key or
+                sorted(tools) != stamp.get("tools")):
+            return False
+        return all(_stat_key(target) == target_key
+                   for target, target_key in stamp.get("targets", []))
+
+    def _make_default_hermetic_path(self, key: list):
+        """Makes the default hermetic PATH directory and its stamp for key."""
+        import json
+        import shutil
+        from impl.default_host_tools import DEFAULT_HOST_TOOLS
+
         self.gen_default_hermetic_path_dir.mkdir(parents=True, exist_ok=True)
+        # Remove the stamp first, in case we get interrupted.
+        self._default_hermetic_path_stamp().unlink(missing_ok=True)
 
         host_tools = DEFAULT_HOST_TOOLS + _ACTION_EXTRA_HOST_TOOLS
         all_tools = set()
+        targets = []
         for tool in host_tools:
             dst_path = self.gen_default_hermetic_path_dir / tool
             all_tools.add(dst_path)
             src_path = shutil.which(tool)
             if src_path:
                 src_path = pathlib.Path(src_path).resolve()
+                targets.append(src_path)
                 if dst_path.is_symlink() and dst_path.resolve() == src_path:
                     continue
             # Delete broken symlinks or symlinks that is not correct
@@ -756,6 +1114,9 @@ class BazelWrapper(KleafHelpPrinter):
             all_tools.add(dst_path)
             if dst_path.exists():
                 continue
+            # Delete broken symlinks
+            if dst_path.is_symlink():
+                dst_path.unlink()
             src_path = self.kleaf_repo_dir / tool
             dst_path.symlink_to(src_path)
 
@@ -763,20 +1124,33 @@ class BazelWrapper(KleafHelpPrinter):
             if file not in all_tools:
                 file.unlink()
 
-        # TODO(b/228105413): Drop provided $PATH after allow list is settled.
-        self.env["PATH"] = str(self.gen_default_hermetic_path_dir)
+        stamp = {
+            "key": key,
+            "tools": sorted(path.name for path in all_tools),
+            "targets": [[str(target), _stat_key(target)] for target in targets],
+        }
+        tmp = self._default_hermetic_path_stamp().with_suffix(
+            f".{os.getpid()}.tmp")
+        try:
+            tmp.write_text(json.dumps(stamp))
+            os.replace(tmp, self._default_hermetic_path_stamp())
+        except OSError:
+            pass  # Just rebuild the directory next time.
 
     def run(self) -> int:
         """Runs the wrapper.
 
         Returns:
             exit code"""
-        final_args = self._build_final_args()
+        with self.profile.phase("final_args"):
+            final_args = self._build_final_args()
 
         if self.known_startup_options.help or self.command == "help":
             self._print_help()
 
         if not self._should_run_as_subprocess():
+            self.profile.add_instant("execve", {"command": self.command})
+            self.profile.write()
             os.execve(path=self.bazel_path, argv=final_args, env=self.env)
             assert False, "os.execve should not return"
 
@@ -788,16 +1162,20 @@ class BazelWrapper(KleafHelpPrinter):
 
         import asyncio
         try:
-            asyncio.run(run(
-                command=final_args,
-                env=self.env,
-                output_mutator=output_mutator,
-                epilog_coroutine=self._get_epilog_coroutine(),
-            ))
+            with self.profile.phase("bazel") as phase:
+                phase.args["command"] = self.command
+                asyncio.run(run(
+                    command=final_args,
+                    env=self.env,
+                    output_mutator=output_mutator,
+                    epilog_coroutine=self._get_epilog_coroutine(),
+                ))
         except BazelWrapperException as exception:
             if exception.message:
                 print(exception.message, file=sys.stderr)
             return exception.code
+        finally:
+            self.profile.write()
 
         return 0
 
@@ -811,16 +1189,17 @@ class BazelWrapper(KleafHelpPrinter):
                 is not None),
         ])
 
-    def _get_output_filter_regex(self):
+    def _get_output_filter_regex(self) -> re.Pattern[bytes] | None:
         """Returns regex to filter output / stderr lines"""
         if not self.known_args.strip_execroot:
             return None
         if self.absolute_user_root.is_relative_to(self.absolute_out_dir):
-            prefix = str(self.absolute_out_dir)
+            prefix = self.absolute_out_dir
         else:
-            prefix = str(self.absolute_user_root)
+            prefix = self.absolute_user_root
 
-        return re.compile(prefix + r"/\S+?/execroot/__main__/")
+        return re.compile(re.escape(os.fsencode(prefix)) +
+                          rb"/\S+?/execroot/__main__/")
 
     def _get_epilog_coroutine(self):
         """Returns epilog coroutine after bazel command finishes"""
@@ -829,16 +1208,25 @@ class BazelWrapper(KleafHelpPrinter):
         return self.remove_gen_dirs()
 
     async def remove_gen_dirs(self):
+        import shutil
         sys.stderr.write("INFO: Deleting generated directories.\n")
         shutil.rmtree(self.gen_bazelrc_dir, ignore_errors=True)
         shutil.rmtree(self.gen_default_hermetic_path_dir, ignore_errors=True)
+        self._default_hermetic_path_stamp().unlink(missing_ok=True)
 
 
 class OutputMutator:
-    """Helper class to filter and mutate an output stream."""
+    """Helper class to filter and mutate an output stream.
+
+    The stream is handled as bytes, in chunks of whole lines.
+    """
+
+    # Maximum number of bytes read from the stream at once.
+    _CHUNK_SIZE = 256 * 1024
+
     def __init__(
             self,
-            filter_regex: re.Pattern | None,
+            filter_regex: re.Pattern[bytes] | None,
             regex_allowlist_path: pathlib.Path | None,
         ):
         self._regex_allowlist_path = regex_allowlist_path
@@ -847,10 +1235,11 @@ class OutputMutator:
 
         if regex_allowlist_path:
             with open(regex_allowlist_path, encoding="utf-8") as file:
-                self._regex_allowlist = list(self._parse_regex_lines(file))
+                self._regex_allowlist = _combine_regexes(
+                    list(self._parse_regex_lines(file)))
 
     def _parse_regex_lines(self, lines) -> \
-            Generator[re.Pattern, None, None]:
+            Generator[re.Pattern[str], None, None]:
         """Parses lines from stdout_stderr_regex_allowlist file."""
         for line in lines:
             line = line.strip()
@@ -860,6 +1249,34 @@ class OutputMutator:
                 continue
             yield re.compile(line)
 
+    def _find_unexpected_lines(self, data: bytes) \
+            -> tuple[int, str | None]:
+        """Checks lines against the allowlist.
+
+        The lines are decoded first, so that the regexes keep their str
+        semantics, e.g. for \\w, \\s and non-ASCII characters. Decoding a
+        whole chunk at once costs little compared to matching.
+
+        Args:
+            data: whole lines, or the end of the stream.
+
+        Returns:
+            The number of lines not matching any regex in the allowlist, and
+            the first of them.
+        """
+        text = data.decode(errors="replace")
+        lines = text.split("\n")
+        if text.endswith("\n"):
+            lines.pop()
+        unexpected_line_count = 0
+        first_unexpected_line = None
+        for line in lines:
+            if not any(regex.match(line) for regex in self._regex_allowlist):
+                unexpected_line_count += 1
+                if first_unexpected_line is None:
+                    first_unexpected_line = line
+        return unexpected_line_count, first_unexpected_line
+
     async def mutate_stream(
         self,
         input_stream: BinaryIO,
@@ -875,23 +1292,41 @@ class OutputMutator:
         """
         unexpected_line_count = 0
         first_unexpected_line = None
+        mutate = self._filter_regex or self._regex_allowlist
+        # The incomplete line at the end of what has been read so far.
+        pending = bytearray()
+
+        while True:
+            chunk = await input_stream.read(self._CHUNK_SIZE)
+            if not mutate:
+                if not chunk:
+                    break
+                output_stream.buffer.write(chunk)
+                output_stream.flush()
+                continue
 
-        while not input_stream.at_eof():
-            output = await input_stream.readline()
-            if self._filter_regex or self._regex_allowlist:
-                output_decoded = output.decode()
-                if self._filter_regex:
-                    output_decoded = re.sub(
-                        self._filter_regex, "", output_decoded)
-                if self._regex_allowlist:
-                    if not any(regex.match(output_decoded)
-                               for regex in self._regex_allowlist):
-                        unexpected_line_count += 1
-                        if first_unexpected_line is None:
-                            first_unexpected_line = output_decoded
-                output = output_decoded.encode()
+            if chunk:
+                end = chunk.rfind(b"\n") + 1
+                if not end:
+                    pending += chunk
+                    continue
+                output = bytes(pending) + chunk[:end]
+                pending[:] = chunk[end:]
+            else:
+                output = bytes(pending)
+                pending.clear()
+
+            if self._filter_regex:
+                output = self._filter_regex.sub(b"", output)
+            if self._regex_allowlist and output:
+                count, first = self._find_unexpected_lines(output)
+                unexpected_line_count += count
+                if first_unexpected_line is None:
+                    first_unexpected_line = first
             output_stream.buffer.write(output)
             output_stream.flush()
+            if not chunk:
+                break
 
         if unexpected_line_count:
             raise UnexpectedOutputLinesException(textwrap.dedent(f"""\
@@ -903,6 +1338,32 @@ allowlist:
                     {self._regex_allowlist_path}"""))
 
 
+def _combine_regexes(regexes: list[re.Pattern[str]]) \
+        -> list[re.Pattern[str]]:
+    """Combines regexes, as alternatives, into as few regexes as possible.
+
+    A line matches one of the returned regexes iff it matches one of
+    regexes, but it is usually matched once, not once per regex. Regexes
+    with backreferences are kept apart, because combining renumbers their
+    groups, and so are all of them if the combination does not compile
+    (e.g. because of inline flags).
+    """
+    combinable = []
+    separate = []
+    for regex in regexes:
+        if regex.groups and re.search(r"\\[1-9]|\(\?P=", regex.pattern):
+            separate.append(regex)
+        else:
+            combinable.append(regex)
+    if len(combinable) > 1:
+        try:
+            combinable = [re.compile("|".join(
+                "(?:" + regex.pattern + ")" for regex in combinable))]
+        except re.error:
+            pass
+    return combinable + separate
+
+
 async def _wait_for_subprocess(process):
     """Wraps process.wait() and raises if exit code is non-zero."""
     return_code = await process.wait()
@@ -961,9 +1422,11 @@ def _bazel_wrapper_main():
     # <kleaf_repo_dir>/build/kernel/kleaf/bazel.py
     kleaf_repo_dir = (
         pathlib.Path(__file__).resolve().parent.parent.parent.parent)
-    return BazelWrapper(kleaf_repo_dir=kleaf_repo_dir,
-                        bazel_args=sys.argv[1:],
-                        env=os.environ).run()
+    wrapper = BazelWrapper(kleaf_repo_dir=kleaf_repo_dir,
+                           bazel_args=sys.argv[1:],
+                           env=os.environ)
+    wrapper.profile.add("imports", _START_NS, _IMPORTS_END_NS)
+    return wrapper.run()
 
 if __name__ == "__main__":
     sys.exit(_bazel_wrapper_main())
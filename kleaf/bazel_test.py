@@ -0,0 +1,396 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import io
+import json
+import os
+import pathlib
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from absl.testing import absltest
+import bazel
+from bazel import BazelWrapper, OutputMutator, UnexpectedOutputLinesException
+
+_BAZELRC_FILES = (
+    "android_ci.bazelrc",
+    "ants.bazelrc",
+    "bzlmod.bazelrc",
+    "canary.bazelrc",
+    "fast.bazelrc",
+    "flags.bazelrc",
+    "hermetic_cc.bazelrc",
+    "local.bazelrc",
+    "musl.bazelrc",
+    "musl_platform.bazelrc",
+    "network.bazelrc",
+    "platforms.bazelrc",
+    "rbe.bazelrc",
+    "release.bazelrc",
+    "silent.bazelrc",
+    "stamp.bazelrc",
+)
+
+
+class _WorkspaceTestCase(unittest.TestCase):
+    """Runs tests in a workspace that is also the Kleaf repository."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = pathlib.Path(tmp.name).resolve()
+        (self.root / "MODULE.bazel").touch()
+        self.bazelrc_dir = self.root / "build/kernel/kleaf/bazelrc"
+        self.bazelrc_dir.mkdir(parents=True)
+        for name in _BAZELRC_FILES:
+            (self.bazelrc_dir / name).touch()
+        (self.bazelrc_dir / "local.bazelrc").write_text("build:local --foo\n")
+        (self.root / "build/kernel/kleaf/common.bazelrc").touch()
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.root)
+
+
+class BazelWrapperTest(_WorkspaceTestCase):
+    def _wrapper(self, *args, env=None):
+        return BazelWrapper(kleaf_repo_dir=self.root,
+                            bazel_args=list(args),
+                            env=env or {"KLEAF_TEST": "1"})
+
+    def _wrapper_parses(self, *args, env=None):
+        """Returns whether creating a wrapper parses the arguments."""
+        with mock.patch.object(BazelWrapper, "_parse_command_args",
+                               autospec=True,
+                               side_effect=BazelWrapper._parse_command_args
+                               ) as parse:
+            self._wrapper(*args, env=env)
+        return parse.called
+
+    def test_hit(self):
+        first = self._wrapper("build", "--make_jobs=3", "//foo")
+        with mock.patch.object(BazelWrapper, "_handle_bazelrc") as handle:
+            second = self._wrapper("build", "--make_jobs=3", "//foo")
+        handle.assert_not_called()
+        self.assertEqual(first._build_final_args(), second._build_final_args())
+        self.assertEqual(first.env, second.env)
+        self.assertEqual(second.env["KLEAF_MAKE_JOBS"], "3")
+
+    def test_miss(self):
+        self.assertTrue(self._wrapper_parses("build", "//foo"))
+        self.assertFalse(self._wrapper_parses("build", "//foo"))
+        self.assertTrue(self._wrapper_parses("build", "//bar"))
+        self.assertTrue(self._wrapper_parses(
+            "build", "//foo", env={"KLEAF_TEST": "2"}))
+        # Not KLEAF_*, not part of the key.
+        self.assertFalse(self._wrapper_parses(
+            "build", "//foo", env={"KLEAF_TEST": "1", "OTHER": "1"}))
+
+    def test_bazelrc_changed(self):
+        self._wrapper("build", "//foo")
+        (self.bazelrc_dir / "local.bazelrc").write_text("build:local --bar\n")
+        self.assertTrue(self._wrapper_parses("build", "//foo"))
+
+    def test_generated_bazelrc_deleted(self):
+        wrapper = self._wrapper("build", "//foo")
+        cache_dir_bazelrc = wrapper.gen_bazelrc_dir / "cache_dir.bazelrc"
+        content = cache_dir_bazelrc.read_text()
+        cache_dir_bazelrc.unlink()
+        self.assertFalse(self._wrapper_parses("build", "//foo"))
+        self.assertEqual(cache_dir_bazelrc.read_text(), content)
+
+    def test_generated_bazelrc_shared(self):
+        # All entries share the same generated files.
+        cache_dir_bazelrc = self.root / "out/bazel/bazelrc/cache_dir.bazelrc"
+        self._wrapper("build", "--cache_dir=/a", "//foo")
+        self._wrapper("build", "--cache_dir=/b", "//foo")
+        self.assertIn("=/b", cache_dir_bazelrc.read_text())
+        self.assertFalse(
+            self._wrapper_parses("build", "--cache_dir=/a", "//foo"))
+        self.assertIn("=/a", cache_dir_bazelrc.read_text())
+
+    def test_warnings_not_cached(self):
+        self._wrapper("build", "--experimental_strip_sandbox_path", "//foo")
+        self.assertTrue(self._wrapper_parses(
+            "build", "--experimental_strip_sandbox_path", "//foo"))
+
+    def test_unchanged_files_not_rewritten(self):
+        wrapper = self._wrapper("build", "//foo")
+        stamp_extra = wrapper.gen_bazelrc_dir / "stamp_extra.bazelrc"
+        os.utime(stamp_extra, ns=(0, 0))
+        self._wrapper("build", "//bar")
+        self.assertEqual(stamp_extra.stat().st_mtime_ns, 0)
+
+    def _profile(self, *args) -> list[dict]:
+        """Runs a wrapper with KLEAF_WRAPPER_PROFILE, and returns the events."""
+        profile = self.root / "profile.json"
+        wrapper = self._wrapper(
+            *args, env={"KLEAF_WRAPPER_PROFILE": str(profile)})
+        with mock.patch.object(os, "execve", side_effect=SystemExit) as execve:
+            with self.assertRaises(SystemExit):
+                wrapper.run()
+        execve.assert_called_once()
+        trace = json.loads(profile.read_text())
+        return [event for event in trace["traceEvents"]
+                if event["ph"] != "M"]
+
+    def test_profile(self):
+        events = self._profile("build", "//foo")
+        self.assertEqual(
+            [event["name"] for event in events],
+            ["find_workspace", "load_args_cache", "parse_startup_options",
+             "parse_command_args", "stamp_bazelrc", "bazelrc",
+             "save_args_cache", "hermetic_path", "final_args", "execve"])
+        self.assertFalse(events[1]["args"]["hit"])
+        for event in events:
+            self.assertEqual(event["cat"], "kleaf_wrapper")
+            self.assertGreater(event["ts"], 0)
+        # Nested in bazelrc.
+        stamp, bazelrc = events[4:6]
+        self.assertLessEqual(bazelrc["ts"], stamp["ts"])
+        self.assertGreaterEqual(bazelrc["ts"] + bazelrc["dur"],
+                                stamp["ts"] + stamp["dur"])
+
+        events = self._profile("build", "//foo")
+        self.assertEqual(
+            [event["name"] for event in events],
+            ["find_workspace", "load_args_cache", "hermetic_path",
+             "final_args", "execve"])
+        self.assertTrue(events[1]["args"]["hit"])
+
+    def test_no_profile(self):
+        wrapper = self._wrapper("build", "//foo")
+        with mock.patch.object(os, "execve", side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                wrapper.run()
+        self.assertFalse((self.root / "profile.json").exists())
+
+
+# Runs the wrapper until os.execve, and prints the modules it imported.
+_FAST_PATH_SCRIPT = """
+import os
+import pathlib
+import sys
+
+before = set(sys.modules)
+import bazel
+
+def execve(path, argv, env):
+    print(" ".join(sorted(set(sys.modules) - before)))
+    sys.exit(0)
+
+os.execve = execve
+bazel.BazelWrapper(kleaf_repo_dir=pathlib.Path.cwd(), bazel_args=sys.argv[1:],
+                   env=os.environ).run()
+"""
+
+# Modules that the wrapper must not import when it ends in os.execve.
+_SLOW_MODULES = (
+    "asyncio",
+    "dataclasses",
+    "hashlib",
+    "json",
+    "kleaf_help",
+    "shutil",
+    "typing",
+)
+
+# Budget for `import bazel`, including the modules it imports, as reported
+# by python -X importtime. Generous, so that slow machines do not fail; the
+# list of modules above is the precise check.
+_IMPORT_BUDGET_US = 150_000
+
+
+class BazelWrapperStartupTest(_WorkspaceTestCase):
+    """Checks what `tools/bazel build` costs before Bazel starts."""
+
+    def _run(self, *args) -> set[str]:
+        """Returns the modules imported by the wrapper until os.execve."""
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            filter(None, [os.path.dirname(os.path.abspath(bazel.__file__)),
+                          env.get("PYTHONPATH")]))
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _FAST_PATH_SCRIPT,
+             *args],
+            env=env, capture_output=True, text=True, check=True)
+        import_time = None
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = line.removeprefix("import time:").split("|")
+            if len(fields) == 3 and fields[2].strip() == "bazel":
+                import_time = int(fields[1])
+        self.assertIsNotNone(import_time, result.stderr)
+        self.assertLessEqual(import_time, _IMPORT_BUDGET_US)
+        return set(result.stdout.split())
+
+    def test_fast_path(self):
+        # Parses the arguments, and fills the arguments cache.
+        modules = self._run("build", "//foo")
+        self.assertIn("argparse", modules)
+        self.assertFalse(modules.intersection(_SLOW_MODULES), sorted(modules))
+
+        # Hits the arguments cache.
+        modules = self._run("build", "//foo")
+        self.assertFalse(modules.intersection(_SLOW_MODULES + ("argparse",)),
+                         sorted(modules))
+
+
+class BazelWrapperDefaultHermeticPathTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = pathlib.Path(tmp.name).resolve()
+        (self.root / "MODULE.bazel").touch()
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.root)
+
+        self.host_bin = self.root / "host_bin"
+        self.host_bin.mkdir()
+        self.bash = self.host_bin / "bash"
+        self.bash.write_text("#!/bin/sh\n")
+        self.bash.chmod(0o755)
+        for tool in bazel._ACTION_HERMETIC_TOOLS:
+            (self.root / tool).parent.mkdir(parents=True, exist_ok=True)
+            (self.root / tool).touch()
+        patcher = mock.patch.dict(os.environ, {"PATH": str(self.host_bin)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _wrapper_resolves(self):
+        """Returns whether creating a wrapper looks up the host tools."""
+        with mock.patch.object(shutil, "which", wraps=shutil.which) as which:
+            wrapper = BazelWrapper(
+                kleaf_repo_dir=self.root,
+                bazel_args=["build", "--incompatible_hermetic_actions"],
+                env={})
+        self.path_dir = pathlib.Path(wrapper.env["PATH"])
+        return which.called
+
+    def test_cached(self):
+        self.assertTrue(self._wrapper_resolves())
+        self.assertEqual((self.path_dir / "bash").resolve(), self.bash)
+        self.assertFalse(self._wrapper_resolves())
+
+    def test_tool_added_to_path(self):
+        self._wrapper_resolves()
+        (self.host_bin / "git").symlink_to(self.bash)
+        self.assertTrue(self._wrapper_resolves())
+        self.assertEqual((self.path_dir / "git").resolve(), self.bash)
+
+    def test_target_changed(self):
+        self._wrapper_resolves()
+        os.utime(self.bash, ns=(0, 0))
+        self.assertTrue(self._wrapper_resolves())
+
+    def test_tool_deleted(self):
+        self._wrapper_resolves()
+        (self.path_dir / "bash").unlink()
+        self.assertTrue(self._wrapper_resolves())
+        self.assertTrue((self.path_dir / "bash").is_symlink())
+
+    def test_broken_link(self):
+        self._wrapper_resolves()
+        cat = self.path_dir / "cat"
+        cat.unlink()
+        cat.symlink_to(self.root / "gone")
+        self.assertTrue(self._wrapper_resolves())
+        self.assertEqual(cat.resolve(),
+                         self.root / bazel._ACTION_HERMETIC_TOOLS[0])
+
+
+class OutputMutatorTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.allowlist = pathlib.Path(tmp.name) / "allowlist"
+        self.allowlist.write_text(
+            "# comment\n^INFO: .*$\n^(a+)b\\1$\n^$\n")
+        # Make the stream be read in small chunks.
+        patcher = mock.patch.object(OutputMutator, "_CHUNK_SIZE", 7)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _mutate(self, mutator: OutputMutator, data: bytes) -> bytes:
+        output = io.TextIOWrapper(io.BytesIO())
+
+        async def mutate():
+            stream = asyncio.StreamReader()
+            stream.feed_data(data)
+            stream.feed_eof()
+            await mutator.mutate_stream(stream, output, "stdout")
+
+        asyncio.run(mutate())
+        return output.buffer.getvalue()
+
+    def test_passthrough(self):
+        data = b"abc\ndef\xff\nno newline"
+        mutator = OutputMutator(filter_regex=None, regex_allowlist_path=None)
+        self.assertEqual(self._mutate(mutator, data), data)
+
+    def test_filter(self):
+        mutator = OutputMutator(
+            filter_regex=re.compile(rb"/out/\S+?/execroot/__main__/"),
+            regex_allowlist_path=None)
+        self.assertEqual(
+            self._mutate(mutator,
+                         b"ERROR: /out/abcdef/execroot/__main__/common/a.c\n"
+                         b"/out/x/execroot/__main__/b.c /out/y/execroot/__main__/c"),
+            b"ERROR: common/a.c\nb.c c")
+
+    def test_allowlist(self):
+        mutator = OutputMutator(filter_regex=None,
+                                regex_allowlist_path=self.allowlist)
+        data = b"INFO: Build completed\n\naabaa\nINFO: \xff\n"
+        self.assertEqual(self._mutate(mutator, data), data)
+
+    def test_unexpected_lines(self):
+        mutator = OutputMutator(filter_regex=None,
+                                regex_allowlist_path=self.allowlist)
+        with self.assertRaises(UnexpectedOutputLinesException) as context:
+            self._mutate(mutator, b"INFO: a\nWARNING: b\naaba\nINFO: c\nd")
+        self.assertIn("Found 3 unexpected lines in stdout",
+                      context.exception.message)
+        self.assertIn("WARNING: b", context.exception.message)
+
+    def test_combined_allowlist(self):
+        mutator = OutputMutator(filter_regex=None,
+                                regex_allowlist_path=self.allowlist)
+        # The backreference is kept apart from the others.
+        self.assertEqual(
+            [regex.pattern for regex in mutator._regex_allowlist],
+            ["(?:^INFO: .*$)|(?:^$)", r"^(a+)b\1$"])
+
+    def test_allowlist_unicode(self):
+        self.allowlist.write_text("^\\w+$\n^[é]\\s.$\n", encoding="utf-8")
+        mutator = OutputMutator(filter_regex=None,
+                                regex_allowlist_path=self.allowlist)
+        data = "héllo\né\u00a0x\n".encode()
+        self.assertEqual(self._mutate(mutator, data), data)
+
+    def test_allowlist_inline_flags(self):
+        self.allowlist.write_text("(?i)^info$\n^debug$\n")
+        mutator = OutputMutator(filter_regex=None,
+                                regex_allowlist_path=self.allowlist)
+        self.assertEqual(len(mutator._regex_allowlist), 2)
+        self.assertEqual(self._mutate(mutator, b"INFO\ndebug\n"),
+                         b"INFO\ndebug\n")
+
+
+if __name__ == "__main__":
+    absltest.main()
@@ -0,0 +1,184 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how fast the Bazel wrapper filters the output of Bazel.
+
+Synthetic Bazel output is streamed through OutputMutator, as with
+--strip_execroot and --stdout_stderr_regex_allowlist, and the throughput is
+reported.
+
+Usage:
+
+    benchmark_output_mutator --megabytes 512
+"""
+
+import argparse
+import asyncio
+import pathlib
+import re
+import sys
+import tempfile
+import time
+
+from bazel import OutputMutator, UnexpectedOutputLinesException
+
+_OUTPUT_ROOT = "/workspace/out"
+_EXECROOT = (_OUTPUT_ROOT +
+             "/bazel/output_user_root/0123456789abcdef/execroot/__main__/")
+
+# Lines typical of a verbose build, e.g. --config=local with -s.
+_LINES = (
+    "INFO: From Building {i} (kernel_aarch64_{i}):",
+    "  CC      drivers/misc/file_{i}.o",
+    "  clang -Wp,-MMD,drivers/misc/.file_{i}.o.d -nostdinc "
+    "-I{execroot}common/arch/arm64/include -I{execroot}common/include "
+    "-D__KERNEL__ -O2 -c -o drivers/misc/file_{i}.o "
+    "{execroot}common/drivers/misc/file_{i}.c",
+    "{execroot}common/drivers/misc/file_{i}.c:{i}:5: warning: unused "
+    "variable 'x' [-Wunused-variable]",
+    "[{i} / 20,000] Compiling drivers/misc/file_{i}.c; 3s remote-cache",
+    "",
+)
+
+# Allowlist matching all of the lines above.
+_ALLOWLIST = (
+    "^INFO: .*$",
+    "^  CC .*$",
+    "^  clang .*$",
+    r"^\S+:\d+:\d+: warning: .*$",
+    r"^\[[\d,]+ / [\d,]+\] .*$",
+    "^$",
+)
+
+# Bytes fed to the stream at once, like a pipe.
+_FEED_SIZE = 64 * 1024
+
+
+class _NullOutput:
+    """A sys.stdout lookalike counting what is written to it."""
+
+    def __init__(self):
+        self.buffer = self
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.size += len(data)
+
+    def flush(self):
+        pass
+
+
+def _make_block(size: int) -> bytes:
+    """Returns about size bytes of synthetic Bazel output."""
+    lines = []
+    length = 0
+    i = 0
+    while length < size:
+        for line in _LINES:
+            line = line.format(i=i, execroot=_EXECROOT) + "\n"
+            lines.append(line)
+            length += len(line)
+        i += 1
+    return "".join(lines).encode()
+
+
+async def _stream(mutator: OutputMutator, block: bytes, repeat: int,
+                  output: _NullOutput):
+    stream = asyncio.StreamReader()
+
+    async def feed():
+        for _ in range(repeat):
+            for start in range(0, len(block), _FEED_SIZE):
+                stream.feed_data(block[start:start + _FEED_SIZE])
+                # Let the mutator run, like a pipe would.
+                await asyncio.sleep(0)
+        stream.feed_eof()
+
+    await asyncio.gather(
+        feed(), mutator.mutate_stream(stream, output, "stdout"))
+
+
+def benchmark(megabytes: int, strip_execroot: bool,
+              allowlist: pathlib.Path | None) -> dict:
+    """Streams megabytes of synthetic output through an OutputMutator.
+
+    Returns:
+        A dict with the input size, the output size, the number of lines and
+        the time it took.
+    """
+    filter_regex = None
+    if strip_execroot:
+        filter_regex = re.compile(re.escape(_OUTPUT_ROOT.encode()) +
+                                  rb"/\S+?/execroot/__main__/")
+    mutator = OutputMutator(filter_regex=filter_regex,
+                            regex_allowlist_path=allowlist)
+    block = _make_block(1024 * 1024)
+    repeat = max(1, megabytes)
+    output = _NullOutput()
+    unexpected = None
+    start = time.perf_counter()
+    try:
+        asyncio.run(_stream(mutator, block, repeat, output))
+    except UnexpectedOutputLinesException as exception:
+        unexpected = exception.message
+    seconds = time.perf_counter() - start
+    return {
+        "input_bytes": len(block) * repeat,
+        "output_bytes": output.size,
+        "lines": block.count(b"\n") * repeat,
+        "seconds": seconds,
+        "unexpected": unexpected,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--megabytes", type=int, default=256,
+        help="Amount of output to stream, in MiB (default: %(default)s)")
+    parser.add_argument(
+        "--nostrip_execroot", dest="strip_execroot", action="store_false",
+        help="Do not strip the execroot, as without --strip_execroot")
+    parser.add_argument(
+        "--allowlist", type=pathlib.Path,
+        help="--stdout_stderr_regex_allowlist file; default is one that "
+             "allows all the synthetic output")
+    parser.add_argument(
+        "--noallowlist", dest="use_allowlist", action="store_false",
+        help="Do not check lines against an allowlist")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        allowlist = None
+        if args.use_allowlist:
+            allowlist = args.allowlist
+            if allowlist is None:
+                allowlist = pathlib.Path(tmp) / "allowlist"
+                allowlist.write_text("\n".join(_ALLOWLIST) + "\n")
+        result = benchmark(args.megabytes, args.strip_execroot, allowlist)
+
+    mib = result["input_bytes"] / 1024 / 1024
+    print(f"{mib:.0f} MiB, {result['lines']} lines in "
+          f"{result['seconds']:.2f}s: {mib / result['seconds']:.1f} MiB/s, "
+          f"{result['lines'] / result['seconds']:.0f} lines/s")
+    if result["unexpected"]:
+        print(result["unexpected"])
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -54,16 +54,28 @@ import buildozer_command_builder
 import collections
 import dataclasses
 import logging
+import module_symvers
 import re
 import subprocess
 import sys
 import pathlib
 from typing import Sequence
 
-_MODULE_SYMBOL_PATTERN = r'^0x[0-9a-f]+\s+([_a-zA-Z][_a-zA-Z0-9]*)\s+(\S+)\s+EXPORT_SYMBOL(_GPL)?\s*$'
+_EXPORT_TYPES = frozenset(["EXPORT_SYMBOL", "EXPORT_SYMBOL_GPL"])
 _MODPOST_ERROR_PATTERN = r'modpost: "([_a-zA-Z][_a-zA-Z0-9]*)" \[(\S*)] undefined!'
 
 
+def _module_exports(symvers_path: pathlib.Path) -> list[tuple[str, str]]:
+    """Returns the (symbol, object) exports of a Module.symvers file.
+
+    Only EXPORT_SYMBOL and EXPORT_SYMBOL_GPL exports outside of a namespace
+    are returned.
+    """
+    symvers = module_symvers.ModuleSymvers.load(symvers_path, use_index=True)
+    return [(entry.symbol, entry.object) for entry in symvers.entries()
+            if entry.export_type in _EXPORT_TYPES and not entry.namespace]
+
+
 class BuildCleanerError(Exception):
     pass
 
@@ -187,14 +199,12 @@ class DdkCleaner(SingleCleaner):
 
         for target in kernel_module_targets:
             logging.info("Looking up symbols for %s", target)
-            with open(target.module_symvers_path()) as f:
-                for line in f.readlines():
-                    for mo in re.finditer(_MODULE_SYMBOL_PATTERN, line):
-                        symbol = mo.group(1)
-                        symbols[symbol].append(SymbolLocation(
-                            target=target,
-                            module_file=mo.group(2),
-                        ))
+            for symbol, module_file in _module_exports(
+                    target.module_symvers_path()):
+                symbols[symbol].append(SymbolLocation(
+                    target=target,
+                    module_file=module_file,
+                ))
 
         errors = []
 
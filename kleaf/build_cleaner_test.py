@@ -25,6 +25,7 @@
 # TODO(b/257176147): Add this test to kernel_aarch64_additional_tests
 
 import os
+import pathlib
 import tempfile
 import unittest
 
@@ -76,5 +77,22 @@ class DdkModuleDepTest(BuildCleanerTest):
             str(cm.exception))
 
 
+class ModuleExportsTest(unittest.TestCase):
+    def test_module_exports(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp) / "Module.symvers"
+            path.write_text(
+                "0x1\tfoo\tdrivers/foo\tEXPORT_SYMBOL\t\n"
+                "0x2\tbar\tdrivers/foo\tEXPORT_SYMBOL_GPL\t\n"
+                "0x3\tns\tdrivers/foo\tEXPORT_SYMBOL_GPL\tMY_NS\n"
+                "0x4\tfut\tdrivers/foo\tEXPORT_SYMBOL_GPL_FUTURE\t\n")
+            # Namespaced exports are not considered, like the regex that
+            # build_cleaner used to match lines with.
+            self.assertEqual(build_cleaner._module_exports(path), [
+                ("foo", "drivers/foo"),
+                ("bar", "drivers/foo"),
+            ])
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
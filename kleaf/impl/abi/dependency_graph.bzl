@@ -26,6 +26,9 @@ load(":utils.bzl", "kernel_utils", "utils")
 
 visibility("//build/kernel/kleaf/...")
 
+def _basename(file):
+    return file.basename
+
 def _dependency_graph_extractor_impl(ctx):
     out = ctx.actions.declare_file("{}/dependency_graph.json".format(ctx.attr.name))
     intermediates_dir = utils.intermediates_dir(ctx)
@@ -66,11 +69,21 @@ def _dependency_graph_extractor_impl(ctx):
             tar xf {base_modules_archive} -C {intermediates_dir}/temp
             find {intermediates_dir}/temp -name '*.ko' -exec mv -t {intermediates_dir} {{}} \\;
             rm -rf {intermediates_dir}/temp
+            # The modules of the archive are not known ahead; list them from its index.
+            tar tf {base_modules_archive} | {{ grep '\\.ko$' || true; }} | sed 's#^.*/##; s#^#{intermediates_dir}/#' > {intermediates_dir}.binaries
         """.format(
             base_modules_archive = base_modules_archive.path,
             intermediates_dir = intermediates_dir,
         )
 
+    # The staging directory is flat; list where the inputs end up there.
+    srcs_manifest = ctx.actions.declare_file("{}/srcs_manifest".format(ctx.attr.name))
+    srcs_manifest_args = ctx.actions.args()
+    srcs_manifest_args.set_param_file_format("multiline")
+    srcs_manifest_args.add_all(srcs, map_each = _basename, format_each = intermediates_dir + "/%s")
+    ctx.actions.write(srcs_manifest, srcs_manifest_args)
+    inputs.append(srcs_manifest)
+
     command = kernel_utils.setup_serialized_env_cmd(
         serialized_env_info = ctx.attr.kernel_build[KernelSerializedEnvInfo],
         restore_out_dir_cmd = utils.get_check_sandbox_cmd(),
@@ -81,14 +94,18 @@ def _dependency_graph_extractor_impl(ctx):
         {base_modules_archive_cmd}
         # Copy other inputs including vendor modules; This will overwrite modules being overridden.
         cp -pfl {srcs} {intermediates_dir}
-        {dependency_graph_extractor} {intermediates_dir} {output}
-        rm -rf {intermediates_dir}
+        # List the binaries instead of letting the tool walk the directory.
+        cat {srcs_manifest} >> {intermediates_dir}.binaries
+        LC_ALL=C sort -u -o {intermediates_dir}.binaries {intermediates_dir}.binaries
+        {dependency_graph_extractor} --binaries-from {intermediates_dir}.binaries {intermediates_dir} {output}
+        rm -rf {intermediates_dir} {intermediates_dir}.binaries
     """.format(
         srcs = " ".join([file.path for file in srcs]),
         intermediates_dir = intermediates_dir,
         dependency_graph_extractor = ctx.executable._dependency_graph_extractor.path,
         output = out.path,
         base_modules_archive_cmd = base_modules_archive_cmd,
+        srcs_manifest = srcs_manifest.path,
     )
     debug.print_scripts(ctx, command)
     ctx.actions.run_shell(
@@ -151,6 +168,10 @@ def _dependency_graph_drawer_impl(ctx):
     flags = []
     if ctx.attr.colorful:
         flags.append("--colors")
+    if not ctx.attr.transitive_reduction:
+        flags.append("--no-reduce")
+    if ctx.attr.max_edges:
+        flags.append("--max-edges={}".format(ctx.attr.max_edges))
 
     command = """
         {dependency_graph_drawer} {input} {output} {flags}
@@ -182,12 +203,10 @@ dependency_graph_drawer = rule(
       * Outputs:
         A `dependency_graph.dot` file containing the diagram representation.
 
-      * NOTE: For further simplification of the resulting diagram
-        [tred utility](https://graphviz.org/docs/cli/tred/) from the CLI can
-        be used as in the following example:
-        ```
-        tred dependency_graph.dot > simplified.dot
-        ```
+      * NOTE: Edges implied by other paths are not drawn, as with the
+        [tred utility](https://graphviz.org/docs/cli/tred/), unless
+        `transitive_reduction` is `False`. Use `max_edges` to bound the size
+        of large diagrams.
 
       * Example:
         ```
@@ -202,6 +221,13 @@ dependency_graph_drawer = rule(
         "colorful": attr.bool(
             doc = "Whether outgoing edges from every node are colored.",
         ),
+        "transitive_reduction": attr.bool(
+            doc = "Whether edges implied by other paths are omitted.",
+            default = True,
+        ),
+        "max_edges": attr.int(
+            doc = "If positive, the maximum number of edges to draw.",
+        ),
         "_dependency_graph_drawer": attr.label(
             default = "//build/kernel:dependency_graph_drawer",
             cfg = "exec",
@@ -217,6 +243,7 @@ def dependency_graph(
         kernel_modules,
         colorful = None,
         exclude_base_kernel_modules = None,
+        max_edges = None,
         **kwargs):
     """Declare targets for dependency graph visualization.
 
@@ -229,6 +256,7 @@ def dependency_graph(
         kernel_modules: A list of external [`kernel_module()`](#kernel_module)s.
         colorful: When set to True, outgoing edges from every node are colored differently.
         exclude_base_kernel_modules: Whether the analysis should made for only external modules.
+        max_edges: If positive, the maximum number of edges to draw.
         **kwargs: Additional attributes to the internal rule, e.g.
           [`visibility`](https://docs.bazel.build/versions/main/visibility.html).
           See complete list
@@ -248,6 +276,7 @@ def dependency_graph(
         name = name + "_drawer",
         adjacency_list = name + "_extractor",
         colorful = colorful,
+        max_edges = max_edges,
     )
 
     native.filegroup(
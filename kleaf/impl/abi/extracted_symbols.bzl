@@ -26,6 +26,9 @@ load(":utils.bzl", "kernel_utils", "utils")
 
 visibility("//build/kernel/kleaf/...")
 
+def _basename(file):
+    return file.basename
+
 def _extracted_symbols_impl(ctx):
     if ctx.attr.kernel_build[KernelBuildAbiInfo].trim_nonlisted_kmi:
         fail("{}: Requires `kernel_build` {} to have `trim_nonlisted_kmi = False`.".format(
@@ -82,6 +85,14 @@ def _extracted_symbols_impl(ctx):
         base_modules_archive = ctx.attr.kernel_build[KernelBuildAbiInfo].modules_staging_archive
     inputs.append(base_modules_archive)
 
+    # The staging directory is flat; list where the inputs end up there.
+    srcs_manifest = ctx.actions.declare_file("{}/srcs_manifest".format(ctx.attr.name))
+    srcs_manifest_args = ctx.actions.args()
+    srcs_manifest_args.set_param_file_format("multiline")
+    srcs_manifest_args.add_all(srcs, map_each = _basename, format_each = intermediates_dir + "/%s")
+    ctx.actions.write(srcs_manifest, srcs_manifest_args)
+    inputs.append(srcs_manifest)
+
     command = kernel_utils.setup_serialized_env_cmd(
         serialized_env_info = ctx.attr.kernel_build[KernelSerializedEnvInfo],
         restore_out_dir_cmd = utils.get_check_sandbox_cmd(),
@@ -98,8 +109,14 @@ def _extracted_symbols_impl(ctx):
         # Copy other inputs including vendor modules; this will overwrite modules being overridden
         cp -pfl {srcs} {intermediates_dir}
         {cp_src_cmd}
-        {extract_symbols} {flags} {intermediates_dir}
-        rm -rf {intermediates_dir}
+        # List the binaries instead of letting the tool walk the directory. Only the GKI
+        # modules are not known ahead; they are listed from the archive index.
+        {{
+            tar tf {base_modules_archive} | {{ grep '\\.ko$' || true; }} | sed 's#^.*/##; s#^#{intermediates_dir}/#'
+            cat {srcs_manifest}
+        }} | LC_ALL=C sort -u > {intermediates_dir}.binaries
+        {extract_symbols} {flags} --binaries-from {intermediates_dir}.binaries {intermediates_dir}
+        rm -rf {intermediates_dir} {intermediates_dir}.binaries
     """.format(
         srcs = " ".join([file.path for file in srcs]),
         intermediates_dir = intermediates_dir,
@@ -107,6 +124,7 @@ def _extracted_symbols_impl(ctx):
         flags = " ".join(flags),
         cp_src_cmd = cp_src_cmd,
         base_modules_archive = base_modules_archive.path,
+        srcs_manifest = srcs_manifest.path,
     )
     debug.print_scripts(ctx, command)
     ctx.actions.run_shell(
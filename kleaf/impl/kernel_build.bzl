@@ -2540,10 +2540,14 @@ def _kmi_symbol_list_violations_check(ctx, modules_staging_archive):
     command += """
         mkdir -p {intermediates_dir}
         tar xf {modules_staging_archive} -C {intermediates_dir}
+        # Only the modules in the archive are checked; list them from the archive index.
+        # The archive may have no modules at all, which grep reports as a failure.
+        tar tf {modules_staging_archive} | {{ grep '\\.ko$' || true; }} | sed 's#^#{intermediates_dir}/#' > {intermediates_dir}.binaries
         {check_symbol_protection} \\
             --abi-symbol-list {raw_kmi_symbol_list} \\
+            --binaries-from {intermediates_dir}.binaries \\
             {intermediates_dir}
-        rm -rf {intermediates_dir}
+        rm -rf {intermediates_dir} {intermediates_dir}.binaries
         touch {out}
     """.format(
         check_symbol_protection = ctx.executable._check_symbol_protection.path,
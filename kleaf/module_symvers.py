@@ -0,0 +1,193 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reader for Module.symvers files.
+
+Each line of Module.symvers describes one exported symbol:
+
+    <CRC>\t<symbol>\t<object>\t<export type>\t<namespace>
+
+Older kernels omit the namespace column. Loading only splits the file into
+lines; the columns are split while going through them, and the symbol ->
+entry lookup is created on first use. This keeps filtering the exported
+symbols as cheap as a single pass over the file: holding tens of thousands of
+split rows or entry objects at once makes the garbage collector walk them
+repeatedly.
+
+The exported symbols, grouped by object and export type, can be stored next
+to the file (`Module.symvers.idx`) with the contents of the file, so that
+later readers need a single read and no pass over the lines to filter them.
+The stored index is ignored once Module.symvers changes size or mtime.
+"""
+
+import json
+import os
+import pathlib
+from typing import Iterable, Iterator, NamedTuple
+
+INDEX_SUFFIX = ".idx"
+# Bump when the layout of the stored index changes.
+_INDEX_VERSION = 2
+
+
+class SymversEntry(NamedTuple):
+    """A symbol exported according to Module.symvers."""
+    crc: str
+    symbol: str
+    object: str
+    export_type: str
+    namespace: str = ""
+
+
+class ModuleSymvers:
+    """The entries of Module.symvers files, with a lookup by symbol."""
+
+    def __init__(self, entries: Iterable[SymversEntry] = ()):
+        self._lines = ["\t".join(entry) for entry in entries]
+        # The contents of the file, when loaded from an index and not split
+        # into _lines yet.
+        self._text: str | None = None
+        # object -> export type -> symbols, when loaded from an index.
+        self._exports: dict[str, dict[str, list[str]]] | None = None
+        self._by_symbol: dict[str, SymversEntry] | None = None
+
+    @staticmethod
+    def parse(text: str) -> list[SymversEntry]:
+        """Parses the contents of a Module.symvers file."""
+        symvers = ModuleSymvers()
+        symvers._lines = text.splitlines()
+        return list(symvers.entries())
+
+    @classmethod
+    def load(cls, path: pathlib.Path | str,
+             use_index: bool = False) -> "ModuleSymvers":
+        """Loads a Module.symvers file.
+
+        Args:
+            path: The Module.symvers file.
+            use_index: If true, load the index stored next to path when it is
+                up to date, and store it there otherwise (if possible).
+        """
+        path = pathlib.Path(path)
+        symvers = cls()
+        if not use_index:
+            symvers._lines = path.read_text().splitlines()
+            return symvers
+
+        # Stat before reading, so that a change while reading makes the
+        # stored index stale rather than wrong.
+        stat = path.stat()
+        stamp = [_INDEX_VERSION, stat.st_size, stat.st_mtime_ns]
+        index_path = path.with_name(path.name + INDEX_SUFFIX)
+        try:
+            header, _, text = index_path.read_text().partition("\n")
+            stored_stamp, exports = json.loads(header)
+            if stored_stamp == stamp and isinstance(exports, dict):
+                symvers._text = text
+                symvers._exports = exports
+                return symvers
+        except (OSError, ValueError, TypeError):
+            pass
+
+        symvers._lines = path.read_text().splitlines()
+        try:
+            symvers.save_index(index_path, stamp)
+        except OSError:
+            pass  # e.g. a read-only output directory; just don't cache.
+        return symvers
+
+    def save_index(self, index_path: pathlib.Path, stamp: list) -> None:
+        """Atomically writes the index, stamped with stamp, to index_path."""
+        exports: dict[str, dict[str, list[str]]] = {}
+        for fields in self._rows():
+            exports.setdefault(fields[2], {}).setdefault(
+                fields[3], []).append(fields[1])
+        header = json.dumps([stamp, exports], separators=(",", ":"))
+        tmp = index_path.with_name(f".{index_path.name}.{os.getpid()}")
+        tmp.write_text("\n".join([header] + self._get_lines()))
+        os.replace(tmp, index_path)
+
+    def _get_lines(self) -> list[str]:
+        if self._text is not None:
+            self._lines = self._text.splitlines()
+            self._text = None
+        return self._lines
+
+    def _rows(self) -> Iterator[list[str]]:
+        """Yields the columns of every well-formed line."""
+        for line in self._get_lines():
+            fields = line.split("\t")
+            if len(fields) >= 4:
+                yield fields
+
+    def _lookup(self) -> dict[str, SymversEntry]:
+        if self._by_symbol is None:
+            self._by_symbol = {}
+            for fields in self._rows():
+                # A symbol is only exported once; keep the first definition
+                # like modpost does.
+                if fields[1] not in self._by_symbol:
+                    self._by_symbol[fields[1]] = SymversEntry(*fields[:5])
+        return self._by_symbol
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._lookup()
+
+    def __len__(self) -> int:
+        return len(self._lookup())
+
+    def get(self, symbol: str) -> SymversEntry | None:
+        """Returns the first entry for symbol, or None if it is not exported."""
+        return self._lookup().get(symbol)
+
+    def entries(self) -> Iterator[SymversEntry]:
+        """Yields every entry in file order, including repeated symbols."""
+        for fields in self._rows():
+            yield SymversEntry(*fields[:5])
+
+    def exported_symbols(
+        self,
+        objects: Iterable[str] | None = None,
+        export_type_prefix: str = "EXPORT_SYMBOL",
+    ) -> set[str]:
+        """Returns the exported symbols, optionally only from some objects.
+
+        Every entry is considered, not only the first one of each symbol.
+
+        Args:
+            objects: If set, only symbols exported by these objects (e.g.
+                "vmlinux") are returned.
+            export_type_prefix: Only symbols whose export type starts with
+                this prefix are returned.
+        """
+        objects = None if objects is None else frozenset(objects)
+        symbols = set()
+        if self._exports is not None:
+            for object_, groups in self._exports.items():
+                if objects is not None and object_ not in objects:
+                    continue
+                for export_type, group in groups.items():
+                    if export_type.startswith(export_type_prefix):
+                        symbols.update(group)
+            return symbols
+
+        # Like _rows(), inlined as this is the hot path. Columns: crc, symbol,
+        # object, export type[, namespace].
+        for line in self._lines:
+            fields = line.split("\t", 4)
+            if (len(fields) >= 4 and
+                    fields[3].startswith(export_type_prefix) and
+                    (objects is None or fields[2] in objects)):
+                symbols.add(fields[1])
+        return symbols
@@ -0,0 +1,119 @@
+# Copyright (C) 2024 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pathlib
+import tempfile
+import unittest
+
+from absl.testing import absltest
+from module_symvers import ModuleSymvers, SymversEntry, INDEX_SUFFIX
+
+_SYMVERS = """\
+0x12345678\tfoo\tvmlinux\tEXPORT_SYMBOL\t
+0x9abcdef0\tbar\tvmlinux\tEXPORT_SYMBOL_GPL\tMY_NS
+0x00000000\tbaz\tdrivers/baz\tEXPORT_SYMBOL_GPL
+0x00000001\tqux\tvmlinux\tEXPORT_SYMBOL_GPL_FUTURE\t
+malformed line
+"""
+
+
+class ModuleSymversTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = pathlib.Path(self.tmp.name) / "Module.symvers"
+        self.path.write_text(_SYMVERS)
+
+    def test_parse(self):
+        symvers = ModuleSymvers.load(self.path)
+        self.assertEqual(len(symvers), 4)
+        self.assertEqual(symvers.get("bar"), SymversEntry(
+            symbol="bar", object="vmlinux", export_type="EXPORT_SYMBOL_GPL",
+            namespace="MY_NS", crc="0x9abcdef0"))
+        self.assertEqual(symvers.get("baz").namespace, "")
+        self.assertIsNone(symvers.get("malformed"))
+        self.assertIn("foo", symvers)
+
+    def test_exported_symbols(self):
+        symvers = ModuleSymvers.load(self.path)
+        self.assertEqual(symvers.exported_symbols(),
+                         {"foo", "bar", "baz", "qux"})
+        self.assertEqual(symvers.exported_symbols(objects=["vmlinux"]),
+                         {"foo", "bar", "qux"})
+        self.assertEqual(symvers.exported_symbols(objects=["drivers/baz"]),
+                         {"baz"})
+        self.assertEqual(symvers.exported_symbols(objects=[]), set())
+
+    def test_repeated_symbol(self):
+        self.path.write_text(
+            "0x1\tdup\tdrivers/a\tEXPORT_SYMBOL\t\n"
+            "0x2\tdup\tdrivers/b\tEXPORT_SYMBOL\t\n")
+        symvers = ModuleSymvers.load(self.path)
+        self.assertEqual(len(symvers), 1)
+        self.assertEqual(symvers.get("dup").object, "drivers/a")
+        self.assertEqual(symvers.exported_symbols(objects=["drivers/b"]),
+                         {"dup"})
+        self.assertEqual([entry.object for entry in symvers.entries()],
+                         ["drivers/a", "drivers/b"])
+
+    def test_entries(self):
+        self.assertEqual(list(ModuleSymvers.load(self.path).entries()),
+                         ModuleSymvers.parse(_SYMVERS))
+        self.assertEqual(
+            list(ModuleSymvers(ModuleSymvers.parse(_SYMVERS)).entries()),
+            ModuleSymvers.parse(_SYMVERS))
+
+    def test_index(self):
+        index = pathlib.Path(str(self.path) + INDEX_SUFFIX)
+        expected = ModuleSymvers.load(self.path)
+        self.assertFalse(index.exists())
+
+        ModuleSymvers.load(self.path, use_index=True)
+        self.assertTrue(index.exists())
+        # The stored index is used as long as Module.symvers is unchanged.
+        stat = self.path.stat()
+        self.path.write_text(_SYMVERS.replace("foo", "FOO"))
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        symvers = ModuleSymvers.load(self.path, use_index=True)
+        for objects in (None, ["vmlinux"], ["drivers/baz"], []):
+            self.assertEqual(symvers.exported_symbols(objects=objects),
+                             expected.exported_symbols(objects=objects))
+        self.assertEqual(
+            symvers.exported_symbols(export_type_prefix="EXPORT_SYMBOL_GPL"),
+            {"bar", "baz", "qux"})
+        self.assertEqual(list(symvers.entries()), list(expected.entries()))
+        self.assertEqual(symvers.get("bar"), expected.get("bar"))
+
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertIn("FOO", ModuleSymvers.load(self.path, use_index=True))
+        self.assertIn("FOO", ModuleSymvers.load(
+            self.path, use_index=True).exported_symbols())
+
+    def test_corrupt_index(self):
+        index = pathlib.Path(str(self.path) + INDEX_SUFFIX)
+        for content in ("garbage", "[1, 2]\n", "[[2, 0, 0], []]\n"):
+            index.write_text(content)
+            self.assertEqual(
+                ModuleSymvers.load(self.path, use_index=True)
+                .exported_symbols(), {"foo", "bar", "baz", "qux"})
+
+    def test_unwritable_index(self):
+        index = pathlib.Path(str(self.path) + INDEX_SUFFIX)
+        index.mkdir()
+        self.assertIn("foo", ModuleSymvers.load(self.path, use_index=True))
+
+
+if __name__ == '__main__':
+    absltest.main()